@@ -1,5 +1,98 @@
 -- Add Docker container metadata to log records
 -- This script extracts container ID from the file path and uses tag to get container info
+--
+-- Container names come from the map that selfhost_scripts/container_metadata_map.py maintains
+-- (tab-separated lines of: container id, container name, compose service label, after a first
+-- line with a hash of the content). It is checked every few seconds and only reloaded when its
+-- size or hash line changed, so no file is read per record.
+-- Containers missing from the map fall back to reading config.v2.json, once per container.
+--
+-- service_name is the service part of a swarm container name (stackname_servicename.instance.taskid).
+-- With SERVICE_NAME_FROM_COMPOSE_LABEL=1 in fluent-bit's environment, the com.docker.compose.service
+-- label is used instead where a container has one, as log_formatter --docker-logs names services;
+-- ship-logs-to-opensearch.py --compose-service-names does the same for backfilled documents.
+
+local map_file = os.getenv("CONTAINER_MAP_FILE") or "/fluent-bit/metadata/container-map.tsv"
+local reload_interval = 5
+local service_from_compose_label = os.getenv("SERVICE_NAME_FROM_COMPOSE_LABEL") == "1"
+
+local containers = {}
+local last_check = nil
+local loaded_stamp = nil
+
+local function service_name(container_name, compose_service)
+    if service_from_compose_label and compose_service then
+        return compose_service
+    end
+    return string.match(container_name, "^[^_]+_([^%.]+)")
+end
+
+local function map_stamp(file)
+    -- the size and the first line, which holds a hash of the content
+    local size = file:seek("end")
+    file:seek("set", 0)
+    return tostring(size) .. " " .. (file:read("*l") or "")
+end
+
+local function load_container_map()
+    last_check = os.time()
+    local file = io.open(map_file, "r")
+    if not file then
+        -- keep what we have (including fallback lookups) until the map exists
+        return
+    end
+    local stamp = map_stamp(file)
+    if stamp == loaded_stamp then
+        file:close()
+        return
+    end
+    file:seek("set", 0)
+    local loaded = {}
+    for line in file:lines() do
+        local id, name, compose_service = string.match(line, "^([^\t]+)\t([^\t]*)\t?([^\t]*)$")
+        if id then
+            loaded[id] = { name = name, service = service_name(name, compose_service ~= "" and compose_service or nil) }
+        end
+    end
+    file:close()
+    containers = loaded
+    loaded_stamp = stamp
+end
+
+local function read_container_config(container_id)
+    -- Try to read container name from Docker config.v2.json
+    -- This file contains container metadata including name
+    local config_file = "/var/lib/docker/containers/" .. container_id .. "/config.v2.json"
+    local file = io.open(config_file, "r")
+    if not file then
+        return nil
+    end
+    local content = file:read("*a")
+    file:close()
+
+    -- Extract container name using pattern matching
+    -- Look for "Name":"/<container_name>"
+    local container_name = string.match(content, '"Name":"/?([^"]+)"')
+    if not container_name then
+        return nil
+    end
+    local compose_service = string.match(content, '"com%.docker%.compose%.service":"([^"]+)"')
+    return { name = container_name, service = service_name(container_name, compose_service) }
+end
+
+local function lookup_container(container_id)
+    if last_check == nil or os.time() - last_check >= reload_interval then
+        load_container_map()
+    end
+    local info = containers[container_id]
+    if info == nil then
+        info = read_container_config(container_id)
+        if info then
+            containers[container_id] = info
+        end
+    end
+    return info
+end
 
 function add_container_metadata(tag, timestamp, record)
     -- Try to get container ID from multiple possible sources
@@ -26,28 +119,11 @@ function add_container_metadata(tag, timestamp, record)
     record["container_id_full"] = container_id
     record["container_id"] = string.sub(container_id, 1, 12)
 
-    -- Try to read container name from Docker config.v2.json
-    -- This file contains container metadata including name
-    local config_file = "/var/lib/docker/containers/" .. container_id .. "/config.v2.json"
-    local file = io.open(config_file, "r")
-
-    if file then
-        local content = file:read("*a")
-        file:close()
-
-        -- Extract container name using pattern matching
-        -- Look for "Name":"/<container_name>"
-        local container_name = string.match(content, '"Name":"/?([^"]+)"')
-
-        if container_name then
-            record["container_name"] = container_name
-
-            -- Extract service name from Swarm container name
-            -- Format: stackname_servicename.instance.taskid
-            local service_name = string.match(container_name, "^[^_]+_([^%.]+)")
-            if service_name then
-                record["service_name"] = service_name
-            end
+    local info = lookup_container(container_id)
+    if info then
+        record["container_name"] = info.name
+        if info.service then
+            record["service_name"] = info.service
         end
     end
 
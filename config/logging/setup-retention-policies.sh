@@ -115,6 +115,8 @@ main() {
     echo "========================================="
     echo ""
     echo "The 30-day policy is automatically applied to all 'logs-*' indices."
+    echo "selfhost_scripts/plan-log-retention.py --apply adds logs-planned-short-policy and logs-planned-long-policy,"
+    echo "sized to the disk; their index templates take precedence over the 30-day policy for new indices."
     echo ""
     echo "To manually apply a different policy to specific indices:"
     echo "  curl -X POST http://${OPENSEARCH_HOST}/_plugins/_ism/add/logs-pds-* \\"
@@ -7,7 +7,10 @@ allowing easy switching between different configurations.
 """
 
 import argparse
+import hashlib
+import json
 import os
+import shutil
 import sys
 import types
 from pathlib import Path
@@ -22,6 +25,12 @@ sys.modules[__package__] = package_module
 
 from .selfhost_scripts.env_utils import get_all_env_paths, get_env_filename, get_profile_env_paths, get_existing_profile_names, validate_profile_name
 
+DERIVED_CACHE_DIR = Path(".params-cache")
+DERIVED_CACHE_MANIFEST = "manifest.json"
+
+# eas build profiles that google-services.*.json files are generated for
+GOOGLE_SERVICES_PROFILES = [None, "development", "preview", "testflight", "production"]
+
 def list_env_files():
     """List all available environment files with symlink targets."""
     param_files = list(Path.cwd().glob("*.env"))
@@ -86,8 +95,112 @@ def delete_env_links(profiles):
     return success
 
 
-def create_env_link(params_file, env_file):
-    """Create a symlink to the parameters file."""
+def get_derived_artifact_paths(profile):
+    """
+    Get the files that generate-env-files.sh and make derive from the given profile's .env file.
+
+    env-content files are left out: they are converted from the atproto JSON5 sources, not from the params file.
+    """
+    suffix = f".{profile}" if profile else ""
+    social_app = Path("repos/social-app")
+    paths = [
+        # social env
+        social_app / f".env{suffix}",
+        social_app / "bskyembed" / f".env{suffix}",
+    ]
+    if profile is None:
+        # shell snapshot that make derives from .env for caddy
+        paths.append(Path("config/caddy-dynamic.env"))
+    if profile == "production":
+        # branding and google-services are derived from the production profile's branding
+        paths.extend([social_app / "branding.json", social_app / "bskyweb/branding.json", social_app / "bskylink/branding.json"])
+        paths.extend(social_app / (f"google-services.{gs_profile}.json" if gs_profile else "google-services.json")
+                     for gs_profile in GOOGLE_SERVICES_PROFILES)
+    return paths
+
+
+def get_params_hash(params_path):
+    """Get a hash of the params file content, so edited params files don't restore stale derived files."""
+    with open(params_path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def get_derived_cache_path(profile, params_path):
+    """Get the cache directory for derived files of a profile when linked to a params file."""
+    return DERIVED_CACHE_DIR / (profile or "default") / Path(params_path).name
+
+
+def get_stale_derived_files(profile, params_path, linked_at=0):
+    """
+    Get the derived files of a profile that weren't generated from the current content of params_path:
+    those older than params_path, or than linked_at, when the profile was linked to it.
+    """
+    since = max(Path(params_path).stat().st_mtime, linked_at)
+    return [artifact_path for artifact_path in get_derived_artifact_paths(profile)
+            if artifact_path.is_file() and artifact_path.stat().st_mtime < since]
+
+
+def save_derived_cache(profile, params_path, linked_at=0):
+    """Snapshot the current derived files of a profile into the cache for its current params file."""
+    params_path = Path(params_path)
+    if not params_path.exists():
+        return False
+    if not any(artifact_path.is_file() for artifact_path in get_derived_artifact_paths(profile)):
+        # nothing was generated since this params file was linked
+        return False
+    # the hash is taken now, so only cache files generated since the params file last changed
+    stale_files = get_stale_derived_files(profile, params_path, linked_at)
+    if stale_files:
+        print(f"Not caching derived files for {profile or 'default'}: {', '.join(map(str, stale_files))} not regenerated since linking {params_path}")
+        return False
+    cache_path = get_derived_cache_path(profile, params_path)
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    staging_path = cache_path.with_name(f".{cache_path.name}.tmp-{os.getpid()}")
+    shutil.rmtree(staging_path, ignore_errors=True)
+    cached_files = []
+    for artifact_path in get_derived_artifact_paths(profile):
+        if artifact_path.is_file():
+            target = staging_path / "files" / artifact_path
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(artifact_path, target)
+            cached_files.append(str(artifact_path))
+    staging_path.mkdir(parents=True, exist_ok=True)
+    with (staging_path / DERIVED_CACHE_MANIFEST).open('w') as f:
+        json.dump({"params_hash": get_params_hash(params_path), "files": cached_files}, f, indent=2)
+    # swap the new snapshot in as a whole, so an interrupted save never leaves a half-written cache
+    old_path = cache_path.with_name(f".{cache_path.name}.old-{os.getpid()}")
+    if cache_path.exists():
+        cache_path.rename(old_path)
+    staging_path.rename(cache_path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    return True
+
+
+def restore_derived_cache(profile, params_path):
+    """Restore the derived files of a profile from the cache for params_path, if it is current."""
+    cache_path = get_derived_cache_path(profile, params_path)
+    try:
+        with (cache_path / DERIVED_CACHE_MANIFEST).open('r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if manifest.get("params_hash") != get_params_hash(params_path):
+        print(f"Cached derived files for {profile or 'default'} are from an older version of {params_path}; not restoring")
+        return False
+    cached_files = set(manifest.get("files", []))
+    for artifact_path in get_derived_artifact_paths(profile):
+        if str(artifact_path) in cached_files:
+            artifact_path.parent.mkdir(parents=True, exist_ok=True)
+            staging_path = artifact_path.with_name(f".{artifact_path.name}.tmp-{os.getpid()}")
+            # copied with a new mtime, so the restored files count as generated since the link was made
+            shutil.copy(cache_path / "files" / artifact_path, staging_path)
+            os.replace(staging_path, artifact_path)
+    print(f"Restored {len(cached_files)} cached derived file(s) for {profile or 'default'} from {cache_path}")
+    return True
+
+
+def create_env_link(params_file, env_file, profile=None, use_cache=False):
+    """Create a symlink to the parameters file, swapping in cached derived files if use_cache and available."""
     params_path = Path(params_file)
 
     # Check if the source file exists
@@ -96,9 +209,13 @@ def create_env_link(params_file, env_file):
         return False
 
     # Handle existing .env file/link
+    target = None
     if env_file.is_symlink():
         target = env_file.readlink()
         print(f"{env_file.name} was previously pointing to {target}")
+        if use_cache and target != params_path:
+            # only files generated since the link was made are from this target
+            save_derived_cache(profile, target, env_file.lstat().st_mtime)
         env_file.unlink()
     elif env_file.exists():
         print(f"Error: {env_file.name} is not a symlink: not removing, check and adjust manually")
@@ -108,10 +225,14 @@ def create_env_link(params_file, env_file):
     # Create the symlink
     env_file.symlink_to(params_path)
     os.system(f"ls -l {env_file}")
+    if use_cache and target != params_path and not restore_derived_cache(profile, params_path):
+        # the derived files on disk are left as they are; being older than the new link, they won't be cached for it
+        print(f"No cached derived files for {profile or 'default'}: the derived files are still from the previous target, "
+              "regenerate them with ./generate-env-files.sh")
     return True
 
 
-def create_env_links(params_file, profiles):
+def create_env_links(params_file, profiles, use_cache=False):
     """Create symlinks for specified profiles to the parameters file."""
     params_path = Path(params_file)
 
@@ -123,8 +244,8 @@ def create_env_links(params_file, profiles):
     env_files = get_profile_env_paths(profiles)
     success = True
 
-    for env_file in env_files:
-        success = success and create_env_link(params_file, env_file)
+    for profile, env_file in zip(profiles, env_files):
+        success = success and create_env_link(params_file, env_file, profile, use_cache)
     return success
 
 
@@ -188,6 +309,12 @@ def main():
         action='store_true',
         help='Apply command to all existing .env* files'
     )
+    parser.add_argument(
+        '--cache',
+        action='store_true',
+        help=f'Save the derived files (social env, google-services, branding, caddy env) generated from the previous target in {DERIVED_CACHE_DIR}, '
+             'and restore those of the new target if it has not changed since they were cached'
+    )
 
     args = parser.parse_args()
 
@@ -226,7 +353,7 @@ def main():
     # Handle showing current status
     if args.params_file:
         # Handle creating new symlink
-        if not create_env_links(args.params_file, profiles):
+        if not create_env_links(args.params_file, profiles, use_cache=args.cache):
             sys.exit(1)
     else:
         if not show_current_env(profiles):
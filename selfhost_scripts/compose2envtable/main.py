@@ -4,23 +4,33 @@
 make table of envs x containers x its value from docker-composer.yaml
 
 required 3rd party packages
-pydantic v2
-pandas
+pandas (and numpy)
+pydantic v2 (optional, only to serialize EnvVal with EnvVal.model_dump)
 openpyxl (optional, output to excel)
 '''
 
-from   pydantic import BaseModel, ConfigDict, computed_field
+import numpy    as np
 import pandas   as pd
 
-from   collections import Counter
 from   typing      import Self, Any
 import yaml
 import json
 import sys
 import os
 import argparse
+import hashlib
 
-class ValContainer(BaseModel):
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))  # for shared modules in selfhost_scripts
+from   compose_model import load_compose, normalize_compose, load_yaml, load_yaml_all, interpolate, read_env_file
+from   env_utils import get_cache_path
+
+
+def intern(s: Any) -> Any:
+     '''intern strings, so that env names, container names and repeated values share one object.'''
+     return sys.intern(s) if isinstance(s, str) else s
+
+
+class ValContainer:
      '''
      data model to describe value on each container.
 
@@ -28,58 +38,59 @@ class ValContainer(BaseModel):
        - val (str): value of environment.
        - container (str): name of service in docker-compose
      '''
+     __slots__ = ('val', 'container')
+
+     def __init__(self, val: str, container: str):
+          self.val = intern(val)
+          self.container = intern(container)
 
-     val: str
-     container: str
+     def __repr__(self) -> str:
+          return f'ValContainer(val={self.val!r}, container={self.container!r})'
 
-class EnvVal(BaseModel):
+
+class EnvVal:
      '''
      data model to describe env name and its value for all containers(services) in docker-compose.
+     counts of each value are maintained as values are added, so statistics are cheap to read.
 
      Attributes:
        - env (str): environment name
        - value (list[ValContainer]): pairs of {val, container};  length>1 when the same env is used in multiple containers.
-       - values_assigned   (list[str]; by computing): unique assigned values in common ordered for the above value.
-       - values_mostCommon (str; by computing): most common value among the above.
-       - and others (extra properties==allowed).
+       - assigned_   (list[str]; by computing): unique assigned values in common ordered for the above value, except most common.
+       - mostCommon_ (str; by computing): most common value among the above.
+       - composerOnly_ (str): mark for envs which exist in composer but not in external env lists.
      '''
-     model_config = ConfigDict(extra='allow')
-
-     env : str
-     value  : list['ValContainer'] = []
-     composerOnly_: str = None
+     __slots__ = ('env', 'value', 'composerOnly_', '_counts', '_mostCommon', '_assigned')
      __statisticsFields__: list[str] = ['composerOnly_', 'mostCommon_', 'assigned_' ] # hidden class params
 
-     @computed_field(return_type=list[str])
+     def __init__(self, env: str, value: list[ValContainer]=None, composerOnly_: str=None):
+          self.env = intern(env)
+          self.value = []
+          self.composerOnly_ = composerOnly_
+          self._counts: dict[str, int] = {}  # value => count, in order of first appearance.
+          self._mostCommon: str = None
+          self._assigned: list[str] = None   # cache of assigned_, invalidated by add.
+          for vc in value or []:
+               self.add(vc.val, vc.container)
+
      @property
-     def assigned_(self) -> str:
-          '''compute and return unique assigned values in common order from current value instances, when needed.
+     def assigned_(self) -> list[str]:
+          '''return unique assigned values in common order from current value instances.
              NOTE: THIS ATTRIBUTE DOES NOT RETURN MOST-COMMON-VALUE, but seconds and beyonds.
           '''
-          if self.value in [ None, [] ]:
+          if len(self._counts) < 2:
                return None
+          if self._assigned is None:
+               # same order as Counter.most_common: by count, then by first appearance.
+               ranked = sorted(self._counts.items(), key=lambda vc: -vc[1])
+               self._assigned = [ v for v, _ in ranked[1:] ]  # returns values other than most-common-value.
+          return self._assigned
 
-          lv = [ itr.val for itr in self.value ]       # get list of val
-          count = Counter(lv)
-          rtn  = [ v for v, _ in count.most_common() ] # get unique and common ordered list of value.
-
-          if len(rtn)<2:
-               return None
-          return rtn[1:]  # returns values other than most-common-value.
-
-     @computed_field(return_type=str)
      @property
      def mostCommon_(self) -> str:
-          '''compute and return most common value from current value instances, when needed.
+          '''return most common value from current value instances.
           '''
-          if self.value in [ None, [] ]:
-               return None
-
-          # rtn = self.values_asssigned[0]
-          lv = [ itr.val for itr in self.value ]
-          count = Counter(lv)
-          rtn = count.most_common(1)[0][0]
-          return rtn
+          return self._mostCommon
 
      def add(self, v: str, c: str) -> Self:
           '''helper function to add instance into value.
@@ -88,9 +99,57 @@ class EnvVal(BaseModel):
             - v (str): value
             - c (str): container
           '''
-          self.value.append(ValContainer(val=v, container=c))
+          vc = ValContainer(val=v, container=c)
+          self.value.append(vc)
+          count = self._counts[vc.val] = self._counts.get(vc.val, 0) + 1
+          best = self._counts.get(self._mostCommon, 0)
+          if count > best or (count == best and self._isEarlier(vc.val, self._mostCommon)):
+               self._mostCommon = vc.val
+          self._assigned = None
           return self
 
+     def _isEarlier(self, v1: str, v2: str) -> bool:
+          '''check whether v1 first appeared before v2; only called on ties, which are rare.'''
+          for v in self._counts:
+               if v == v1:
+                    return True
+               if v == v2:
+                    return False
+          return False
+
+     def model_dump(self, **kwargs) -> dict:
+          '''serialize with pydantic, which is only imported here at the serialization boundary.'''
+          return _pydanticModels()[1].model_validate({
+               'env': self.env,
+               'value': [ {'val': vc.val, 'container': vc.container} for vc in self.value ],
+               'composerOnly_': self.composerOnly_,
+               'mostCommon_': self.mostCommon_,
+               'assigned_': self.assigned_,
+          }).model_dump(**kwargs)
+
+
+_pydanticModelCache: tuple = None
+
+def _pydanticModels() -> tuple:
+     '''define pydantic models for EnvVal serialization on first use.'''
+     global _pydanticModelCache
+     if _pydanticModelCache is None:
+          from pydantic import BaseModel
+
+          class ValContainerModel(BaseModel):
+               val: str
+               container: str
+
+          class EnvValModel(BaseModel):
+               env: str
+               value: list[ValContainerModel] = []
+               composerOnly_: str | None = None
+               mostCommon_: str | None = None
+               assigned_: list[str] | None = None
+
+          _pydanticModelCache = (ValContainerModel, EnvValModel)
+     return _pydanticModelCache
+
 
 def readEnvList(path: str) -> set[str]:
      '''
@@ -124,11 +183,39 @@ def readYaml(path: str) -> dict:
         fp = open(path, 'r')
 
      cont = fp.read()
-     d = yaml.load(cont, Loader=yaml.Loader)
+     d = load_yaml(cont)
      fp.close()
      return d
 
 
+def readYamlDocs(path: str, cont: str=None) -> list[dict]:
+     '''
+     get all documents of (multi-document) yaml, e.g. rendered helm manifests.
+
+     Args:
+       - path (str): input file path
+       - cont (str): content already read from path (e.g. stdin); optional.
+     Returns:
+       - list[dict]:  non-empty documents of yaml.
+     '''
+
+     if cont is not None:
+          pass
+     elif path not in ['-', '/dev/stdin']:
+          try:
+               return [ load_compose(path) ]   # normalized and cached by content hash.
+          except yaml.composer.ComposerError:
+               pass                            # multi-document, e.g. manifests; parse below.
+          with open(path, 'r') as fp:
+               cont = fp.read()
+     else:
+          cont = sys.stdin.read()
+     docs = list(load_yaml_all(cont))
+     if len(docs) == 1:
+          return [ normalize_compose(docs[0]) ]   # same as load_compose does for a single-document file.
+     return [ d for d in docs if d ]
+
+
 def dumpYaml(d: dict):
     yaml.dump(d, Dumper=yaml.Dumper)
 
@@ -149,9 +236,9 @@ def pickEnvsFromComposer(d: dict, limits: list[str]=None, excludes: list[str]=No
      # phase1) pick just services parts.
      d = d.get('services')
 
-     # phase2) pick environment parts from each service.
+     # phase2) pick environment parts from each service (env_override, for debug-services.yaml).
      for k, d2 in d.items():
-         d2 = d2.get('environment')
+         d2 = d2.get('environment', d2.get('env_override'))
          d[k] = d2
 
      ls = set(d.keys())      # make candidates from given dict.keys ( i.e. services).
@@ -167,6 +254,81 @@ def pickEnvsFromComposer(d: dict, limits: list[str]=None, excludes: list[str]=No
      return rtn
 
 
+K8S_WORKLOAD_KINDS = [ 'Deployment', 'StatefulSet', 'DaemonSet', 'Job', 'ReplicaSet', 'Pod' ]
+
+def pickEnvsFromManifests(docs: list[dict], limits: list[str]=None, excludes: list[str]=None) -> dict:
+     '''
+     pick containers[some].env from rendered kubernetes manifests (e.g. helm template foodios-chart).
+
+     Args:
+       - docs (list[dict]): documents of rendered manifests
+       - limits (list[str]):   container names to want.
+       - excludes (list[str]): container names NOT to want.
+
+     Returns:
+       - dict:  container name => dict[env: val]
+     '''
+
+     rtn: dict = {}
+     for doc in docs:
+          kind = doc.get('kind')
+          if kind == 'CronJob':
+               doc = doc.get('spec', {}).get('jobTemplate', {})
+          elif kind not in K8S_WORKLOAD_KINDS:
+               continue
+          spec = doc.get('spec', {})
+          podSpec = spec if kind == 'Pod' else spec.get('template', {}).get('spec', {})
+          for container in podSpec.get('containers', []) + podSpec.get('initContainers', []):
+               name = container.get('name')
+               if excludes not in [ None, [] ] and name in excludes:
+                    continue
+               if limits not in [ None, [] ] and name not in limits:
+                    continue
+               envs = rtn.setdefault(name, {})
+               for env in container.get('env') or []:
+                    if 'value' in env:
+                         envs[env['name']] = env['value']
+                    elif 'valueFrom' in env:  # refer to secrets etc by its source, since value is unknown here.
+                         envs[env['name']] = 'valueFrom:' + json.dumps(env['valueFrom'], sort_keys=True)
+     return rtn
+
+
+def pickEnvsFromSource(docs: list[dict], limits: list[str]=None, excludes: list[str]=None) -> dict:
+     '''
+     pick envs of each service from documents of one source, either docker-compose style or kubernetes manifests.
+
+     Args:
+       - docs (list[dict]): documents of source
+       - limits (list[str]):   names to want.
+       - excludes (list[str]): names NOT to want.
+
+     Returns:
+       - dict:  service => environment (dict or list style)
+     '''
+
+     if len(docs) == 1 and 'services' in docs[0]:
+          return pickEnvsFromComposer(docs[0], limits, excludes)
+     return pickEnvsFromManifests(docs, limits, excludes)
+
+
+def mergeSources(sources: dict[str, dict]) -> dict:
+     '''
+     merge envs of services over sources in order, like docker compose override files; later sources win.
+
+     Args:
+       - sources (dict[str, dict]): source name => service => dict[env: val]
+
+     Returns:
+       - dict:  service => dict[env: val]
+     '''
+
+     rtn: dict = {}
+     for d in sources.values():
+          for svc, envs in d.items():
+               rtn.setdefault(svc, {}).update(envs)
+     return rtn
+
+
 def reshapeEnvsInComposer(d: dict ) -> dict:
      '''
      reshape services[].environment from list style to dict style.
@@ -216,18 +378,6 @@ def groupbyEnv(d: dict) -> dict:
      return rtn
 
 
-def fillCommonVal(d: dict[str, EnvVal], commonValField: str='value_mostCommon') -> dict[str, EnvVal]:
-     '''
-     find most common value from list of d.values[].val and assign it to commonValField of d
-     '''
-     for ev in d.values():
-          cv = ev.mostCommonValue
-          lv = [ itr.val for itr in ev.value ]
-          count = Counter(lv)
-          cv = count.most_common(1)[0][0]
-          setattr(ev, commonValField, cv)
-     return d
-
 def update4ComposerOnly(rows: set[str], gd: dict[str, EnvVal], mark: str='Y') -> tuple:
 
      '''
@@ -253,6 +403,38 @@ def update4ComposerOnly(rows: set[str], gd: dict[str, EnvVal], mark: str='Y') ->
      return newrows, gd
 
 
+def mkRecords(lev: list[EnvVal]) -> pd.DataFrame:
+     '''
+     make long-format records (env, container, value) from EnvVal, in the order values were added.
+
+     Args:
+       - lev  (list[EnvVal]): data to make records.
+
+     Returns:
+       - panda Dataframe:  one row per {env, container, value}.
+     '''
+
+     records = [ (ev.env, vc.container, vc.val) for ev in lev for vc in ev.value ]
+     return pd.DataFrame.from_records(records, columns=['env', 'container', 'value'])
+
+
+def mkStatistics(lev: list[EnvVal]) -> pd.DataFrame:
+     '''
+     make statistics fields for each env from EnvVal, whose counts are maintained as values are added.
+
+     Args:
+       - lev  (list[EnvVal]): data to pick statistics fields from.
+
+     Returns:
+       - panda Dataframe:  envs x EnvVal.__statisticsFields__
+     '''
+
+     return pd.DataFrame({ 'composerOnly_': [ ev.composerOnly_ for ev in lev ],
+                           'mostCommon_':   [ ev.mostCommon_   for ev in lev ],
+                           'assigned_':     [ ev.assigned_     for ev in lev ] },
+                         index=pd.Index([ ev.env for ev in lev ], name='env'), dtype=object)
+
+
 def mkTable(rows: list[str],  cols:list[str], lev: list[EnvVal], initial_val:Any=None, extraFields: list[str]=[]) -> pd.DataFrame:
      '''
      make table as pandas DataFrame from row, cols, and EnvVal.
@@ -267,23 +449,172 @@ def mkTable(rows: list[str],  cols:list[str], lev: list[EnvVal], initial_val:Any
      Returns:
        - panda Dataframe:  envs x containers with values in table.
      '''
-     
-     # make dataframe with schema.
-     df = pd.DataFrame(data=initial_val, index=rows, columns=cols)
-     df = df.rename_axis(index='env', columns='containers')
 
-     # fill data into each table cell.
-     for ev in lev:
-          r = ev.env         # row for cell
-          for p in extraFields:                 # get and fill extra properties from EnvVal to table.
-              df.at[r , p ] = getattr(ev, p )
+     # build long-format records once, and make envs x containers with a single pivot.
+     records = mkRecords(lev)
+     df = records.pivot(index='env', columns='container', values='value')
 
-          for vc in ev.value:
-            c = vc.container # col for cell
-            v = vc.val       # celldata
-            df.at[r, c] = v  # fill v into corresponding cell.
+     # join statistics fields maintained by EnvVal.
+     if extraFields:
+          df = mkStatistics(lev)[extraFields].join(df)
+
+     # conform to table schema.
+     df = df.reindex(index=rows, columns=cols).astype(object)
+     if initial_val is not None:
+          df = df.where(df.notna(), initial_val)
+     df = df.rename_axis(index='env', columns='containers')
      return df
 
+class EnvCube:
+     '''
+     dense env x service x profile data, of values resolved against each profile.
+
+     Attributes:
+       - envs (list[str]): env names; axis 0.
+       - services (list[tuple[str, str]]): pairs of {source, service}; axis 1.
+       - profiles (list[str]): profile names; axis 2.
+       - values (np.ndarray[object]): resolved values; None where the env is not set on the service.
+       - codes (np.ndarray[int]): integer code per distinct value, -1 where not set, for vectorized comparison.
+     '''
+     __slots__ = ('envs', 'services', 'profiles', 'values', 'codes')
+
+     def __init__(self, envs: list[str], services: list[tuple[str, str]], profiles: list[str], values: np.ndarray):
+          self.envs = envs
+          self.services = services
+          self.profiles = profiles
+          self.values = values
+          codes, _ = pd.factorize(values.ravel(), use_na_sentinel=True)
+          self.codes = codes.reshape(values.shape)
+
+
+def mkCube(sources: dict[str, dict], profiles: dict[str, dict[str, str]]) -> EnvCube:
+     '''
+     make env x service x profile cube, resolving each distinct raw value once per profile.
+
+     Args:
+       - sources (dict[str, dict]): source name => service => dict[env: val]
+       - profiles (dict[str, dict]): profile name => variables; empty to keep raw values (as profile 'raw').
+
+     Returns:
+       - EnvCube: resolved values.
+     '''
+
+     if not profiles:
+          profiles = { 'raw': None }
+     records = [ (env, (src, svc), val) for src, d in sources.items() for svc, envs in d.items() for env, val in envs.items() ]
+     envs     = sorted({ r[0] for r in records }, key=lambda s: s.lower())
+     services = sorted({ r[1] for r in records }, key=lambda s: (s[1].lower(), list(sources).index(s[0])))
+     envIdx   = { e: i for i, e in enumerate(envs) }
+     svcIdx   = { s: i for i, s in enumerate(services) }
+
+     # raw values as codes into distinct values; -1 where not set.
+     raw = np.full((len(envs), len(services)), -1, dtype=np.intp)
+     distinct, distinctIdx = [], {}
+     for env, svc, val in records:
+          key = None if val is None else str(val)
+          if key not in distinctIdx:
+               distinctIdx[key] = len(distinct)
+               distinct.append(key)
+          raw[envIdx[env], svcIdx[svc]] = distinctIdx[key]
+
+     # resolve each distinct value once per profile, then spread into cube with a single fancy index.
+     resolved = np.empty((len(distinct) + 1, len(profiles)), dtype=object)   # last row (index -1) stays None for not set.
+     for j, penv in enumerate(profiles.values()):
+          resolved[:-1, j] = [ v if penv is None else interpolate(v, penv) for v in distinct ]
+     values = resolved[raw]                                                   # envs x services x profiles
+     return EnvCube(envs, services, list(profiles), values)
+
+
+def diffProfiles(cube: EnvCube) -> pd.DataFrame:
+     '''
+     find env x service whose resolved values differ between profiles, in one vectorized pass.
+
+     Returns:
+       - panda Dataframe:  rows of {env, source, service} with a column of value for each profile.
+     '''
+
+     differs = (cube.codes != cube.codes[:, :, :1]).any(axis=2)
+     ie, js = np.nonzero(differs)
+     rtn = pd.DataFrame(cube.values[ie, js, :], columns=cube.profiles)
+     rtn.insert(0, 'service', [ cube.services[j][1] for j in js ])
+     rtn.insert(0, 'source',  [ cube.services[j][0] for j in js ])
+     rtn.insert(0, 'env',     [ cube.envs[i] for i in ie ])
+     return rtn
+
+
+def diffSources(cube: EnvCube, missingDiffers: bool=False) -> pd.DataFrame:
+     '''
+     find env x service x profile whose resolved values differ between sources defining the same service.
+
+     Args:
+       - cube (EnvCube): resolved values.
+       - missingDiffers (bool): also count an env set by one source but not by another as a difference;
+         otherwise only values set by at least two sources are compared, as override files usually set a few envs only.
+
+     Returns:
+       - panda Dataframe:  rows of {env, service, profile} with a column of value for each source.
+     '''
+
+     sourceNames = list(dict.fromkeys(src for src, _ in cube.services))
+     serviceNames = list(dict.fromkeys(svc for _, svc in cube.services))
+     # reshape services axis into service x source, -2 where the source doesn't define the service at all.
+     grid = np.full((len(cube.envs), len(serviceNames), len(sourceNames), len(cube.profiles)), -2, dtype=cube.codes.dtype)
+     vgrid = np.full(grid.shape, None, dtype=object)
+     si = np.array([ serviceNames.index(svc) for _, svc in cube.services ], dtype=np.intp)
+     oi = np.array([ sourceNames.index(src) for src, _ in cube.services ], dtype=np.intp)
+     grid[:, si, oi, :] = cube.codes
+     vgrid[:, si, oi, :] = cube.values
+     # compare only sources which define the service (code -1 where they don't set the env, -2 where they don't define the service).
+     compared = grid >= -1 if missingDiffers else grid >= 0
+     highest = np.where(compared, grid, np.iinfo(grid.dtype).min).max(axis=2)
+     lowest  = np.where(compared, grid, np.iinfo(grid.dtype).max).min(axis=2)
+     differs = compared.any(axis=2) & (highest != lowest)                     # envs x services x profiles
+     ie, js, ks = np.nonzero(differs)
+     rtn = pd.DataFrame(vgrid[ie, js, :, ks], columns=sourceNames)
+     rtn.insert(0, 'profile', [ cube.profiles[k] for k in ks ])
+     rtn.insert(0, 'service', [ serviceNames[j] for j in js ])
+     rtn.insert(0, 'env',     [ cube.envs[i] for i in ie ])
+     return rtn[ [ 'env', 'service', 'profile' ] + [ src for src in sourceNames if rtn[src].notna().any() ] ]
+
+
+def cubeToRecords(cube: EnvCube) -> pd.DataFrame:
+     '''
+     flatten cube into long-format records {env, source, service, profile, value} where the env is set.
+     '''
+
+     ie, js, ks = np.nonzero(cube.codes >= 0)
+     return pd.DataFrame({ 'env':     [ cube.envs[i] for i in ie ],
+                           'source':  [ cube.services[j][0] for j in js ],
+                           'service': [ cube.services[j][1] for j in js ],
+                           'profile': [ cube.profiles[k] for k in ks ],
+                           'value':   cube.values[ie, js, ks] })
+
+
+def writeExcel(df: pd.DataFrame, path: str, sheet_name: str='Sheet1'):
+
+     '''
+     write table(DataFrame) to excel file, streaming rows through a write-only workbook.
+     Args:
+       - df (pd.DataFrame): data for output
+       - path (str): file name to store data
+       - sheet_name (str): name of the sheet
+     '''
+
+     from openpyxl import Workbook
+
+     def cell(v: Any) -> Any:
+          if isinstance(v, (list, tuple, dict)):
+               return str(v)
+          return None if pd.isna(v) else v
+
+     wb = Workbook(write_only=True)
+     ws = wb.create_sheet(sheet_name)
+     ws.append([ df.index.name ] + [ str(c) for c in df.columns ])
+     for row in df.itertuples(name=None):
+          ws.append([ cell(v) for v in row ])
+     wb.save(path)
+
+
 def writeDF(df: pd.DataFrame, path: str, writer:str=None, **kwargs):
 
      '''
@@ -299,7 +630,9 @@ def writeDF(df: pd.DataFrame, path: str, writer:str=None, **kwargs):
      
      if writer is not None: # when writer is specified, use it.
           fn = getattr(df, writer)
-     elif any( path.endswith(suffix) for suffix in [ '.xlsx', '.xls']):
+     elif any( path.endswith(suffix) for suffix in [ '.xlsx' ]):
+          fn = lambda path, **kwargs: writeExcel(df, path, **kwargs)
+     elif any( path.endswith(suffix) for suffix in [ '.xls']):
           fn = df.to_excel
      elif any( path.endswith(suffix) for suffix in [ '.json', '.js']):
           fn = df.to_json
@@ -315,26 +648,119 @@ def writeDF(df: pd.DataFrame, path: str, writer:str=None, **kwargs):
           pass
 
 
+def inputsHash(opts: argparse.Namespace, contents: dict[str, str]) -> str:
+     '''
+     compute hash of everything the outputs depend on: this script, options, inputs, envlist and profiles.
+
+     Args:
+       - opts (argparse.Namespace): parsed options
+       - contents (dict[str, str]): content of inputs already read (e.g. stdin)
+
+     Returns:
+       - str:  hex digest.
+     '''
+
+     h = hashlib.sha256()
+     with open(__file__, 'rb') as fp:
+          h.update(fp.read())
+     h.update(json.dumps({ k: v for k, v in sorted(vars(opts).items()) if k not in [ 'output', 'force' ] }).encode())
+     for path in opts.input + [ opts.envlist ] + (opts.profiles or []):
+          if path in contents:
+               h.update(contents[path].encode())
+          else:
+               with open(path, 'rb') as fp:
+                    h.update(fp.read())
+          h.update(b'\0')
+     return h.hexdigest()
+
+
+def stampPath(output: str) -> str:
+     '''path of stamp recording inputsHash of the run which wrote output.'''
+     key = hashlib.sha256(os.path.abspath(output).encode()).hexdigest()
+     return str(get_cache_path('compose2envtable', key))
+
+
+def isUpToDate(outputs: list[str], digest: str) -> bool:
+     '''
+     check whether all outputs exist and were written from inputs with the same hash.
+     '''
+
+     for output in outputs:
+          if output in ['-'] or not os.path.exists(output):
+               return False
+          try:
+               with open(stampPath(output), 'r') as fp:
+                    if fp.read() != digest:
+                         return False
+          except OSError:
+               return False
+     return True
+
+
+def writeStamps(outputs: list[str], digest: str):
+     '''record inputsHash for written outputs.'''
+     for output in outputs:
+          if output in ['-']:
+               continue
+          path = stampPath(output)
+          os.makedirs(os.path.dirname(path), exist_ok=True)
+          with open(path, 'w') as fp:
+               fp.write(digest)
+
+
 if __name__ == '__main__':
 
     parser = argparse.ArgumentParser()
-    parser.add_argument('-i', '--input',    type=str,   default='-',         help='path of docker-composer.yaml to parse(default: stdin)')
+    parser.add_argument('-i', '--input',    nargs='+',  default=['-'],       help='paths of docker-composer.yaml, override files or rendered k8s manifests to parse; later ones override earlier (default: stdin)')
     parser.add_argument('-e', '--excludes', nargs='+',  default=None,        help='services NOT to parse; optional (default: no-exclusion; i.e: all)')
     parser.add_argument('-s', '--includes', nargs='+',  default=None,        help='limit services to parse; optional (default: none; i.e: all)')
     parser.add_argument('-l', '--envlist',  type=str,   default=os.devnull,  help='list of env names to use table schema; optional(default: /dev/null,  to skip loading list)')
-    parser.add_argument('-o', '--output',   type=str,   default='-',         help='output file path (*.xlsx, *.json, *.csv etc), to output result (default: stdout)')
+    parser.add_argument('-o', '--output',   nargs='+',  default=['-'],       help='output file paths (*.xlsx, *.json, *.csv, *.md etc), all written from the same table (default: stdout)')
     parser.add_argument('-w', '--writer',   type=str,   default=None,        help='enforce writer for output dataframe into file(default: None)')
     parser.add_argument('--no-statistics',  action='store_true',             help='flag to output statistic values on env into table or not( default:False, i.e: include statistics)')
     parser.add_argument('-t', '--transpose',   action='store_true',          help='transpose table(swap rows<=>cols) just before output(default: False)')
+    parser.add_argument('-p', '--profiles', nargs='+',  default=None,        help='env profiles (e.g. .env .env.production) to resolve ${VAR} against; outputs env x service x profile records instead of table')
+    parser.add_argument('-d', '--diff',     choices=['profiles', 'sources'], default=None, help='output only envs whose resolved values differ between profiles or between sources')
+    parser.add_argument('--missing-differs', action='store_true',            help='with --diff sources, count an env that one source sets and another does not as a difference (default: False, i.e: compare only envs set in both)')
+    parser.add_argument('-f', '--force',    action='store_true',             help='regenerate outputs even if inputs are unchanged since they were written (default: False)')
 
 
     opts = parser.parse_args()
 
-    d = readYaml(opts.input)                                        # read docker-compose yaml file into d(dict)
-    d = pickEnvsFromComposer(d, opts.includes, opts.excludes)       # pick just .services[<selected>].environment
-    cols = sorted(d.keys(), key=lambda s: s.lower())                # cols <= services in composer, to use table schema.
+    contents = {}                                                   # inputs which can only be read once.
+    for path in opts.input:
+         if path in ['-', '/dev/stdin']:
+              contents[path] = sys.stdin.read()
+    digest = inputsHash(opts, contents)
+    if not opts.force and isUpToDate(opts.output, digest):         # skip regeneration, when all outputs were made from same inputs.
+         print(f'outputs are up to date: {" ".join(opts.output)}', file=sys.stderr)
+         sys.exit(0)
+
+    sources = {}                                                    # source name => service => dict[env: val]
+    services = {}                                                   # all picked services, including ones without envs.
+    for path in opts.input:
+         name = 'stdin' if path in ['-', '/dev/stdin'] else os.path.basename(path)
+         d = pickEnvsFromSource(readYamlDocs(path, contents.get(path)), opts.includes, opts.excludes)  # pick just .services[<selected>].environment or containers[].env
+         services.update(dict.fromkeys(d))
+         sources[name] = reshapeEnvsInComposer(d)                  # change envs style in composer (list[env=val) => dict[k:env, v:val] ) for easy parse.
+
+    if opts.profiles is not None or opts.diff is not None:
+         profiles = { os.path.basename(path): read_env_file(path) for path in opts.profiles or [] }
+         cube = mkCube(sources, profiles)                           # envs x services x profiles, resolved against each profile.
+         if opts.diff == 'profiles':
+              df = diffProfiles(cube)
+         elif opts.diff == 'sources':
+              df = diffSources(cube, missingDiffers=opts.missing_differs)
+         else:
+              df = cubeToRecords(cube)
+         for output in opts.output:
+              writeDF(df.set_index('env'), output, writer=opts.writer)
+         writeStamps(opts.output, digest)
+         sys.exit(0)
+
+    cols = sorted(services, key=lambda s: s.lower())                # cols <= services in composer, to use table schema.
+    d = mergeSources(sources)                                       # merge services over sources, later ones override.
 
-    d = reshapeEnvsInComposer(d)                                    # change envs style in composer (list[env=val) => dict[k:env, v:val] ) for easy parse.
     gd = groupbyEnv(d)                                              # apply groupby env to d, and get gd; i.e. dict[ k:env,  v:EnvVal[ env: env, value: list[ ValContainer[ val=v, container=c]]]]
     envNamesInComposer = set(gd.keys())                             # get env names in composer
 
@@ -350,4 +776,6 @@ if __name__ == '__main__':
     df = mkTable(rows, cols, celldata,  extraFields=extraFields)    # make table { rows: envs, cols: [extrafields + containers], cell: corresponding value}
     if opts.transpose:
          df = df.T
-    writeDF(df, opts.output, writer=opts.writer)                    # save table into file.
+    for output in opts.output:
+         writeDF(df, output, writer=opts.writer)                    # save table into each file, from the same table.
+    writeStamps(opts.output, digest)
@@ -0,0 +1,226 @@
+#!/bin/sh
+"exec" """$(dirname $0)/venv/bin/python""" "$0" "$@" # this is a polyglot shell exec which will drop down to the relative virtualenv's python
+
+"""
+Shared loader for docker compose files.
+
+Loads compose files with the C-accelerated YAML loader where available, expands anchors,
+drops top-level x- fragments and normalizes list-style environments to dicts once.
+The normalized model is cached on disk keyed by the file's content hash, so looking up
+a service's environment doesn't need to parse YAML or run `docker compose config`.
+Used by compose2envtable.
+
+service_environment only covers a single compose file's environment and env_file entries:
+override files, profiles and extends are not applied, so use `docker compose config` (as
+export-service-env.sh does) where the result must match what a container actually gets.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+from pathlib import Path
+
+import yaml
+
+from env_utils import get_cache_path
+
+try:
+    YamlLoader = yaml.CSafeLoader
+except AttributeError:
+    # PyYAML built without libyaml
+    YamlLoader = yaml.SafeLoader
+
+# bump this when the normalized model changes, so old cache entries are ignored
+MODEL_VERSION = 1
+
+def get_cache_dir():
+    """Directory for cached normalized compose models"""
+    return get_cache_path('compose')
+
+def load_yaml(content):
+    """Parse a single YAML document with the fastest available safe loader"""
+    return yaml.load(content, Loader=YamlLoader)
+
+def load_yaml_all(content):
+    """Parse all documents of a (multi-document) YAML stream with the fastest available safe loader"""
+    return yaml.load_all(content, Loader=YamlLoader)
+
+def normalize_environment(environment):
+    """Convert list-style (KEY=value) environment to a dict; KEY alone maps to None, as compose passes it through"""
+    if environment is None:
+        return {}
+    if isinstance(environment, dict):
+        return {key: (None if value is None else str(value) if not isinstance(value, bool) else str(value).lower())
+                for key, value in environment.items()}
+    normalized = {}
+    for entry in environment:
+        key, sep, value = entry.partition('=')
+        normalized[key] = value if sep else None
+    return normalized
+
+def normalize_compose(compose):
+    """Drop x- fragments (anchors are already expanded by the loader) and normalize each service's environment"""
+    model = {key: value for key, value in (compose or {}).items() if not key.startswith('x-')}
+    services = model.get('services') or {}
+    for service in services.values():
+        if service is None:
+            continue
+        if 'environment' in service:
+            service['environment'] = normalize_environment(service['environment'])
+        env_file = service.get('env_file')
+        if isinstance(env_file, (str, dict)):
+            service['env_file'] = [env_file]
+    return model
+
+def load_compose(path, use_cache=True):
+    """
+    Load and normalize a compose file, using the on-disk cache keyed by its content hash.
+
+    Returns:
+        dict: normalized compose model
+    """
+    with open(path, 'rb') as f:
+        content = f.read()
+    content_hash = hashlib.sha256(content).hexdigest()
+    cache_file = get_cache_dir() / f"{content_hash}.v{MODEL_VERSION}.json"
+    if use_cache:
+        try:
+            with cache_file.open('r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            pass
+    model = normalize_compose(load_yaml(content))
+    if use_cache:
+        try:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            temp_file = cache_file.with_suffix(f'.tmp-{os.getpid()}')
+            with temp_file.open('w') as f:
+                json.dump(model, f, default=str)
+            os.replace(temp_file, cache_file)
+        except OSError as e:
+            print(f"Warning: could not cache compose model for {path}: {e}", file=sys.stderr)
+    return model
+
+INTERPOLATION_RE = re.compile(r'\$(?:(\$)|\{([A-Za-z_][A-Za-z0-9_]*)(?:(:?[-+?])([^}]*))?\}|([A-Za-z_][A-Za-z0-9_]*))')
+
+def interpolate(src, env):
+    """Resolve $VAR, ${VAR}, ${VAR:-default}, ${VAR-default}, ${VAR:+alt}, ${VAR+alt} and $$ like docker compose"""
+    if src is None:
+        return None
+
+    def replace(m):
+        escaped, name, op, arg, bare = m.groups()
+        if escaped:
+            return '$'
+        name = name or bare
+        value = env.get(name)
+        if op in (':-', ':?'):
+            return value if value else arg
+        if op in ('-', '?'):
+            return value if value is not None else arg
+        if op == ':+':
+            return arg if value else ''
+        if op == '+':
+            return arg if value is not None else ''
+        return value or ''
+
+    return INTERPOLATION_RE.sub(replace, str(src))
+
+def read_env_file(path, env=None):
+    """
+    Read a docker-style env file, interpolating unquoted and double-quoted values as docker compose does
+    (against env, then earlier lines); single-quoted values are kept literally.
+    """
+    variables = {}
+    lookup = dict(env or {})
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('export '):
+                line = line[len('export '):]
+            if not line or line.startswith('#') or '=' not in line:
+                continue
+            key, value = line.split('=', 1)
+            key, value = key.strip(), value.strip()
+            if value[:1] == "'" and len(value) > 1 and value.endswith("'"):
+                variables[key] = lookup[key] = value[1:-1]
+                continue
+            if value[:1] == '"' and len(value) > 1 and value.endswith('"'):
+                value = value[1:-1]
+            else:
+                value = re.sub(r'\s+#.*$', '', value)  # drop inline comments of unquoted values
+            variables[key] = lookup[key] = interpolate(value, lookup)
+    return variables
+
+def service_environment(model, service_name, env=None, base_dir='.'):
+    """
+    Get a service's environment as docker compose config would: env_file entries overridden by environment,
+    with values interpolated against env if given.
+
+    Returns:
+        dict: {variable: value}
+    """
+    service = (model.get('services') or {}).get(service_name)
+    if service is None:
+        raise KeyError(f"No such service: {service_name}")
+    environment = {}
+    for env_file in service.get('env_file') or []:
+        required = True
+        if isinstance(env_file, dict):
+            required = env_file.get('required', True)
+            env_file = env_file.get('path')
+        env_file_path = Path(base_dir) / interpolate(env_file, env or {})
+        if not env_file_path.exists():
+            if required:
+                print(f"Warning: env_file {env_file_path} for {service_name} not found", file=sys.stderr)
+            continue
+        environment.update(read_env_file(env_file_path, env))
+    for key, value in service.get('environment', {}).items():
+        if value is None:
+            # a variable without a value is passed through from the environment
+            environment[key] = (env or {}).get(key)
+        else:
+            environment[key] = value if env is None else interpolate(value, env)
+    return environment
+
+def main():
+    parser = argparse.ArgumentParser(description='Query the normalized model of a docker compose file')
+    parser.add_argument('-f', '--file', default='docker-compose.yaml',
+                        help='Compose file to load (default: docker-compose.yaml)')
+    parser.add_argument('-e', '--env-file', default='.env',
+                        help='Env file to interpolate values against, if it exists (default: .env)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help=f'Neither read nor write the cached model in {get_cache_dir()}')
+    parser.add_argument('--json', action='store_true',
+                        help='Output JSON rather than KEY=value lines')
+    parser.add_argument('service', nargs='?',
+                        help='Service whose environment to output (default: output the whole normalized model)')
+    args = parser.parse_args()
+
+    model = load_compose(args.file, use_cache=not args.no_cache)
+    if not args.service:
+        json.dump(model, sys.stdout, indent=2, default=str)
+        sys.stdout.write('\n')
+        return
+    # as with docker compose, the shell environment takes precedence over the env file
+    env = {}
+    if args.env_file and os.path.exists(args.env_file):
+        env.update(read_env_file(args.env_file, os.environ))
+    env.update(os.environ)
+    try:
+        environment = service_environment(model, args.service, env, base_dir=os.path.dirname(os.path.abspath(args.file)))
+    except KeyError as e:
+        print(f"Error: {e.args[0]} in {args.file}", file=sys.stderr)
+        sys.exit(1)
+    if args.json:
+        json.dump(environment, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        for key, value in environment.items():
+            print(f"{key}={'' if value is None else value}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+#!/bin/sh
+"exec" """$(dirname $0)/venv/bin/python""" "$0" "$@" # this is a polyglot shell exec which will drop down to the relative virtualenv's python
+
+"""
+Maintain the container id -> name/service map that config/logging/add-container-metadata.lua uses.
+
+Without the map, the fluent-bit Lua filter would have to read a container's config.v2.json
+to name it. This polls the docker containers directory, reads config.v2.json once for each new
+container, and rewrites the map file (atomically, and only when a container starts or goes)
+as tab-separated lines of: full container id, container name, compose service label.
+The first line is a comment with a hash of the content, which the Lua filter compares (with
+the file size) to skip reloading a map that hasn't changed.
+
+The Lua filter sets service_name from the swarm container name, as it always has; the compose
+service label is only used when fluent-bit has SERVICE_NAME_FROM_COMPOSE_LABEL=1 in its environment.
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+import time
+
+from docker_logs import DEFAULT_CONTAINERS_DIR, read_container_metadata
+
+DEFAULT_MAP_FILE = '/fluent-bit/metadata/container-map.tsv'
+
+def scan_containers(containers_dir, known=None):
+    """
+    Get {container_id: (name, compose_service)} for the containers in containers_dir, reusing entries from known
+    so that config.v2.json is only read for containers that weren't seen before.
+
+    Returns:
+        tuple: (containers, whether every container's config could be read)
+    """
+    known = known or {}
+    containers = {}
+    try:
+        container_ids = os.listdir(containers_dir)
+    except FileNotFoundError:
+        return containers, True
+    for container_id in container_ids:
+        if container_id in known:
+            containers[container_id] = known[container_id]
+            continue
+        metadata = read_container_metadata(os.path.join(containers_dir, container_id))
+        if metadata is not None:
+            containers[container_id] = metadata
+    return containers, len(containers) == len(container_ids)
+
+def render_map(containers):
+    lines = []
+    for container_id, (name, compose_service) in sorted(containers.items()):
+        lines.append(f"{container_id}\t{name}\t{compose_service or ''}\n")
+    body = ''.join(lines)
+    return f"# container-map {hashlib.sha256(body.encode('utf-8')).hexdigest()[:16]}\n{body}"
+
+def file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+def write_map(map_file, containers, written=None):
+    """
+    Write the map if its content changed, replacing it atomically so the Lua filter never reads half a file.
+    written is the (content, file stamp) this returned last time, so the file is only read back if it
+    was changed by something else.
+
+    Returns:
+        tuple: (whether the map was written, (content, file stamp))
+    """
+    content = render_map(containers)
+    stamp = file_stamp(map_file)
+    if written is not None and written == (content, stamp):
+        return False, written
+    try:
+        with open(map_file, 'r') as f:
+            if f.read() == content:
+                return False, (content, stamp)
+    except FileNotFoundError:
+        pass
+    map_dir = os.path.dirname(map_file)
+    if map_dir:
+        os.makedirs(map_dir, exist_ok=True)
+    temp_file = f"{map_file}.tmp-{os.getpid()}"
+    with open(temp_file, 'w') as f:
+        f.write(content)
+    os.replace(temp_file, map_file)
+    return True, (content, file_stamp(map_file))
+
+def main():
+    parser = argparse.ArgumentParser(description='Maintain the container metadata map for the fluent-bit Lua filter')
+    parser.add_argument('-d', '--containers-dir', default=DEFAULT_CONTAINERS_DIR,
+                        help=f'Docker containers directory (default: {DEFAULT_CONTAINERS_DIR})')
+    parser.add_argument('-o', '--output', default=DEFAULT_MAP_FILE,
+                        help=f'Map file to write (default: {DEFAULT_MAP_FILE})')
+    parser.add_argument('-w', '--watch', action='store_true',
+                        help='Keep polling for containers starting and stopping, rather than writing the map once')
+    parser.add_argument('-i', '--interval', type=float, default=2.,
+                        help='Seconds between polls with --watch (default: 2)')
+    args = parser.parse_args()
+
+    containers = {}
+    written = None
+    last_mtime = None
+    while True:
+        # the directory's mtime changes whenever a container directory is created or removed
+        try:
+            mtime = os.stat(args.containers_dir).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime != last_mtime:
+            containers, complete = scan_containers(args.containers_dir, containers)
+            changed, written = write_map(args.output, containers, written)
+            if changed:
+                print(f"Wrote {len(containers)} containers to {args.output}", file=sys.stderr)
+            # a container whose config.v2.json isn't written yet is retried on the next poll
+            last_mtime = mtime if complete else None
+        if not args.watch:
+            break
+        time.sleep(args.interval)
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+
+"""
+Tail docker's json-file container logs directly, resuming from checkpointed offsets.
+
+Each container logs to /var/lib/docker/containers/<id>/<id>-json.log, one JSON object per line
+like {"log": "...\n", "stream": "stdout", "time": "..."}. Container names are read once from
+config.v2.json, as config/logging/add-container-metadata.lua does for fluent-bit, and lines are
+produced in the `service | message` form that `docker compose logs` uses. The offset of every
+file is saved to a checkpoint file, so a restarted reader carries on where it stopped.
+"""
+
+import glob
+import json
+import os
+import re
+import sys
+import time
+from pathlib import Path
+
+from env_utils import get_cache_path, json_loads
+
+DEFAULT_CONTAINERS_DIR = '/var/lib/docker/containers'
+
+# as add-container-metadata.lua matches it
+SWARM_NAME_RE = re.compile(r'^[^_]+_([^.]+)')
+
+READ_SIZE = 1 << 20
+
+def get_checkpoint_file():
+    """Default offsets checkpoint, next to the other cached state in ~/.cache/bluesky-selfhost"""
+    return get_cache_path('docker-log-offsets.json')
+
+def swarm_service_name(container_name):
+    """Service part of a swarm container name (stackname_servicename.instance.taskid), or None if it isn't one"""
+    m = SWARM_NAME_RE.match(container_name)
+    return m.group(1) if m else None
+
+def read_container_metadata(container_dir):
+    """
+    Get (container_name, compose_service) from a container's config.v2.json, where compose_service is
+    the com.docker.compose.service label or None. Returns None if the config can't be read.
+    """
+    try:
+        with open(os.path.join(container_dir, 'config.v2.json'), 'rb') as f:
+            config = json_loads(f.read())
+    except (OSError, ValueError):
+        return None
+    name = (config.get('Name') or '').lstrip('/') or os.path.basename(container_dir)[:12]
+    labels = (config.get('Config') or {}).get('Labels') or {}
+    return name, labels.get('com.docker.compose.service') or None
+
+def read_container_name(container_dir):
+    """Service name for a container: the compose service label, else the swarm service or container name"""
+    metadata = read_container_metadata(container_dir)
+    if metadata is None:
+        return os.path.basename(container_dir)[:12]
+    name, compose_service = metadata
+    return compose_service or swarm_service_name(name) or name
+
+def load_checkpoint(checkpoint_file):
+    try:
+        with open(checkpoint_file, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_checkpoint(checkpoint_file, offsets):
+    checkpoint_file = Path(checkpoint_file)
+    checkpoint_file.parent.mkdir(parents=True, exist_ok=True)
+    temp_file = checkpoint_file.with_suffix(f'.tmp-{os.getpid()}')
+    with temp_file.open('w') as f:
+        json.dump(offsets, f)
+    os.replace(temp_file, checkpoint_file)
+
+class TailedFile:
+    def __init__(self, path, service, inode, offset):
+        self.path = path
+        self.service = service
+        self.inode = inode
+        self.offset = offset
+        self.pending_message = ''
+        self.pending_entry = None
+        self.pending_offset = offset
+
+    def read_lines(self):
+        """Read complete new lines, returning them with the offset just after them (the offset isn't advanced here)"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return [], self.offset
+        if stat.st_ino != self.inode or stat.st_size < self.offset:
+            # rotated or truncated: start the new file from the beginning
+            self.inode, self.offset, self.pending_message = stat.st_ino, 0, ''
+        if stat.st_size == self.offset:
+            return [], self.offset
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read(READ_SIZE)
+        end = data.rfind(b'\n')
+        if end < 0:
+            return [], self.offset
+        return data[:end].split(b'\n'), self.offset + end + 1
+
+    def entries(self, lines):
+        """
+        Decode json-file entries, joining messages docker split into 16KB parts; each joined entry
+        keeps the stream and time of its first part, and gets the file offset it starts at as 'offset'
+        """
+        entries = []
+        line_offset = self.offset
+        for line in lines:
+            if not self.pending_message:
+                self.pending_offset = line_offset
+            line_offset += len(line) + 1
+            try:
+                entry = json_loads(line)
+            except ValueError:
+                continue
+            if not self.pending_message:
+                self.pending_entry = entry
+            message = self.pending_message + entry.get('log', '')
+            if not message.endswith('\n'):
+                self.pending_message = message
+                continue
+            self.pending_message = ''
+            entry = dict(self.pending_entry, log=message, offset=self.pending_offset)
+            entries.append(entry)
+        return entries
+
+    def messages(self, lines):
+        """Convert json-file entries to `service | message` lines"""
+        return [f"{self.service} | {entry['log']}" for entry in self.entries(lines)]
+
+class DockerLogTailer:
+    """Follows every container's json-file log under containers_dir, keeping per-file offsets in checkpoint_file"""
+    def __init__(self, containers_dir=DEFAULT_CONTAINERS_DIR, checkpoint_file=None, from_start=False,
+                 services=None, poll_interval=0.5, checkpoint_interval=1.):
+        self.containers_dir = containers_dir
+        self.checkpoint_file = checkpoint_file or get_checkpoint_file()
+        self.from_start = from_start
+        self.services = set(services) if services else None
+        self.poll_interval = poll_interval
+        self.checkpoint_interval = checkpoint_interval
+        self.files = {}
+        self.ignored = set()
+        self.offsets = load_checkpoint(self.checkpoint_file)
+
+    def discover(self, initial=False):
+        """Start tailing new log files; without a checkpoint, files present at startup are read from their end
+        (unless from_start), while files that appear later are read from the beginning"""
+        for path in glob.glob(os.path.join(self.containers_dir, '*', '*-json.log')):
+            if path in self.files or path in self.ignored:
+                continue
+            service = read_container_name(os.path.dirname(path))
+            if self.services is not None and service not in self.services:
+                self.ignored.add(path)
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            checkpoint = self.offsets.get(path)
+            if checkpoint and checkpoint.get('inode') == stat.st_ino and checkpoint.get('offset', 0) <= stat.st_size:
+                offset = checkpoint['offset']
+            elif initial and not self.from_start:
+                offset = stat.st_size
+            else:
+                offset = 0
+            self.files[path] = TailedFile(path, service, stat.st_ino, offset)
+
+    def advance(self, tailed, offset):
+        """Move tailed's read position to offset, returning the checkpoint to save once what was read is handled"""
+        tailed.offset = offset
+        # a message that is still incomplete is read again from its first part after a restart
+        saved_offset = tailed.pending_offset if tailed.pending_message else offset
+        return {'inode': tailed.inode, 'offset': saved_offset}
+
+    def commit(self, tailed, offset):
+        self.offsets[tailed.path] = self.advance(tailed, offset)
+
+    def save(self):
+        # forget files that docker has removed
+        for path in [path for path in self.offsets if not os.path.exists(path)]:
+            del self.offsets[path]
+        try:
+            save_checkpoint(self.checkpoint_file, self.offsets)
+        except OSError as e:
+            print(f"Warning: could not save log offsets to {self.checkpoint_file}: {e}", file=sys.stderr)
+
+    def read_batches(self, follow=True, idle=False):
+        """
+        Yield (tailed, lines, offset) for each read of new lines. The caller decides when the lines are
+        handled: it advances the read position with advance(), and puts the checkpoint that returns in
+        offsets once it's safe to skip the lines after a restart. With idle, (None, [], None) is yielded
+        for each poll that found nothing, so the caller can do periodic work on a quiet stream.
+        """
+        self.discover(initial=True)
+        last_save = time.monotonic()
+        last_discover = last_save
+        try:
+            while True:
+                found = False
+                # one read per file per round, so a busy container doesn't hold back the others
+                for tailed in list(self.files.values()):
+                    lines, offset = tailed.read_lines()
+                    if not lines:
+                        continue
+                    found = True
+                    yield tailed, lines, offset
+                now = time.monotonic()
+                if now - last_save >= self.checkpoint_interval:
+                    self.save()
+                    last_save = now
+                if not found:
+                    if not follow:
+                        break
+                    if idle:
+                        yield None, [], None
+                    time.sleep(self.poll_interval)
+                if now - last_discover >= self.poll_interval * 10:
+                    self.discover()
+                    last_discover = now
+        finally:
+            self.save()
+
+    def line_batches(self, follow=True, idle=False):
+        """
+        Yield lists of `service | message` lines. Offsets of a batch are committed when the next batch is
+        requested, so lines that weren't handled before an interruption are read again after a restart.
+        With idle, an empty list is yielded for each poll that found nothing.
+        """
+        for tailed, lines, offset in self.read_batches(follow, idle):
+            if tailed is None:
+                yield []
+                continue
+            messages = tailed.messages(lines)
+            if messages:
+                yield messages
+            self.commit(tailed, offset)
@@ -1,12 +1,27 @@
 #!/usr/bin/env python3
 
 import configparser
+import json
+import os
 import re
 import sys
 from pathlib import Path
 
+try:
+    import orjson
+    json_loads = orjson.loads
+    json_dumps = orjson.dumps
+except ImportError:
+    json_loads = json.loads
+    json_dumps = lambda obj: json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
 base_dir = Path(__file__).parent.parent
 
+def get_cache_path(*parts):
+    """Path under the cached state directory, $XDG_CACHE_HOME/bluesky-selfhost (default ~/.cache/bluesky-selfhost)"""
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return Path(cache_home, 'bluesky-selfhost', *parts)
+
 def get_env_filename(profile):
     """Get the environment filename for a given profile."""
     if profile:
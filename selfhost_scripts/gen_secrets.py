@@ -3,40 +3,57 @@
 
 import argparse
 import os
+import random
 import sys
 import secrets
 import subprocess
 import string
 
-from env_utils import read_env
+import yaml
 
-def generate_long_key():
+from env_utils import read_env, validate_profile_name
+
+_system_random = secrets.SystemRandom()
+
+def _token_hex(nbytes, rng=None):
+    """Hex token from the system CSPRNG, or from rng when reproducible output is wanted"""
+    if rng is None:
+        return secrets.token_hex(nbytes)
+    return f'{rng.getrandbits(nbytes * 8):0{nbytes * 2}x}'
+
+def generate_long_key(rng=None):
     """Generate a 64-character hex key (256 bits) equivalent to openssl ecparam method"""
-    return secrets.token_hex(32)
+    return _token_hex(32, rng)
 
-def generate_short_key():
+def generate_short_key(rng=None):
     """Generate a 32-character hex key (128 bits) equivalent to openssl rand --hex 16"""
-    return secrets.token_hex(16)
+    return _token_hex(16, rng)
 
-def generate_random_password():
+def generate_random_password(rng=None):
     """Generate a strong password with capitals, numbers, and symbols for OpenSearch"""
+    rng = rng or _system_random
     # Ensure at least one of each required character type
     chars = string.ascii_lowercase + string.ascii_uppercase + string.digits + "_-"
     password = [
-        secrets.choice(string.ascii_uppercase),
-        secrets.choice(string.digits),
-        secrets.choice("_-"),
+        rng.choice(string.ascii_uppercase),
+        rng.choice(string.digits),
+        rng.choice("_-"),
     ]
     # Fill the rest randomly
     for _ in range(7):  # Total length 10
-        password.append(secrets.choice(chars))
+        password.append(rng.choice(chars))
     
     # Shuffle to avoid predictable patterns
-    secrets.SystemRandom().shuffle(password)
+    rng.shuffle(password)
     return ''.join(password) + '_'
 
+def seeded_stack_random(seed, stack_name):
+    """Reproducible (NOT cryptographically secure) random source for a named test stack"""
+    return random.Random(f"{seed}:{stack_name}")
+
 # Import shared secret type definitions
 from secret_types import SecretType, parse_secret_template, get_fixed_value_secrets
+from k8s_secrets import DEFAULT_NAMESPACE, chart_namespace, write_secret_manifest
 
 def get_secret_generator(secret_type):
     """Get the appropriate generator function for a secret type"""
@@ -47,6 +64,98 @@ def get_secret_generator(secret_type):
     }
     return generators.get(secret_type)
 
+def generate_secrets_file(secret_config, secrets_file, rng=None):
+    """
+    Create or update secrets_file so that it has every variable in secret_config.
+
+    Existing values are kept; new values come from rng if given, otherwise from the system CSPRNG.
+
+    Returns:
+        tuple: (dict of newly added secrets, list of external secret names needing manual values)
+    """
+    # Read existing secrets and file content if file exists
+    existing_vars = {}
+    existing_content = ""
+    if os.path.exists(secrets_file):
+        existing_vars = read_env(secrets_file, interpolate=False)
+        with open(secrets_file, 'r') as f:
+            existing_content = f.read()
+    
+    # Generate only new secrets that don't exist
+    new_secrets = {}
+    external_secrets = []
+    
+    for var_name, config in secret_config.items():
+        # Skip if variable already exists in file
+        if var_name in existing_vars:
+            continue
+            
+        secret_type = config['type']
+        fixed_value = config['fixed_value']
+        
+        if secret_type == SecretType.FIXED_VALUE and fixed_value:
+            # Use fixed value
+            new_secrets[var_name] = fixed_value
+        elif secret_type == SecretType.EXTERNAL:
+            # External secrets need manual intervention
+            external_secrets.append(var_name)
+            new_secrets[var_name] = ""  # Empty placeholder
+        else:
+            # Generate new secret
+            generator = get_secret_generator(secret_type)
+            if generator:
+                new_secrets[var_name] = generator(rng)
+            else:
+                print(f"Warning: Unknown secret type '{secret_type}' for {var_name}", file=sys.stderr)
+                new_secrets[var_name] = ""
+    
+    # Build final content: existing content + new secrets
+    if existing_content:
+        # Start with existing content
+        output_content = existing_content
+        # Ensure it ends with a newline
+        if not output_content.endswith('\n'):
+            output_content += '\n'
+    else:
+        output_content = ""
+
+    # Add new secrets if any, preserving template order for new variables
+    for var_name in secret_config.keys():
+        if var_name in new_secrets:
+            output_content += f"{var_name}={new_secrets[var_name]}\n"
+    
+    # Write to the secrets file
+    secrets_dir = os.path.dirname(secrets_file)
+    if secrets_dir:
+        os.makedirs(secrets_dir, exist_ok=True)
+    with open(secrets_file, 'w') as f:
+        f.write(output_content)
+    # Report what was done
+    if new_secrets:
+        print(f"Added {len(new_secrets)} new secrets to {secrets_file}", file=sys.stderr)
+    else:
+        print(f"All secrets already exist in {secrets_file}", file=sys.stderr)
+    return new_secrets, external_secrets
+
+def update_k8s_manifest(secret_config, secrets_file, manifest_file, namespace):
+    """Write the Kubernetes Secret manifest for secrets_file, reporting which secrets changed"""
+    secret_vars = read_env(secrets_file, interpolate=False)
+    changed = write_secret_manifest(secret_vars, manifest_file, namespace, secret_config)
+    if changed:
+        print(f"Updated {len(changed)} secrets in {manifest_file}: {', '.join(changed)}", file=sys.stderr)
+    else:
+        print(f"All secrets in {manifest_file} are up to date", file=sys.stderr)
+
+def report_external_secrets(external_secrets, secrets_file):
+    """Notify user about external secrets that need manual setup"""
+    if not external_secrets:
+        return
+    print("\n❌  EXTERNAL SECRETS REQUIRED:", file=sys.stderr)
+    print("The following secrets are externally generated and must be manually added:", file=sys.stderr)
+    for var_name in external_secrets:
+        print(f"  - {var_name}: Edit {secrets_file} to provide this value", file=sys.stderr)
+    print(f"\nPlease edit {secrets_file} and set values for these external secrets.", file=sys.stderr)
+
 def main():
     parser = argparse.ArgumentParser(description='Generate secrets for bluesky self-hosting')
     parser.add_argument('-t', '--template-file', 
@@ -55,9 +164,32 @@ def main():
     parser.add_argument('secrets_file', nargs='?',
                        default='config/secrets-passwords.env',
                        help='Secrets file to create/update (default: config/secrets-passwords.env)')
-    
+    parser.add_argument('-k', '--k8s-manifest',
+                       help='Also write a multi-document Kubernetes Secret manifest to this file, for a single kubectl apply')
+    parser.add_argument('-n', '--k8s-namespace',
+                       help=f'Namespace for the Kubernetes Secret manifest (default: global.namespace from --k8s-chart-values, or {DEFAULT_NAMESPACE})')
+    parser.add_argument('--k8s-chart-values', metavar='VALUES_FILE',
+                       help='foodios-chart values file to take the manifest namespace from, like foodios-chart/values/staging.yaml')
+    parser.add_argument('--stacks', nargs='+', metavar='STACK',
+                       help='Batch mode: generate a secrets file for each named stack as STACKS_DIR/STACK/<secrets_file name>')
+    parser.add_argument('--stacks-dir', default='config/stacks',
+                       help='Directory for per-stack secrets in batch mode (default: config/stacks)')
+    parser.add_argument('--seed',
+                       help='Generate reproducible secrets for test stacks from this seed (batch mode only; never use for production)')
+
     args = parser.parse_args()
-    
+
+    if args.seed is not None and not args.stacks:
+        parser.error("--seed can only be used with --stacks, so production secrets stay cryptographically random")
+    for stack_name in args.stacks or []:
+        if not validate_profile_name(stack_name):
+            parser.error(f"Stack name {stack_name} is not valid")
+    if not args.k8s_namespace:
+        try:
+            args.k8s_namespace = (chart_namespace(args.k8s_chart_values) if args.k8s_chart_values else None) or DEFAULT_NAMESPACE
+        except (OSError, yaml.YAMLError) as e:
+            parser.error(f"Could not read the namespace from {args.k8s_chart_values}: {e}")
+
     # Check if template file exists
     if not os.path.exists(args.template_file):
         print(f"Error: Template file '{args.template_file}' not found", file=sys.stderr)
@@ -66,93 +198,25 @@ def main():
     try:
         # Parse template to get secret configuration
         secret_config = parse_secret_template(args.template_file)
-        
-        # Read existing secrets and file content if file exists
-        existing_vars = {}
-        existing_content = ""
-        if os.path.exists(args.secrets_file):
-            existing_vars = read_env(args.secrets_file, interpolate=False)
-            with open(args.secrets_file, 'r') as f:
-                existing_content = f.read()
-        
-        # Generate only new secrets that don't exist
-        new_secrets = {}
-        external_secrets = []
-        
-        for var_name, config in secret_config.items():
-            # Skip if variable already exists in file
-            if var_name in existing_vars:
-                continue
-                
-            secret_type = config['type']
-            fixed_value = config['fixed_value']
-            
-            if secret_type == SecretType.FIXED_VALUE and fixed_value:
-                # Use fixed value
-                new_secrets[var_name] = fixed_value
-            elif secret_type == SecretType.EXTERNAL:
-                # External secrets need manual intervention
-                external_secrets.append(var_name)
-                new_secrets[var_name] = ""  # Empty placeholder
-            else:
-                # Generate new secret
-                generator = get_secret_generator(secret_type)
-                if generator:
-                    new_secrets[var_name] = generator()
-                else:
-                    print(f"Warning: Unknown secret type '{secret_type}' for {var_name}", file=sys.stderr)
-                    new_secrets[var_name] = ""
-        
-        # Build final content: existing content + new secrets
-        if existing_content:
-            # Start with existing content
-            output_content = existing_content
-            # Ensure it ends with a newline
-            if not output_content.endswith('\n'):
-                output_content += '\n'
-            
-            # Add new secrets if any
-            if new_secrets:
-                for var_name in secret_config.keys():  # Preserve template order for new variables
-                    if var_name in new_secrets:
-                        output_content += f"{var_name}={new_secrets[var_name]}\n"
-        else:
-            # No existing file, create from scratch
-            output_lines = []
-            for var_name, config in secret_config.items():
-                secret_type = config['type']
-                fixed_value = config['fixed_value']
-                
-                if secret_type == SecretType.FIXED_VALUE and fixed_value:
-                    value = fixed_value
-                elif secret_type == SecretType.EXTERNAL:
-                    if var_name not in external_secrets:
-                        external_secrets.append(var_name)
-                    value = ""
-                else:
-                    generator = get_secret_generator(secret_type)
-                    value = generator() if generator else ""
-                
-                output_lines.append(f"{var_name}={value}")
-            
-            output_content = '\n'.join(output_lines) + '\n'
-        
-        # Write to the secrets file
-        with open(args.secrets_file, 'w') as f:
-            f.write(output_content)
-        # Report what was done
-        if new_secrets:
-            print(f"Added {len(new_secrets)} new secrets to {args.secrets_file}", file=sys.stderr)
-        else:
-            print(f"All secrets already exist in {args.secrets_file}", file=sys.stderr)
-        
-        # Notify user about external secrets that need manual setup
-        if external_secrets:
-            print("\n❌  EXTERNAL SECRETS REQUIRED:", file=sys.stderr)
-            print("The following secrets are externally generated and must be manually added:", file=sys.stderr)
-            for var_name in external_secrets:
-                print(f"  - {var_name}: Edit {args.secrets_file} to provide this value", file=sys.stderr)
-            print(f"\nPlease edit {args.secrets_file} and set values for these external secrets.", file=sys.stderr)
+
+        if not args.stacks:
+            _, external_secrets = generate_secrets_file(secret_config, args.secrets_file)
+            if args.k8s_manifest:
+                update_k8s_manifest(secret_config, args.secrets_file, args.k8s_manifest, args.k8s_namespace)
+            report_external_secrets(external_secrets, args.secrets_file)
+            return
+
+        if args.seed is not None:
+            print("Warning: generating seeded, reproducible secrets; these are only suitable for test stacks", file=sys.stderr)
+        for stack_name in args.stacks:
+            stack_dir = os.path.join(args.stacks_dir, stack_name)
+            stack_secrets_file = os.path.join(stack_dir, os.path.basename(args.secrets_file))
+            rng = seeded_stack_random(args.seed, stack_name) if args.seed is not None else None
+            _, external_secrets = generate_secrets_file(secret_config, stack_secrets_file, rng)
+            if args.k8s_manifest:
+                stack_manifest = os.path.join(stack_dir, os.path.basename(args.k8s_manifest))
+                update_k8s_manifest(secret_config, stack_secrets_file, stack_manifest, args.k8s_namespace)
+            report_external_secrets(external_secrets, stack_secrets_file)
             
     except Exception as e:
         print(f"Error generating secrets: {e}", file=sys.stderr)
@@ -48,8 +48,12 @@ def get_branding():
     with open(branding_file, 'r') as f:
         return json5.load(f)
 
-def patch_google_services_content(template_content, profile):
-    branding = get_branding()
+def patch_google_services(template, profile, branding):
+    """Return template patched for profile's project and package name.
+
+    The parsed template is shared between profiles and is not modified: only the parts
+    that are patched (project_info and each android client_info) are copied into the result.
+    """
     gs_project_name = branding.get('code', {}).get('google_service_project_name', 'blueskyweb')
     if is_example:
         gs_project_name += '-example'
@@ -57,28 +61,29 @@ def patch_google_services_content(template_content, profile):
     package_name = branding.get('code', {}).get('web_package_id', 'xyz.blueskyweb.app')
     profile_suffix = PACKAGE_NAME_PROFILE_SUFFIXES.get(profile)
     profile_package_name = package_name + profile_suffix
-    gs = json.loads(template_content)
-    patched = False
-    old_project_id = gs['project_info']['project_id']
-    old_firebase_url = gs['project_info']['firebase_url']
-    gs['project_info']['project_id'] = gs_project_name
-    gs['project_info']['firebase_url'] = gs_firebase_url
-    patched = old_project_id != gs_project_name or old_firebase_url != gs_firebase_url
-    for client in gs.get('client', []):
-        android_client_info = client.get('client_info', {}).get('android_client_info', {})
-        if android_client_info and 'package_name' in android_client_info:
-            old_package_name = android_client_info.get('package_name')
-            android_client_info['package_name'] = profile_package_name
-            patched = old_package_name != old_package_name != profile_package_name
+    gs = dict(template)
+    project_info = gs['project_info']
+    patched = project_info['project_id'] != gs_project_name or project_info['firebase_url'] != gs_firebase_url
+    gs['project_info'] = {**project_info, 'project_id': gs_project_name, 'firebase_url': gs_firebase_url}
+    if 'client' in gs:
+        clients = []
+        for client in gs['client']:
+            android_client_info = client.get('client_info', {}).get('android_client_info', {})
+            if android_client_info and 'package_name' in android_client_info:
+                patched = patched or android_client_info['package_name'] != profile_package_name
+                client = {**client, 'client_info': {**client['client_info'],
+                          'android_client_info': {**android_client_info, 'package_name': profile_package_name}}}
+            clients.append(client)
+        gs['client'] = clients
     if not patched:
         print(f"No changes were made to google services content for {profile}", file=sys.stderr)
     return gs
-    
-def generate_google_services_for_profile(profile, template_content, args):
-    """Generate social-app environment file for a specific profile."""
+
+def generate_google_services_for_profile(profile, template, branding, args):
+    """Generate google-services json file for a specific profile from the parsed template."""
     output_path = get_output_path(profile, args)
 
-    gs_content = patch_google_services_content(template_content, profile)
+    gs_content = patch_google_services(template, profile, branding)
 
     if args.dry_run:
         if not args.silent:
@@ -88,14 +93,16 @@ def generate_google_services_for_profile(profile, template_content, args):
             print("-" * 40)
         return True
     
+    serialized_content = json.dumps(gs_content)
     # Ensure output directory exists
     output_path.parent.mkdir(parents=True, exist_ok=True)
     if output_path.exists():
         if not args.no_check:
             try:
                 with output_path.open('r') as f:
-                    existing_content = json.load(f)
-                matches = existing_content == gs_content
+                    existing_serialized = f.read()
+                # only fall back to comparing the parsed structure if the text differs
+                matches = existing_serialized == serialized_content or json.loads(existing_serialized) == gs_content
             except Exception as e:
                 print(f"Error reading {output_path} to check content; will assume differs: {e}")
                 matches = False
@@ -114,7 +121,7 @@ def generate_google_services_for_profile(profile, template_content, args):
             return not matches
     try:
         with output_path.open('w') as f:
-            json.dump(gs_content, f)
+            f.write(serialized_content)
         if not args.silent:
             print(f"✅ Generated: {output_path}")
     except Exception as e:
@@ -131,7 +138,7 @@ def main():
                "  %(prog)s -p prod                   # Generate for .env.prod\n"
                "  %(prog)s -p prod -p test           # Generate for multiple profiles\n"
                "  %(prog)s --test                    # Generate for .env.test\n"
-               "  %(prog)s -a                        # Generate for all existing profiles\n"
+               "  %(prog)s -a                        # Generate for all eas build profiles\n"
                "  %(prog)s -t custom.mustache        # Use custom template\n",
         formatter_class=argparse.RawDescriptionHelpFormatter
     )
@@ -183,6 +190,12 @@ def main():
         help='Shortcut for --profile development'
     )
 
+    parser.add_argument(
+        '-a', '--all-profiles',
+        action='store_true',
+        help='Generate for all eas build profiles (development, preview, testflight, production) in one pass'
+    )
+
     parser.add_argument(
         '-o', '--output', default=None,
         help='Override the filename to output (relative to target social-app directory; defaults to google-services.$profile.json)',
@@ -190,6 +203,9 @@ def main():
     
     args = parser.parse_args()
     
+    if args.all_profiles:
+        args.profiles += [profile for profile in PACKAGE_NAME_PROFILE_SUFFIXES if profile and profile not in args.profiles]
+
     # If no profiles specified, default to None (which means .env)
     if not args.profiles:
         parser.error("At least one profile must be specified")
@@ -200,10 +216,10 @@ def main():
         print(f"Error: Template file '{template_path}' not found", file=sys.stderr)
         return False
     
-    # Read template content
+    # Read and parse template content once for all profiles
     try:
         with open(template_path, 'r') as f:
-            template_content = f.read()
+            template = json.load(f)
     except Exception as e:
         print(f"Error reading template file {args.template_file}: {e}", file=sys.stderr)
         return False
@@ -215,10 +231,12 @@ def main():
             print("🔍 DRY RUN MODE - No files will be written")
         print()
     
+    branding = get_branding()
+
     # Process each profile
     success_count = 0
     for profile in args.profiles:
-        if generate_google_services_for_profile(profile, template_content, args):
+        if generate_google_services_for_profile(profile, template, branding, args):
             success_count += 1
     
     # Report results
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+"""
+Noise reduction for log_formatter: collapsing repeated records and sampling busy services.
+
+Records are fingerprinted with their volatile fields (times, pids, ids) removed, so the same
+message logged thousands of times a second is shown once, followed by a count of its repeats
+when its window ends. Sampling caps each service at a number of lines per second, reporting
+how many lines were dropped. Both keep memory bounded: the repeat tracker forgets the least
+recently seen fingerprints beyond max_entries, and the sampler keeps one bucket per service.
+Trackers are also kept in a heap by the start of their window, so ending windows costs
+O(log n) per window rather than a scan of every tracker per batch.
+"""
+
+import hashlib
+import heapq
+import itertools
+import json
+import time
+from collections import OrderedDict
+
+volatile_varnames = {'time', 'ts', 'pid', 'hostname', 'host', 'remote_ip', 'id', 'reqId', 'req_id', 'requestId', 'request_id',
+                     'traceId', 'trace_id', 'spanId', 'span_id', 'responseTime', 'response_time', 'duration_ms', 'latency_ms',
+                     'seq', 'cursor', 'req', 'res'}
+
+def is_volatile(varname):
+    return varname in volatile_varnames or varname.endswith('Id') or varname.endswith('_id')
+
+def fingerprint(service, log_obj):
+    """Digest of a record without its volatile fields"""
+    stable = {key: value for key, value in log_obj.items() if not is_volatile(key)}
+    content = json.dumps([service, stable], sort_keys=True, default=str, separators=(',', ':'))
+    return hashlib.blake2b(content.encode('utf-8'), digest_size=16).digest()
+
+class RepeatTracker:
+    def __init__(self, service_prefix, first_seen):
+        self.service_prefix = service_prefix
+        self.first_seen = first_seen
+        self.last_seen = first_seen
+        self.repeats = 0
+        self.msg = None
+
+    def summary(self):
+        duration = self.last_seen - self.first_seen
+        return (None, (self.service_prefix, None, f" [repeated {self.repeats} more times in {duration:.1f}s] {self.msg}\n"))
+
+class RepeatCollapser:
+    """Shows the first of identical records in each window of window seconds, then a line with the repeat count"""
+    def __init__(self, window=5., max_entries=10000):
+        self.window = window
+        self.max_entries = max_entries
+        self.trackers = OrderedDict()
+        # (first_seen, seq, key, tracker) by window start; entries whose tracker was replaced or evicted are skipped
+        self.expiry = []
+        self.seq = itertools.count()
+
+    def process(self, service, service_prefix, log_obj, now):
+        """Returns (show, summaries): whether to show this record, and summary lines for windows that ended"""
+        summaries = []
+        key = fingerprint(service, log_obj)
+        tracker = self.trackers.get(key)
+        if tracker is not None and now - tracker.first_seen > self.window:
+            del self.trackers[key]
+            if tracker.repeats:
+                summaries.append(tracker.summary())
+            tracker = None
+        if tracker is None:
+            tracker = self.trackers[key] = RepeatTracker(service_prefix, now)
+            tracker.msg = log_obj.get('msg', '')
+            heapq.heappush(self.expiry, (now, next(self.seq), key, tracker))
+            if len(self.expiry) > 2 * self.max_entries:
+                # drop the entries of trackers that are gone, so windows ended early don't pile up
+                self.expiry = [entry for entry in self.expiry if self.trackers.get(entry[2]) is entry[3]]
+                heapq.heapify(self.expiry)
+            if len(self.trackers) > self.max_entries:
+                _, evicted = self.trackers.popitem(last=False)
+                if evicted.repeats:
+                    summaries.append(evicted.summary())
+            return True, summaries
+        self.trackers.move_to_end(key)
+        tracker.repeats += 1
+        tracker.last_seen = now
+        return False, summaries
+
+    def expire(self, now):
+        """Summary lines for windows that have ended, oldest first"""
+        summaries = []
+        while self.expiry and now - self.expiry[0][0] > self.window:
+            _, _, key, tracker = heapq.heappop(self.expiry)
+            if self.trackers.get(key) is not tracker:
+                continue
+            del self.trackers[key]
+            if tracker.repeats:
+                summaries.append(tracker.summary())
+        return summaries
+
+    def finish(self):
+        summaries = [tracker.summary() for tracker in self.trackers.values() if tracker.repeats]
+        self.trackers.clear()
+        self.expiry.clear()
+        return summaries
+
+class ServiceSampler:
+    """Token bucket per service allowing rate lines per second, with bursts of up to one second's worth"""
+    def __init__(self, rate):
+        self.rate = rate
+        self.buckets = {}
+        self.dropped = {}
+
+    def allow(self, service_prefix, now):
+        tokens, last = self.buckets.get(service_prefix, (self.rate, now))
+        # time can step back between records of merged or replayed logs: that refills nothing
+        tokens = min(self.rate, tokens + max(0., now - last) * self.rate)
+        last = max(last, now)
+        if tokens >= 1:
+            self.buckets[service_prefix] = (tokens - 1, last)
+            return True
+        self.buckets[service_prefix] = (tokens, last)
+        self.dropped[service_prefix] = self.dropped.get(service_prefix, 0) + 1
+        return False
+
+    def report(self):
+        """Summary lines for lines dropped since the last report"""
+        summaries = [(None, (service_prefix, None, f" [sampled: dropped {count} lines over {self.rate:g}/s]\n"))
+                     for service_prefix, count in self.dropped.items()]
+        self.dropped.clear()
+        return summaries
+
+class NoiseReducer:
+    """Applies repeat collapsing and/or sampling to a stream of (line, parsed) pairs"""
+    def __init__(self, collapse_window=None, sample_rate=None, max_entries=10000, clock=time.monotonic, use_record_time=False):
+        self.collapser = RepeatCollapser(collapse_window, max_entries) if collapse_window else None
+        self.sampler = ServiceSampler(sample_rate) if sample_rate else None
+        self.clock = clock
+        self.last_report = None
+        # with use_record_time (for replays and merges of old logs), time follows the records' own times
+        # once they carry them; live logs use the clock, as their times can be skewed between services
+        self.use_record_time = use_record_time
+        self.record_time = None
+
+    def process(self, batch, service_name, record_timestamp):
+        """Filter a batch of (line, parsed) pairs, adding summary lines; with use_record_time, record times are used where known"""
+        output = []
+        now = self.record_time if self.record_time is not None else self.clock()
+        for line, parsed in batch:
+            if parsed is None:
+                output.append((line, parsed))
+                continue
+            service_prefix, log_obj, log_json = parsed
+            if self.use_record_time and log_obj is not None:
+                timestamp = record_timestamp(log_obj)
+                if timestamp is not None:
+                    now = self.record_time = timestamp
+            if self.collapser is not None and log_obj is not None:
+                show, summaries = self.collapser.process(service_name(service_prefix), service_prefix, log_obj, now)
+                output.extend(summaries)
+                if not show:
+                    continue
+            if self.sampler is not None and not self.sampler.allow(service_prefix, now):
+                continue
+            output.append((line, parsed))
+        output.extend(self.periodic(now))
+        return output
+
+    def periodic(self, now):
+        summaries = []
+        if self.collapser is not None:
+            summaries.extend(self.collapser.expire(now))
+        if self.sampler is not None:
+            if self.last_report is None:
+                self.last_report = now
+            elif now - self.last_report >= 1:
+                summaries.extend(self.sampler.report())
+                self.last_report = now
+        return summaries
+
+    def finish(self):
+        summaries = []
+        if self.collapser is not None:
+            summaries.extend(self.collapser.finish())
+        if self.sampler is not None:
+            summaries.extend(self.sampler.report())
+        return summaries
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+
+"""
+Export parsed log records to Parquet, partitioned by service and hour.
+
+The status line fields that log_formatter shows become typed columns (time, level, host,
+req_method, req_url, res_statusCode, msg) and the rest of each record is kept as JSON in an
+extra column. Files are laid out as DIR/service=<service>/hour=<YYYY-MM-DDTHH>/part-*.parquet
+(hive partitioning), so pyarrow.dataset, DuckDB or Spark only read the partitions a query asks
+for, and row groups of row_group_size records keep the column statistics useful for skipping.
+"""
+
+import datetime
+import json
+import os
+import re
+import time
+
+EXPORT_COLUMNS = ['time', 'level', 'host', 'req_method', 'req_url', 'res_statusCode', 'msg', 'extra']
+
+PINO_LEVELS = {'trace': 10, 'debug': 20, 'info': 30, 'warn': 40, 'error': 50, 'fatal': 60}
+
+def export_schema():
+    import pyarrow as pa
+    return pa.schema([
+        ('time', pa.timestamp('ms', tz='UTC')),
+        ('level', pa.int32()),
+        ('host', pa.string()),
+        ('req_method', pa.string()),
+        ('req_url', pa.string()),
+        ('res_statusCode', pa.int32()),
+        ('msg', pa.string()),
+        ('extra', pa.string()),
+    ])
+
+def as_int(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and value.isdigit():
+        return int(value)
+    return None
+
+def as_str(value):
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value)
+
+def export_row(log_obj, timestamp):
+    """
+    Split a record as parse_line returns it into the export columns. log_formatter's adjust_vars has
+    already moved req.method, req.url and res.statusCode up and re-encoded the rest of req and res,
+    which are decoded again here so extra holds one JSON document.
+    """
+    record = dict(log_obj)
+    if isinstance(record.get('req'), str) and isinstance(record.get('res'), str):
+        for key in ('req', 'res'):
+            try:
+                record[key] = json.loads(record[key])
+            except ValueError:
+                pass
+    for key in ('time', 'ts'):
+        record.pop(key, None)
+    level = record.pop('level', None)
+    host = record.pop('host', None)
+    if host is None:
+        host = record.pop('hostname', None)
+    row = {
+        'time': int(timestamp * 1000) if timestamp is not None else None,
+        'level': PINO_LEVELS.get(level) if isinstance(level, str) else as_int(level),
+        'host': as_str(host),
+        'req_method': as_str(record.pop('req_method', None)),
+        'req_url': as_str(record.pop('req_url', None)),
+        'res_statusCode': as_int(record.pop('res_statusCode', None)),
+        'msg': as_str(record.pop('msg', None)),
+    }
+    row['extra'] = json.dumps(record, default=str) if record else None
+    return row
+
+def hour_partition(timestamp):
+    if timestamp is None:
+        return 'unknown'
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime('%Y-%m-%dT%H')
+
+def hour_end(hour):
+    """End of an hour partition in epoch seconds, or None for records without a time"""
+    if hour == 'unknown':
+        return None
+    start = datetime.datetime.strptime(hour, '%Y-%m-%dT%H').replace(tzinfo=datetime.timezone.utc)
+    return start.timestamp() + 3600
+
+class ParquetExporter:
+    """
+    Buffers rows per (service, hour) partition and writes them as row groups of row_group_size,
+    keeping a writer open per partition until max_open_files are open. Files are written under a
+    temporary name and renamed when closed, so readers never see a file without its footer.
+
+    Once the records' times are more than late_seconds past the end of an hour, that hour's
+    partitions are written and their files closed; later records for it go to a new file. At most
+    max_buffered_rows are buffered across partitions, writing the largest buffer (as a smaller row
+    group) when there are more, so many quiet services can't hold the memory of many row groups.
+
+    The current hour and the records without a time never close that way, so every flush_seconds
+    (checked by maybe_flush, which the caller also runs while the input is idle) everything is
+    written and closed, and a crash loses at most that much.
+    """
+    def __init__(self, directory, row_group_size=65536, max_open_files=32, compression='zstd', max_buffered_rows=None, late_seconds=300,
+                 flush_seconds=300):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)") from None
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.schema = export_schema()
+        self.directory = directory
+        self.row_group_size = row_group_size
+        self.max_open_files = max_open_files
+        self.compression = compression
+        self.max_buffered_rows = max_buffered_rows or 4 * row_group_size
+        self.late_seconds = late_seconds
+        self.flush_seconds = flush_seconds
+        self.last_flush = time.monotonic()
+        self.buffers = {}
+        self.buffered_rows = 0
+        # partition -> (writer, temporary path, final path), least recently written first
+        self.writers = {}
+        self.last_timestamps = {}
+        self.latest_timestamp = None
+        self.file_prefix = f"part-{int(time.time())}-{os.getpid()}"
+        self.file_count = 0
+        self.rows = 0
+
+    def add(self, service, log_obj, timestamp=None, log_json=None):
+        """
+        Add a record with its time in epoch seconds; log_obj is None for a line that isn't JSON, which is
+        kept as its msg. Records without a time are put in the hour of the service's previous record.
+        """
+        if timestamp is None:
+            timestamp = self.last_timestamps.get(service)
+        else:
+            self.last_timestamps[service] = timestamp
+            if self.latest_timestamp is None or timestamp > self.latest_timestamp:
+                closed_hour = hour_partition(timestamp - self.late_seconds)
+                if self.latest_timestamp is not None and closed_hour != hour_partition(self.latest_timestamp - self.late_seconds):
+                    self.close_hours(timestamp - self.late_seconds)
+                self.latest_timestamp = timestamp
+        if log_obj is None:
+            row = dict.fromkeys(EXPORT_COLUMNS)
+            row['time'] = int(timestamp * 1000) if timestamp is not None else None
+            row['msg'] = (log_json or '').strip()
+        else:
+            row = export_row(log_obj, timestamp)
+        partition = (service, hour_partition(timestamp))
+        buffer = self.buffers.get(partition)
+        if buffer is None:
+            buffer = self.buffers[partition] = {column: [] for column in EXPORT_COLUMNS}
+        for column in EXPORT_COLUMNS:
+            buffer[column].append(row[column])
+        self.rows += 1
+        self.buffered_rows += 1
+        if len(buffer['msg']) >= self.row_group_size:
+            self.write(partition)
+        elif self.buffered_rows > self.max_buffered_rows:
+            self.write(max(self.buffers, key=lambda partition: len(self.buffers[partition]['msg'])))
+
+    def close_hours(self, before):
+        """Write and close the partitions of hours that ended before the given time"""
+        for partition in set(self.buffers) | set(self.writers):
+            end = hour_end(partition[1])
+            if end is not None and end <= before:
+                self.write(partition)
+                if partition in self.writers:
+                    self.close_writer(partition)
+
+    def write(self, partition):
+        buffer = self.buffers.pop(partition, None)
+        if not buffer or not buffer['msg']:
+            return
+        self.buffered_rows -= len(buffer['msg'])
+        table = self.pa.Table.from_pydict(buffer, schema=self.schema)
+        entry = self.writers.pop(partition, None)
+        if entry is None:
+            if len(self.writers) >= self.max_open_files:
+                self.close_writer(next(iter(self.writers)))
+            service, hour = partition
+            service = re.sub(r'[^\w.-]', '_', service) or '_'
+            partition_dir = os.path.join(self.directory, f"service={service}", f"hour={hour}")
+            os.makedirs(partition_dir, exist_ok=True)
+            self.file_count += 1
+            path = os.path.join(partition_dir, f"{self.file_prefix}-{self.file_count:04d}.parquet")
+            temp_path = os.path.join(partition_dir, f".{os.path.basename(path)}.tmp")
+            writer = self.pq.ParquetWriter(temp_path, self.schema, compression=self.compression)
+            entry = (writer, temp_path, path)
+        entry[0].write_table(table, row_group_size=self.row_group_size)
+        self.writers[partition] = entry
+
+    def close_writer(self, partition):
+        writer, temp_path, path = self.writers.pop(partition)
+        writer.close()
+        os.replace(temp_path, path)
+
+    def maybe_flush(self):
+        if time.monotonic() - self.last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        """Write what is buffered and finish every file; later records go to new files"""
+        for partition in list(self.buffers):
+            self.write(partition)
+        for partition in list(self.writers):
+            self.close_writer(partition)
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+"""
+Filter expressions for log_formatter.
+
+An expression is a list of terms that must all match, like
+    level>=40 service=pds res_statusCode>=500 req_url~/xrpc/
+Each term compares a field of the (adjusted) log record, or the service name, with a value:
+    =  !=  equal / not equal (numerically if both sides are numbers; other non-string values
+           compare as JSON, so active=true matches a JSON true)
+    >  >=  <  <=  numeric comparison
+    ~  !~  regular expression search / no match
+
+Lines without a `service |` prefix have neither a service nor fields (nor do lines that
+aren't JSON records have fields), so any term other than != and !~ drops them.
+
+Terms are compiled once into a predicate. Each term that needs a field to be present
+also contributes substrings that must appear in the raw line, so most lines can be
+rejected with a few substring searches before their JSON is decoded.
+"""
+
+import json
+import operator
+import re
+
+TERM_RE = re.compile(r'^([A-Za-z_][A-Za-z0-9_.]*)(!=|>=|<=|!~|=|>|<|~)(.*)$')
+
+NUMERIC_OPS = {'>': operator.gt, '>=': operator.ge, '<': operator.lt, '<=': operator.le}
+
+# a {m,n} quantifier is matched whole, so its digits aren't taken as literal text
+REGEX_SPECIAL_RE = re.compile(r'\{(\d*)(?:,\d*)?\}|\\.|\[(?:\\.|[^\]])*\]|[.^$*+?{}()|]')
+
+SERVICE_SUFFIX_RE = re.compile(r'-\d+$')
+
+def service_name(service_prefix):
+    """Service name from a docker compose prefix like 'pds-1  ', dropping the replica number"""
+    if service_prefix is None:
+        return None
+    return SERVICE_SUFFIX_RE.sub('', service_prefix.strip())
+
+def _number(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _raw_key(field):
+    """Key that appears in the raw JSON for a field, allowing for the req_/res_ fields that adjust_vars extracts"""
+    if field.startswith('req_') or field.startswith('res_'):
+        return field[4:]
+    return field.rsplit('.', 1)[-1]
+
+def _plain_in_json(text):
+    """Whether text appears verbatim in JSON-encoded strings, i.e. it has nothing that an encoder would escape"""
+    return all(' ' <= c <= '~' and c not in '"\\' for c in text)
+
+def regex_literal(pattern):
+    """Longest substring that any match of pattern must contain, or None if that can't be determined simply"""
+    literals = []
+    position = 0
+    for m in REGEX_SPECIAL_RE.finditer(pattern):
+        if m.group() in ('(', ')', '|'):
+            # groups and alternation can make any part optional
+            return None
+        literal = pattern[position:m.start()]
+        if m.group() in ('?', '*') or (m.group(1) is not None and not int(m.group(1) or 0)):
+            # the quantifier makes the preceding character optional
+            literal = literal[:-1]
+        literals.append(literal)
+        position = m.end()
+    literals.append(pattern[position:])
+    longest = max(literals, key=len)
+    return longest or None
+
+class FilterTerm:
+    def __init__(self, field, op, value):
+        self.field, self.op, self.value = field, op, value
+        self.number = _number(value)
+        if op in NUMERIC_OPS and self.number is None:
+            raise ValueError(f"{field}{op}{value}: {op} needs a numeric value")
+        self.regex = re.compile(value) if op in ('~', '!~') else None
+
+    def needles(self):
+        """Substrings that a raw line must contain for this term to match"""
+        if self.field == 'service' or self.op in ('!=', '!~'):
+            return []
+        needles = [f'"{_raw_key(self.field)}"']
+        if self.op == '=' and self.number is None and self.value and _plain_in_json(self.value):
+            needles.append(self.value)
+        elif self.op == '~':
+            literal = regex_literal(self.value)
+            if literal and _plain_in_json(literal):
+                needles.append(literal)
+        return needles
+
+    def matches_value(self, value):
+        if self.op in NUMERIC_OPS:
+            number = _number(value)
+            return number is not None and NUMERIC_OPS[self.op](number, self.number)
+        if self.regex is not None:
+            found = value is not None and self.regex.search(str(value)) is not None
+            return found if self.op == '~' else not found
+        if self.number is not None and _number(value) is not None:
+            equal = _number(value) == self.number
+        elif isinstance(value, str):
+            equal = value == self.value
+        else:
+            equal = value is not None and json.dumps(value, separators=(',', ':')) == self.value
+        return equal if self.op == '=' else not equal
+
+def _lookup(log_obj, field):
+    value = log_obj
+    for key in field.split('.'):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+class LogFilter:
+    """A compiled conjunction of filter terms"""
+    def __init__(self, terms, json_prefix=True):
+        self.terms = terms
+        service_terms = [term for term in terms if term.field == 'service']
+        field_terms = [term for term in terms if term.field != 'service']
+        self.needles = [needle for term in field_terms for needle in term.needles()]
+        self.byte_needles = [needle.encode('utf-8') for needle in self.needles]
+        # exact service names can be checked from the start of the line when docker's prefix is present
+        self.service_starts = None
+        if json_prefix:
+            for term in service_terms:
+                if term.op == '=':
+                    self.service_starts = term.value
+        self.service_starts_bytes = self.service_starts.encode('utf-8') if self.service_starts else None
+
+        def check_service(service):
+            return all(term.matches_value(service) for term in service_terms)
+        def check_fields(log_obj):
+            return all(term.matches_value(_lookup(log_obj, term.field)) for term in field_terms)
+        self.check_service = check_service
+        self.check_fields = check_fields
+
+    def prefilter(self, line):
+        """Cheap rejection of a raw text line; False means the line can't match"""
+        if self.service_starts is not None and not line.startswith(self.service_starts):
+            return False
+        for needle in self.needles:
+            if needle not in line:
+                return False
+        return True
+
+    def prefilter_bytes(self, line):
+        """As prefilter, for an undecoded line"""
+        if self.service_starts_bytes is not None and not line.startswith(self.service_starts_bytes):
+            return False
+        for needle in self.byte_needles:
+            if needle not in line:
+                return False
+        return True
+
+    def matches(self, service_prefix, log_obj):
+        """Full check of a parsed line; log_obj is None for lines that aren't JSON records"""
+        return self.check_service(service_name(service_prefix)) and self.check_fields(log_obj or {})
+
+def parse_term(expression):
+    m = TERM_RE.match(expression)
+    if not m:
+        raise ValueError(f"Can't parse filter {expression!r}; expected FIELD OP VALUE with OP one of = != > >= < <= ~ !~")
+    try:
+        return FilterTerm(*m.groups())
+    except re.error as e:
+        raise ValueError(f"{expression}: invalid regular expression: {e}")
+
+def compile_filter(expressions, json_prefix=True):
+    """Compile filter expressions (each possibly holding several space-separated terms) into a LogFilter, or None if there are none"""
+    terms = [parse_term(term) for expression in expressions for term in expression.split()]
+    if not terms:
+        return None
+    return LogFilter(terms, json_prefix)
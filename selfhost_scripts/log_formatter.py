@@ -3,7 +3,18 @@
 
 import json, sys, argparse
 import datetime
-import rich
+import heapq
+import itertools
+import os
+import select
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from env_utils import json_loads
+from log_filters import compile_filter, service_name
+
+# the modules for other inputs and outputs (log_stats, log_dedupe, docker_logs, opensearch_client,
+# log_traces, log_export) are imported by the modes that use them, so formatting stdin starts quickly
 
 status_line_varnames = ['time', 'ts', 'level', 'pid', 'remote_ip', 'host', 'hostname', 'name', 'status', 'req_method', 'req_url', 'res_statusCode', 'msg']
 req_extract_vars = ['method', 'url', 'query', 'params']
@@ -22,43 +33,583 @@ def adjust_vars(record):
         record['res'] = json.dumps(res)
     return record
 
-def main(args):
-    for line in sys.stdin:
-        if not '|' in line and not args.no_json_prefix:
-            sys.stdout.write(line)
+def extract_status_vars(log_obj):
+    """Pop the status line variables out of log_obj, converting timestamps to datetimes"""
+    status_vars = {}
+    for varname in status_line_varnames:
+        if varname in log_obj:
+            value = log_obj.pop(varname)
+            if varname == 'time' and type(value) == int:
+                value = datetime.datetime.fromtimestamp(value/1000.)
+            elif varname == 'ts' and type(value) == float:
+                value = datetime.datetime.fromtimestamp(value)
+            status_vars[varname] = value
+    return status_vars
+
+def parse_line(line, args, default_service_prefix=None):
+    """Split a line into (service_prefix, log_obj, log_json); log_obj is None if the line isn't JSON.
+    Returns None for lines without a service prefix, which are passed through unchanged."""
+    if not '|' in line and not args.no_json_prefix:
+        return None
+    if args.no_json_prefix:
+        service_prefix, log_json = default_service_prefix or args.default_service_prefix, line
+    else:
+        service_prefix, log_json = line.split('|',1)
+    try:
+        log_obj = json_loads(log_json)
+    except Exception as e:
+        return service_prefix, None, log_json
+    if not isinstance(log_obj, dict):
+        return service_prefix, None, log_json
+    return service_prefix, adjust_vars(log_obj), log_json
+
+def record_timestamp(log_obj):
+    """Get a record's time as epoch seconds from pino's `time` (ms), a float `ts` (s) or an ISO `time` string"""
+    value = log_obj.get('time')
+    if value is None:
+        value = log_obj.get('ts')
+        if isinstance(value, (int, float)):
+            return float(value)
+    elif isinstance(value, (int, float)):
+        return value / 1000.
+    if isinstance(value, str):
+        try:
+            return datetime.datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+        except ValueError:
+            pass
+    return None
+
+def format_status_line(status_vars):
+    return ' '.join([f"{varname}={value}" for varname, value in status_vars.items()])
+
+class RichRenderer:
+    """The original rendering: rich markup and pretty-printing for every record"""
+    def __init__(self, trace_url=None):
+        import rich
+        self.rich = rich
+        self.trace_url = trace_url
+
+    def passthrough(self, line):
+        sys.stdout.write(line)
+
+    def raw(self, service_prefix, log_json):
+        self.rich.print(f"[bold green]{service_prefix}[/bold green]|", end='')
+        print(log_json.rstrip())
+
+    def record(self, service_prefix, status_vars, log_obj):
+        trace_id = status_vars.pop('trace', None)
+        status_line = format_status_line(status_vars)
+        if trace_id:
+            status_line += f" trace=[link={self.trace_url}/trace/{trace_id}]{trace_id[:7]}[/link]"
+        self.rich.print(f"[bold green]{service_prefix}[/bold green]|", status_line, log_obj)
+
+    def flush(self):
+        sys.stdout.flush()
+
+    def goodbye(self):
+        self.rich.print("[bold blue]Goodbye[/bold blue]")
+
+class PlainRenderer:
+    """Unstyled output, batched into a single write per input chunk; used when stdout is not a terminal"""
+    def __init__(self, trace_url=None):
+        self.pending = []
+        self.trace_url = trace_url
+
+    def format_prefix(self, service_prefix):
+        return f"{service_prefix}|"
+
+    def format_status_var(self, varname, value):
+        if varname == 'trace':
+            # the short trace id, as the Jaeger UI shows it
+            return f"trace={value[:7]}"
+        return f"{varname}={value}"
+
+    def passthrough(self, line):
+        self.pending.append(line)
+
+    def raw(self, service_prefix, log_json):
+        self.pending.append(f"{self.format_prefix(service_prefix)}{log_json.rstrip()}\n")
+
+    def record(self, service_prefix, status_vars, log_obj):
+        status_line = ' '.join([self.format_status_var(varname, value) for varname, value in status_vars.items()])
+        # the rest of the record as JSON, so piped output can still be parsed
+        self.pending.append(f"{self.format_prefix(service_prefix)} {status_line} {json.dumps(log_obj, ensure_ascii=False, default=str)}\n")
+
+    def flush(self):
+        if self.pending:
+            sys.stdout.write(''.join(self.pending))
+            self.pending.clear()
+        sys.stdout.flush()
+
+    def goodbye(self):
+        self.flush()
+
+class AnsiRenderer(PlainRenderer):
+    """Fast terminal output: rich renders each distinct service prefix once, everything else uses precompiled ANSI formats"""
+    status_var_format = "\x1b[36m{}\x1b[0m={}"
+    level_formats = [(50, "\x1b[36mlevel\x1b[0m=\x1b[1;31m{}\x1b[0m"), (40, "\x1b[36mlevel\x1b[0m=\x1b[33m{}\x1b[0m"), (0, "\x1b[36mlevel\x1b[0m={}")]
+    msg_format = "\x1b[36mmsg\x1b[0m=\x1b[1m{}\x1b[0m"
+    # an OSC 8 hyperlink to the trace in the Jaeger UI
+    trace_format = "\x1b[36mtrace\x1b[0m=\x1b]8;;{}/trace/{}\x1b\\{}\x1b]8;;\x1b\\"
+
+    def __init__(self, trace_url=None):
+        super().__init__(trace_url)
+        from rich.console import Console
+        self.console = Console(force_terminal=True)
+        self.prefixes = {}
+
+    def format_prefix(self, service_prefix):
+        prefix = self.prefixes.get(service_prefix)
+        if prefix is None:
+            with self.console.capture() as capture:
+                self.console.print(f"[bold green]{service_prefix}[/bold green]|", end='', markup=True, highlight=False)
+            prefix = self.prefixes[service_prefix] = capture.get()
+        return prefix
+
+    def format_status_var(self, varname, value):
+        if varname == 'level' and isinstance(value, int):
+            for min_level, level_format in self.level_formats:
+                if value >= min_level:
+                    return level_format.format(value)
+        elif varname == 'msg':
+            return self.msg_format.format(value)
+        elif varname == 'trace':
+            return self.trace_format.format(self.trace_url, value, value[:7])
+        return self.status_var_format.format(varname, value)
+
+    def goodbye(self):
+        self.flush()
+        sys.stdout.write("\x1b[1;34mGoodbye\x1b[0m\n")
+
+def renderer_trace_url(args):
+    """The Jaeger UI URL to link records' traces to, or None if traces aren't shown"""
+    if not args.trace_links:
+        return None
+    from log_traces import default_jaeger_url
+    return args.jaeger_url or default_jaeger_url()
+
+def make_renderer(args):
+    if not sys.stdout.isatty():
+        return PlainRenderer(renderer_trace_url(args))
+    if args.fast:
+        return AnsiRenderer(renderer_trace_url(args))
+    return RichRenderer(renderer_trace_url(args))
+
+# a quiet live stream still yields an empty batch this often, so stats snapshots and repeat summaries are written on time
+IDLE_TIMEOUT = 1.
+
+def read_line_batches(f, prefilter=None, idle_timeout=None):
+    """Yield lists of complete lines, one list per read from f, so output can be flushed once per batch
+    without delaying lines when the input is idle. Lines that prefilter rejects are dropped before decoding.
+    With idle_timeout, an empty list is yielded whenever no input arrived for that many seconds."""
+    fd = f.fileno()
+    partial = b''
+    while True:
+        if idle_timeout is not None and not select.select([fd], [], [], idle_timeout)[0]:
+            yield []
             continue
-        if args.no_json_prefix:
-            service_prefix, log_json = args.default_service_prefix, line
+        chunk = os.read(fd, 1 << 16)
+        if not chunk:
+            break
+        lines = (partial + chunk).split(b'\n')
+        partial = lines.pop()
+        if prefilter is not None:
+            lines = [line for line in lines if prefilter(line)]
+        yield [line.decode('utf-8', errors='replace') + '\n' for line in lines]
+    if partial and (prefilter is None or prefilter(partial)):
+        yield [partial.decode('utf-8', errors='replace')]
+
+def filter_accepts(log_filter, parsed):
+    if log_filter is None:
+        return True
+    if parsed is None:
+        return log_filter.matches(None, None)
+    return log_filter.matches(parsed[0], parsed[1])
+
+def render_parsed(line, parsed, renderer):
+    if parsed is None:
+        renderer.passthrough(line)
+        return
+    service_prefix, log_obj, log_json = parsed
+    if log_obj is None:
+        renderer.raw(service_prefix, log_json)
+        return
+    status_vars = extract_status_vars(log_obj)
+    if renderer.trace_url is not None:
+        from log_traces import record_trace_id
+        trace_id = record_trace_id(log_obj)
+        if trace_id:
+            status_vars['trace'] = trace_id
+    renderer.record(service_prefix, status_vars, log_obj)
+
+def index_traces(trace_index, batch):
+    """Add the lines of a batch that carry a trace id to the trace index, before rendering takes their records apart"""
+    from log_traces import record_trace_id
+    entries = []
+    for line, parsed in batch:
+        if parsed is None or parsed[1] is None:
+            continue
+        trace_id = record_trace_id(parsed[1])
+        if trace_id:
+            # stored with the service prefix even with --no-json-prefix, so it can be shown without the original options
+            entries.append((trace_id, f"{parsed[0]}|{parsed[2].rstrip(chr(10))}\n"))
+    trace_index.add(entries)
+
+def show_trace(args, renderer):
+    """Render the indexed lines of the traces matching args.trace (a full or short trace id, or a Jaeger trace URL)"""
+    from log_traces import TraceIndex, default_jaeger_url, parse_trace_arg
+    prefix = parse_trace_arg(args.trace)
+    if prefix is None:
+        print(f"Error: {args.trace!r} is not a trace id", file=sys.stderr)
+        sys.exit(1)
+    trace_index = TraceIndex(args.trace_index)
+    try:
+        trace_ids = trace_index.find(prefix)
+        if not trace_ids:
+            print(f"No logs indexed for trace {prefix} in {args.trace_index}", file=sys.stderr)
+            sys.exit(1)
+        indexed_args = argparse.Namespace(no_json_prefix=False, default_service_prefix=args.default_service_prefix)
+        jaeger_url = args.jaeger_url or default_jaeger_url()
+        for trace_id in trace_ids:
+            lines = trace_index.lines(trace_id)
+            print(f"Trace {jaeger_url}/trace/{trace_id}: {len(lines)} lines", file=sys.stderr)
+            for line in lines:
+                render_parsed(line, parse_line(line, indexed_args), renderer)
+            renderer.flush()
+    finally:
+        trace_index.close()
+
+def timestamped_lines(path, args, log_filter=None):
+    """
+    Yield (timestamp, line, parsed) for each line of path in time order, using a bounded reorder window
+    to fix up local disorder. Lines without a timestamp keep the timestamp of the line before them.
+    """
+    service_prefix = os.path.splitext(os.path.basename(path))[0] if path != '-' else None
+    f = sys.stdin if path == '-' else open(path, 'r', errors='replace')
+    window, seq, last_timestamp = [], itertools.count(), float('-inf')
+    with f:
+        for line in f:
+            if log_filter is not None and not log_filter.prefilter(line):
+                continue
+            parsed = parse_line(line, args, service_prefix)
+            if not filter_accepts(log_filter, parsed):
+                continue
+            timestamp = record_timestamp(parsed[1]) if parsed and parsed[1] is not None else None
+            if timestamp is None:
+                timestamp = last_timestamp
+            last_timestamp = timestamp
+            heapq.heappush(window, (timestamp, next(seq), line, parsed))
+            if len(window) > args.reorder_window:
+                timestamp, _, line, parsed = heapq.heappop(window)
+                yield timestamp, line, parsed
+    while window:
+        timestamp, _, line, parsed = heapq.heappop(window)
+        yield timestamp, line, parsed
+
+def merge_sources(paths, args, log_filter=None):
+    """K-way merge of the time-ordered sources, holding one pending line per source in a heap"""
+    sources = [timestamped_lines(path, args, log_filter) for path in paths]
+    heap = []
+    for index, source in enumerate(sources):
+        for timestamp, line, parsed in itertools.islice(source, 1):
+            heap.append((timestamp, index, line, parsed))
+    heapq.heapify(heap)
+    while heap:
+        timestamp, index, line, parsed = heap[0]
+        yield line, parsed
+        for timestamp, line, parsed in itertools.islice(sources[index], 1):
+            heapq.heapreplace(heap, (timestamp, index, line, parsed))
+            break
         else:
-            service_prefix, log_json = line.split('|',1)
-            service_name = service_prefix.strip()
-        try:
-            log_obj = json.loads(log_json)
-        except Exception as e:
-            rich.print(f"[bold green]{service_prefix}[/bold green]|", end='')
-            print(log_json.rstrip())
+            heapq.heappop(heap)
+
+# fields that fluent-bit stores and the formatter needs; the rest of each document isn't fetched
+opensearch_source_fields = ['log', 'service_name', 'container_name']
+
+def opensearch_hit_line(hit):
+    """Turn a fluent-bit log document back into the `service | message` line that docker would have produced"""
+    source = hit.get('_source', {})
+    service = source.get('service_name') or source.get('container_name') or 'opensearch'
+    log = source.get('log')
+    if not isinstance(log, str):
+        log = json.dumps(source)
+    return f"{service} | {log.rstrip()}\n"
+
+def opensearch_line_batches(args):
+    """Yield a list of lines per page of an OpenSearch search, fetching the next page while the current one is handled"""
+    from opensearch_client import OpenSearchClient, prefetch
+    client = OpenSearchClient(args.opensearch)
+    filters = [{'range': {'@timestamp': {'gte': args.since, 'lte': args.until}}}]
+    if args.query:
+        filters.append({'query_string': {'query': args.query}})
+    body = {
+        'query': {'bool': {'filter': filters}},
+        'sort': [{'@timestamp': 'asc'}],
+        '_source': opensearch_source_fields,
+    }
+    for hits in prefetch(client.pit_search(args.index, body, args.page_size)):
+        yield [opensearch_hit_line(hit) for hit in hits]
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def parsed_batches(args, log_filter=None):
+    """Yield lists of (line, parsed) from the input, after filtering; output is flushed after each list"""
+    if args.merge:
+        yield from batched(merge_sources(args.merge, args, log_filter), 1000)
+        return
+    if args.docker_logs is not None or args.opensearch is not None:
+        if args.opensearch is not None:
+            line_batches = opensearch_line_batches(args)
+        else:
+            from docker_logs import DEFAULT_CONTAINERS_DIR, DockerLogTailer
+            line_batches = DockerLogTailer(args.docker_logs or DEFAULT_CONTAINERS_DIR, args.checkpoint, args.from_start, args.docker_service).line_batches(follow=not args.no_follow, idle=True)
+        for lines in line_batches:
+            batch = []
+            for line in lines:
+                if log_filter is not None and not log_filter.prefilter(line):
+                    continue
+                parsed = parse_line(line, args)
+                if filter_accepts(log_filter, parsed):
+                    batch.append((line, parsed))
+            yield batch
+        return
+    prefilter = log_filter.prefilter_bytes if log_filter is not None else None
+    for lines in read_line_batches(sys.stdin, prefilter, IDLE_TIMEOUT):
+        batch = []
+        for line in lines:
+            parsed = parse_line(line, args)
+            if filter_accepts(log_filter, parsed):
+                batch.append((line, parsed))
+        yield batch
+
+def chunk_boundaries(path, chunk_size):
+    """Split a file into (start, end) byte ranges of about chunk_size, each ending at a line boundary"""
+    size = os.path.getsize(path)
+    boundaries = []
+    start = 0
+    with open(path, 'rb') as f:
+        while start < size:
+            end = min(start + chunk_size, size)
+            if end < size:
+                f.seek(end)
+                f.readline()
+                end = f.tell()
+            boundaries.append((start, end))
+            start = end
+    return boundaries
+
+_worker_filters = {}
+
+def replay_chunk(task):
+    """
+    Decode and filter one chunk of a replayed file in a worker process. Depending on output, returns
+    the rendered text (output is a PlainRenderer class), RequestStats ('stats') or (line, parsed) pairs ('parsed')
+    """
+    path, start, end, args, output = task
+    # compiled filters hold closures, so each worker compiles its own
+    where = tuple(args.where)
+    if where not in _worker_filters:
+        _worker_filters[where] = compile_filter(where, json_prefix=not args.no_json_prefix)
+    log_filter = _worker_filters[where]
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    raw_lines = data.split(b'\n')
+    if not raw_lines[-1]:
+        raw_lines.pop()
+    if log_filter is not None:
+        raw_lines = [line for line in raw_lines if log_filter.prefilter_bytes(line)]
+    if output == 'stats':
+        from log_stats import RequestStats
+        stats = RequestStats(args.stats_max_routes)
+    else:
+        stats = None
+    renderer = output(renderer_trace_url(args)) if isinstance(output, type) else None
+    results = []
+    for raw_line in raw_lines:
+        line = raw_line.decode('utf-8', errors='replace') + '\n'
+        parsed = parse_line(line, args)
+        if not filter_accepts(log_filter, parsed):
+            continue
+        if stats is not None:
+            if parsed is not None and parsed[1] is not None:
+                stats.add(service_name(parsed[0]), parsed[1])
+        elif renderer is not None:
+            render_parsed(line, parsed, renderer)
+        else:
+            results.append((line, parsed))
+    if stats is not None:
+        return stats
+    if renderer is not None:
+        return ''.join(renderer.pending)
+    return results
+
+def replay(args, renderer, stats=None, noise_reducer=None, trace_index=None, exporter=None):
+    """Decode a large file in chunks across a process pool, handling the results in file order.
+    At most two chunks per worker are in flight, so memory doesn't grow with the file."""
+    if stats is not None:
+        output = 'stats'
+    elif isinstance(renderer, PlainRenderer) and noise_reducer is None and trace_index is None and exporter is None:
+        output = type(renderer)
+    else:
+        output = 'parsed'
+    jobs = args.jobs or os.cpu_count() or 1
+    tasks = iter([(args.replay, start, end, args, output) for start, end in chunk_boundaries(args.replay, args.chunk_size << 20)])
+    with ProcessPoolExecutor(jobs) as executor:
+        in_flight = deque(executor.submit(replay_chunk, task) for task in itertools.islice(tasks, 2 * jobs))
+        while in_flight:
+            result = in_flight.popleft().result()
+            for task in itertools.islice(tasks, 1):
+                in_flight.append(executor.submit(replay_chunk, task))
+            if stats is not None:
+                stats.current.merge(result)
+            elif output == 'parsed':
+                if trace_index is not None:
+                    index_traces(trace_index, result)
+                if exporter is not None:
+                    export_batch(exporter, result)
+                    continue
+                if noise_reducer is not None:
+                    result = noise_reducer.process(result, service_name, record_timestamp)
+                for line, parsed in result:
+                    render_parsed(line, parsed, renderer)
+                renderer.flush()
+            else:
+                renderer.passthrough(result)
+                renderer.flush()
+    if stats is not None:
+        stats.finish()
+    elif noise_reducer is not None:
+        finish_noise_reducer(noise_reducer, renderer)
+
+def export_batch(exporter, batch):
+    for line, parsed in batch:
+        if parsed is None:
             continue
-        log_obj = adjust_vars(log_obj)
-        status_vars = {}
-        for varname in status_line_varnames:
-            if varname in log_obj:
-                value = log_obj.pop(varname)
-                if varname == 'time' and type(value) == int:
-                    value = datetime.datetime.fromtimestamp(value/1000.)
-                elif varname == 'ts' and type(value) == float:
-                    value = datetime.datetime.fromtimestamp(value)
-                status_vars[varname] = value
-        status_line = ' '.join([f"{varname}={status_vars[varname]}" for varname in status_line_varnames if varname in status_vars])
-        rich.print(f"[bold green]{service_prefix}[/bold green]|", status_line, log_obj)
+        service_prefix, log_obj, log_json = parsed
+        timestamp = record_timestamp(log_obj) if log_obj is not None else None
+        exporter.add(service_name(service_prefix), log_obj, timestamp, log_json)
+    exporter.maybe_flush()
+
+def finish_noise_reducer(noise_reducer, renderer):
+    for line, parsed in noise_reducer.finish():
+        render_parsed(line, parsed, renderer)
+    renderer.flush()
+
+def main(args, renderer, log_filter=None, stats=None, noise_reducer=None, trace_index=None, exporter=None):
+    if args.trace:
+        show_trace(args, renderer)
+        return
+    if args.replay:
+        replay(args, renderer, stats, noise_reducer, trace_index, exporter)
+        return
+    for batch in parsed_batches(args, log_filter):
+        if trace_index is not None:
+            index_traces(trace_index, batch)
+        if exporter is not None:
+            export_batch(exporter, batch)
+            continue
+        if stats is not None:
+            for line, parsed in batch:
+                if parsed is not None and parsed[1] is not None:
+                    stats.add(service_name(parsed[0]), parsed[1])
+            stats.maybe_snapshot()
+            continue
+        if noise_reducer is not None:
+            batch = noise_reducer.process(batch, service_name, record_timestamp)
+        for line, parsed in batch:
+            render_parsed(line, parsed, renderer)
+        renderer.flush()
+    if stats is not None:
+        stats.finish()
+    elif noise_reducer is not None:
+        finish_noise_reducer(noise_reducer, renderer)
 
 if __name__ == '__main__':
    parser = argparse.ArgumentParser()
    parser.add_argument('--no-json-prefix', action='store_true', help='Read JSON from each line rather than the service prefix that docker produces')
    parser.add_argument('--default-service-prefix', default='stdout', help='Use this as the service prefix for output when none is supplied')
+   parser.add_argument('--fast', action='store_true', help='Render with precompiled ANSI formats rather than rich, for high log volumes (rich is never used when stdout is not a terminal)')
+   parser.add_argument('--merge', nargs='+', metavar='FILE', help='Merge these log files (- for stdin) into one time-ordered stream, rather than formatting stdin as it arrives; with --no-json-prefix, each file name is used as its service prefix')
+   parser.add_argument('--reorder-window', type=int, default=1000, help='Number of lines per merged file that may be buffered to put out-of-order lines back in time order (default: 1000)')
+   parser.add_argument('--docker-logs', nargs='?', const='', metavar='CONTAINERS_DIR', help='Tail the json-file logs of all containers directly (default directory: /var/lib/docker/containers) rather than reading stdin, resuming from the last saved offsets')
+   parser.add_argument('--docker-service', action='append', metavar='SERVICE', help='With --docker-logs, only read logs of this service (may be repeated)')
+   parser.add_argument('--checkpoint', help='With --docker-logs, file to save log offsets in (default: ~/.cache/bluesky-selfhost/docker-log-offsets.json)')
+   parser.add_argument('--from-start', action='store_true', help='With --docker-logs, read logs without a saved offset from the beginning rather than from their end')
+   parser.add_argument('--no-follow', action='store_true', help='With --docker-logs, exit once all logs have been read')
+   parser.add_argument('--opensearch', nargs='?', const='', metavar='URL', help='Search the logs that fluent-bit stored in OpenSearch rather than reading stdin (default URL: http://$OPENSEARCH_HOST, or localhost:9200)')
+   parser.add_argument('--index', default='logs-*', help='With --opensearch, the indices to search (default: logs-*)')
+   parser.add_argument('--since', default='now-15m', help='With --opensearch, earliest time to show, as a date or date math like now-2d (default: now-15m)')
+   parser.add_argument('--until', default='now', help='With --opensearch, latest time to show (default: now)')
+   parser.add_argument('--query', help='With --opensearch, a query string to search for, like \'service_name:pds AND level:50\'')
+   parser.add_argument('--page-size', type=int, default=2000, help='With --opensearch, number of records fetched per request (default: 2000)')
+   parser.add_argument('--replay', metavar='FILE', help='Format a saved log file, decoding chunks of it in parallel and writing the output in order')
+   parser.add_argument('-j', '--jobs', type=int, help='Worker processes for --replay (default: number of CPUs)')
+   parser.add_argument('--chunk-size', type=int, default=8, help='Size in MB of the chunks that --replay workers decode (default: 8)')
+   parser.add_argument('-w', '--where', action='append', default=[], metavar='FILTER', help='Only show records matching all of these space-separated terms, like "level>=40 service=pds res_statusCode>=500 req_url~/xrpc/"; operators are = != > >= < <= ~ (regex) !~; lines without a "service |" prefix are dropped by any term but != and !~')
+   parser.add_argument('--collapse', type=float, metavar='SECONDS', help='Show only the first of identical records (ignoring times, pids and ids) in each window of this many seconds, then the number of repeats')
+   parser.add_argument('--sample', type=float, metavar='RATE', help='Show at most this many lines per second from each service, reporting how many were dropped')
+   parser.add_argument('--stats', action='store_true', help='Rather than formatting records, print request counts, status codes and response time percentiles per service and route')
+   parser.add_argument('--stats-interval', type=float, default=10., help='Seconds between --stats snapshots (default: 10)')
+   parser.add_argument('--stats-top', type=int, default=20, help='Number of busiest routes in each --stats snapshot (default: 20)')
+   parser.add_argument('--stats-max-routes', type=int, default=200, help='Routes tracked per service before the rest are counted as (other) (default: 200)')
+   parser.add_argument('--trace-index', nargs='?', const='', metavar='FILE', help='Keep the lines that carry a trace id, indexed by trace id, in this SQLite file (default: ~/.cache/bluesky-selfhost/log-traces.sqlite), for --trace')
+   parser.add_argument('--trace-index-max-mb', type=int, default=1024, help='Size in MB of the lines kept for --trace-index; older lines are dropped in halves (default: 1024)')
+   parser.add_argument('--trace', metavar='TRACE_ID', help='Show the lines in --trace-index for this trace, given as a full or 7 character short trace id or a Jaeger trace URL, rather than reading logs')
+   parser.add_argument('--trace-links', action='store_true', help='Show the short trace id of records that have one, linked to the trace in the Jaeger UI on terminals')
+   parser.add_argument('--jaeger-url', help='Jaeger UI URL for trace links (default: $JAEGER_URL, or http://localhost:16686)')
+   parser.add_argument('--export-parquet', metavar='DIR', help='Rather than formatting records, write them to Parquet files under DIR/service=<service>/hour=<hour>/, with the status line fields as typed columns and the rest of each record as JSON (needs pyarrow)')
+   parser.add_argument('--row-group-size', type=int, default=65536, help='Records per Parquet row group with --export-parquet (default: 65536)')
+   parser.add_argument('--export-max-buffered-rows', type=int, help='Records buffered across partitions with --export-parquet before the largest is written as a smaller row group (default: 4 row groups)')
+   parser.add_argument('--export-flush-interval', type=float, default=300., help='Seconds between writing and closing every open --export-parquet file, so a crash loses no more (default: 300)')
    args = parser.parse_args()
+   if args.export_parquet and args.stats:
+       parser.error('--export-parquet can\'t be combined with --stats')
+   if args.trace_index == '' or (args.trace and not args.trace_index):
+       from log_traces import get_trace_index_file
+       args.trace_index = str(get_trace_index_file())
+   if args.trace_index and args.replay and args.stats:
+       parser.error('--trace-index can\'t be combined with --replay and --stats')
+   try:
+       log_filter = compile_filter(args.where, json_prefix=not args.no_json_prefix)
+   except ValueError as e:
+       parser.error(str(e))
+   renderer = make_renderer(args)
+   stats = noise_reducer = trace_index = exporter = None
+   if args.stats:
+       from log_stats import StatsReporter
+       stats = StatsReporter(args.stats_interval, args.stats_top, args.stats_max_routes)
+   if (args.collapse or args.sample) and not (args.stats or args.export_parquet):
+       from log_dedupe import NoiseReducer
+       noise_reducer = NoiseReducer(args.collapse, args.sample, use_record_time=bool(args.replay or args.merge))
+   if args.trace_index and not args.trace:
+       from log_traces import TraceIndex
+       trace_index = TraceIndex(args.trace_index, args.trace_index_max_mb << 20)
+   if args.export_parquet and not args.trace:
+       from log_export import ParquetExporter
+       try:
+           exporter = ParquetExporter(args.export_parquet, args.row_group_size, max_buffered_rows=args.export_max_buffered_rows,
+                                      flush_seconds=args.export_flush_interval)
+       except RuntimeError as e:
+           parser.error(str(e))
    try:
-       main(args)
+       main(args, renderer, log_filter, stats, noise_reducer, trace_index, exporter)
    except KeyboardInterrupt:
-       rich.print("[bold blue]Goodbye[/bold blue]")
+       if stats is not None:
+           stats.finish()
+       elif noise_reducer is not None:
+           finish_noise_reducer(noise_reducer, renderer)
+       renderer.goodbye()
        sys.exit()
-
+   finally:
+       if exporter is not None:
+           exporter.close()
+           print(f"Exported {exporter.rows} records to {args.export_parquet}", file=sys.stderr)
+       if trace_index is not None:
+           trace_index.close()
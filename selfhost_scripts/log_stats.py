@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+
+"""
+Streaming request statistics for log_formatter.
+
+Aggregates request counts, status codes and response time percentiles per service and route
+from pino-style records, in memory bounded by the number of routes tracked. Response times go
+into a log-bucketed sketch (as in DDSketch) with a fixed relative error, which, unlike a reservoir
+of samples, can be merged exactly, so per-interval stats can be folded into running totals.
+"""
+
+import math
+import re
+import sys
+import time
+
+# response time fields in milliseconds, in order of preference
+latency_varnames = ['responseTime', 'response_time', 'duration_ms', 'latency_ms']
+
+OTHER_ROUTE = '(other)'
+
+ID_SEGMENT_RE = re.compile(r'^(?:\d+|[0-9a-f]{8,}|did:[a-z]+:[A-Za-z0-9._:%-]+|[0-9a-f-]{36})$', re.IGNORECASE)
+
+class LatencySketch:
+    """Mergeable quantile sketch: values are counted in buckets whose bounds grow geometrically,
+    so any quantile is reported within relative_accuracy of the true value"""
+    def __init__(self, relative_accuracy=0.01, max_buckets=2048):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.max_buckets = max_buckets
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+        self.max = 0.
+
+    def add(self, value, count=1):
+        self.count += count
+        if value > self.max:
+            self.max = value
+        if value <= 0:
+            self.zero_count += count
+            return
+        key = math.ceil(math.log(value) / self.log_gamma)
+        self.buckets[key] = self.buckets.get(key, 0) + count
+        if len(self.buckets) > self.max_buckets:
+            self._collapse()
+
+    def _collapse(self):
+        """Fold the lowest buckets together, losing accuracy only for the smallest values"""
+        keys = sorted(self.buckets)
+        excess = len(keys) - self.max_buckets
+        folded = sum(self.buckets.pop(key) for key in keys[:excess + 1])
+        self.buckets[keys[excess]] = folded
+
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError("Can only merge sketches with the same relative accuracy")
+        for key, count in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.max = max(self.max, other.max)
+        if len(self.buckets) > self.max_buckets:
+            self._collapse()
+
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if rank < seen:
+                # midpoint of the bucket, in relative terms
+                return min(2 * self.gamma ** key / (self.gamma + 1), self.max)
+        return self.max
+
+class RouteStats:
+    def __init__(self, relative_accuracy):
+        self.count = 0
+        self.status_counts = {}
+        self.latency = LatencySketch(relative_accuracy)
+
+    def add(self, status_code, latency):
+        self.count += 1
+        self.status_counts[status_code] = self.status_counts.get(status_code, 0) + 1
+        if latency is not None:
+            self.latency.add(latency)
+
+    def merge(self, other):
+        self.count += other.count
+        for status_code, count in other.status_counts.items():
+            self.status_counts[status_code] = self.status_counts.get(status_code, 0) + count
+        self.latency.merge(other.latency)
+
+    def status_class_counts(self):
+        classes = {}
+        for status_code, count in self.status_counts.items():
+            status_class = f"{str(status_code)[:1]}xx" if status_code is not None else '-'
+            classes[status_class] = classes.get(status_class, 0) + count
+        return classes
+
+def normalize_route(url):
+    """Route for a request URL: XRPC methods are kept whole, other paths have query strings and id-like segments removed"""
+    path = str(url).split('?', 1)[0]
+    if path.startswith('/xrpc/'):
+        return path
+    return '/'.join(':id' if ID_SEGMENT_RE.match(segment) else segment for segment in path.split('/'))
+
+def record_latency(log_obj):
+    for varname in latency_varnames:
+        value = log_obj.get(varname)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return float(value)
+    return None
+
+class RequestStats:
+    """Per (service, method, route) request aggregates, with at most max_routes routes per service"""
+    def __init__(self, max_routes=200, relative_accuracy=0.01):
+        self.max_routes = max_routes
+        self.relative_accuracy = relative_accuracy
+        self.routes = {}
+        self.route_counts = {}
+
+    def _route_stats(self, key):
+        stats = self.routes.get(key)
+        if stats is None:
+            service = key[0]
+            if self.route_counts.get(service, 0) >= self.max_routes:
+                key = (service, key[1], OTHER_ROUTE)
+                stats = self.routes.get(key)
+            if stats is None:
+                self.route_counts[service] = self.route_counts.get(service, 0) + 1
+                stats = self.routes[key] = RouteStats(self.relative_accuracy)
+        return stats
+
+    def add(self, service, log_obj):
+        """Count a request record (one with req_url or res_statusCode, as adjust_vars extracts them); returns whether it was one"""
+        url = log_obj.get('req_url')
+        status_code = log_obj.get('res_statusCode')
+        if url is None and status_code is None:
+            return False
+        key = (service, log_obj.get('req_method') or '-', normalize_route(url) if url is not None else '-')
+        self._route_stats(key).add(status_code, record_latency(log_obj))
+        return True
+
+    def merge(self, other):
+        for key, stats in other.routes.items():
+            self._route_stats(key).merge(stats)
+
+    def format_table(self, title, top=20):
+        rows = sorted(self.routes.items(), key=lambda item: -item[1].count)[:top]
+        lines = [title]
+        header = ['service', 'method', 'route', 'count', '2xx', '3xx', '4xx', '5xx', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms']
+        table = [header]
+        for (service, method, route), stats in rows:
+            classes = stats.status_class_counts()
+            latency = stats.latency
+            percentiles = [latency.quantile(q) for q in (0.5, 0.9, 0.99)] + [latency.max if latency.count else None]
+            table.append([service, method, route, str(stats.count)] +
+                         [str(classes.get(status_class, 0)) for status_class in ('2xx', '3xx', '4xx', '5xx')] +
+                         ['-' if value is None else f"{value:.1f}" for value in percentiles])
+        widths = [max(len(row[i]) for row in table) for i in range(len(header))]
+        for row in table:
+            lines.append('  '.join(cell.ljust(width) if i < 3 else cell.rjust(width) for i, (cell, width) in enumerate(zip(row, widths))))
+        if len(self.routes) > top:
+            lines.append(f"... and {len(self.routes) - top} more routes")
+        return '\n'.join(lines) + '\n'
+
+class StatsReporter:
+    """Collects stats for an interval, printing a snapshot of each interval and folding it into the totals"""
+    def __init__(self, interval=10., top=20, max_routes=200, out=sys.stdout):
+        self.interval = interval
+        self.top = top
+        self.max_routes = max_routes
+        self.out = out
+        self.totals = RequestStats(max_routes)
+        self.current = RequestStats(max_routes)
+        self.interval_start = time.monotonic()
+
+    def add(self, service, log_obj):
+        self.current.add(service, log_obj)
+
+    def maybe_snapshot(self):
+        now = time.monotonic()
+        if now - self.interval_start >= self.interval:
+            self.snapshot(now)
+
+    def snapshot(self, now=None):
+        now = now or time.monotonic()
+        if self.current.routes:
+            self.out.write(self.current.format_table(f"--- requests in the last {now - self.interval_start:.0f}s ---", self.top))
+            self.out.flush()
+        self.totals.merge(self.current)
+        self.current = RequestStats(self.max_routes)
+        self.interval_start = now
+
+    def finish(self):
+        self.totals.merge(self.current)
+        self.current = RequestStats(self.max_routes)
+        self.out.write(self.totals.format_table("--- all requests ---", self.top))
+        self.out.flush()
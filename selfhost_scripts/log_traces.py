@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+"""
+Link log records to the traces in Jaeger.
+
+pds and bsky log the trace context of a request in their pino records (as trace_id, or in the
+traceparent header of req). TraceIndex keeps the lines that carry a trace id in a capture file,
+with a SQLite index of trace id -> offset in that file, so the logs of a trace can be shown
+without searching through all the logs; trace ids can be given in full or as the 7 character
+short ids that the Jaeger UI and utils/trace_annotator.py use. The capture file is rotated
+once it reaches half of max_bytes, keeping the previous file, so the index holds the most
+recent max_bytes of lines.
+"""
+
+import fcntl
+import os
+import re
+import sqlite3
+from pathlib import Path
+
+from env_utils import get_cache_path
+
+DEFAULT_MAX_BYTES = 1 << 30
+
+TRACE_ID_KEYS = ('trace_id', 'traceId', 'traceID', 'trace.id')
+
+TRACE_ID_RE = re.compile(r'^(?:[0-9a-fA-F]{16}){1,2}$')
+TRACEPARENT_RE = re.compile(r'\b[0-9a-f]{2}-([0-9a-f]{32})-[0-9a-f]{16}-[0-9a-f]{2}\b')
+# a trace id or short trace id, alone or at the end of a Jaeger trace URL
+TRACE_ARG_RE = re.compile(r'(?:^|/trace/)([0-9a-fA-F]{1,32})/?$')
+
+def default_jaeger_url():
+    return os.environ.get('JAEGER_URL', 'http://localhost:16686').rstrip('/')
+
+def get_trace_index_file():
+    """Default trace index, next to the other cached state in ~/.cache/bluesky-selfhost"""
+    return get_cache_path('log-traces.sqlite')
+
+def record_trace_id(log_obj):
+    """Get the trace id of a pino record as 32 lowercase hex digits, or None if it has none"""
+    for key in TRACE_ID_KEYS:
+        value = log_obj.get(key)
+        if isinstance(value, str) and TRACE_ID_RE.match(value) and value.strip('0'):
+            return value.lower().rjust(32, '0')
+    req = log_obj.get('req')
+    if isinstance(req, dict):
+        headers = req.get('headers')
+        req = headers.get('traceparent') if isinstance(headers, dict) else None
+    # log_formatter leaves the rest of req as JSON once it has extracted the method and url
+    if isinstance(req, str):
+        m = TRACEPARENT_RE.search(req)
+        if m and m.group(1).strip('0'):
+            return m.group(1)
+    return None
+
+def parse_trace_arg(text):
+    """
+    Get the (possibly short) trace id from a trace id or Jaeger trace URL, or None if it isn't one.
+    16 digit (64 bit) trace ids are padded to 32 digits, as record_trace_id stores them.
+    """
+    m = TRACE_ARG_RE.search(text.strip())
+    if not m:
+        return None
+    trace_id = m.group(1).lower()
+    return trace_id.rjust(32, '0') if len(trace_id) == 16 else trace_id
+
+class TraceIndex:
+    """
+    Lines that carry a trace id, appended to path + '.lines', and a SQLite table of (trace id, offset)
+    at path. Trace ids are stored as 16 byte blobs in a WITHOUT ROWID table, so the index is little
+    more than the ids and offsets themselves, and both full and short ids are a range lookup.
+
+    Offsets count from the start of the first capture file ever written: the current file starts at
+    the 'base' offset kept in the index, and the previous one (path + '.lines.1') at 'previous_base'.
+    Writers hold an exclusive lock on path + '.lock' while they append, index and rotate, so several
+    formatters can share an index; readers hold a shared lock.
+    """
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lines_path = Path(f"{self.path}.lines")
+        self.previous_lines_path = Path(f"{self.path}.lines.1")
+        self.max_bytes = max_bytes
+        self.lock_file = open(f"{self.path}.lock", 'ab')
+        self.db = sqlite3.connect(str(self.path))
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS trace_lines (trace_id BLOB NOT NULL, offset INTEGER NOT NULL, '
+                            'PRIMARY KEY (trace_id, offset)) WITHOUT ROWID')
+            self.db.execute('CREATE TABLE IF NOT EXISTS capture_files (name TEXT PRIMARY KEY, base INTEGER NOT NULL)')
+            self.db.execute("INSERT OR IGNORE INTO capture_files VALUES ('base', 0), ('previous_base', 0)")
+        self.lines_file = None
+
+    def bases(self):
+        """Get the offsets that the current and previous capture files start at"""
+        bases = dict(self.db.execute('SELECT name, base FROM capture_files'))
+        return bases['base'], bases['previous_base']
+
+    def open_lines_file(self):
+        """Get the current capture file for appending, reopening it if another writer rotated it"""
+        if self.lines_file is not None:
+            try:
+                current = os.stat(self.lines_path)
+            except FileNotFoundError:
+                current = None
+            opened = os.fstat(self.lines_file.fileno())
+            if current is None or (current.st_dev, current.st_ino) != (opened.st_dev, opened.st_ino):
+                self.lines_file.close()
+                self.lines_file = None
+        if self.lines_file is None:
+            self.lines_file = open(self.lines_path, 'ab')
+        return self.lines_file
+
+    def rotate(self, base, size):
+        """Start a new capture file, dropping the previous one and its index rows"""
+        with self.db:
+            self.db.execute('DELETE FROM trace_lines WHERE offset < ?', (base,))
+            self.db.execute("UPDATE capture_files SET base = ? WHERE name = 'previous_base'", (base,))
+            self.db.execute("UPDATE capture_files SET base = ? WHERE name = 'base'", (base + size,))
+        os.replace(self.lines_path, self.previous_lines_path)
+        self.lines_file.close()
+        self.lines_file = None
+
+    def add(self, entries):
+        """Add (trace_id, line) entries, writing the lines in one append and the index rows in one transaction"""
+        if not entries:
+            return
+        fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+        try:
+            lines_file = self.open_lines_file()
+            base, _ = self.bases()
+            # other writers may have appended since this one last did
+            position = lines_file.seek(0, os.SEEK_END)
+            offset = base + position
+            rows, chunks = [], []
+            for trace_id, line in entries:
+                data = line.encode('utf-8')
+                rows.append((bytes.fromhex(trace_id), offset))
+                chunks.append(data)
+                offset += len(data)
+            lines_file.write(b''.join(chunks))
+            # the lines are written before the rows that point at them
+            lines_file.flush()
+            with self.db:
+                self.db.executemany('INSERT OR IGNORE INTO trace_lines VALUES (?, ?)', rows)
+            if offset - base >= self.max_bytes // 2:
+                self.rotate(base, offset - base)
+        finally:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+
+    def key_range(self, prefix):
+        return bytes.fromhex(prefix.ljust(32, '0')), bytes.fromhex(prefix.ljust(32, 'f'))
+
+    def find(self, prefix):
+        """Get the full trace ids starting with prefix, oldest first"""
+        rows = self.db.execute('SELECT trace_id, MIN(offset) FROM trace_lines WHERE trace_id BETWEEN ? AND ? '
+                               'GROUP BY trace_id ORDER BY 2', self.key_range(prefix))
+        return [trace_id.hex() for trace_id, _ in rows]
+
+    def lines(self, trace_id):
+        """Get the lines logged for a trace, in the order they were indexed"""
+        fcntl.flock(self.lock_file, fcntl.LOCK_SH)
+        try:
+            base, previous_base = self.bases()
+            offsets = [offset for (offset,) in self.db.execute('SELECT offset FROM trace_lines WHERE trace_id = ? ORDER BY offset',
+                                                              (bytes.fromhex(trace_id),))]
+            lines = []
+            previous = [offset - previous_base for offset in offsets if offset < base]
+            current = [offset - base for offset in offsets if offset >= base]
+            for path, file_offsets in ((self.previous_lines_path, previous), (self.lines_path, current)):
+                if not file_offsets:
+                    continue
+                with open(path, 'rb') as f:
+                    for offset in file_offsets:
+                        f.seek(offset)
+                        lines.append(f.readline().decode('utf-8', errors='replace'))
+            return lines
+        finally:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+
+    def close(self):
+        if self.lines_file is not None:
+            self.lines_file.close()
+        self.db.close()
+        self.lock_file.close()
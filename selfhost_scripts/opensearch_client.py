@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+"""
+Minimal OpenSearch REST client for the logging tools, using only the standard library.
+
+The server is taken from OPENSEARCH_HOST (host:port, default localhost:9200) as in
+config/logging/*.sh, or OPENSEARCH_URL for a full URL; OPENSEARCH_USER and
+OPENSEARCH_PASSWORD enable basic auth when the security plugin is on.
+"""
+
+import base64
+import json
+import os
+import queue
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+
+class OpenSearchError(Exception):
+    def __init__(self, status, message):
+        super().__init__(f"HTTP {status}: {message}")
+        self.status = status
+
+def default_url():
+    if os.environ.get('OPENSEARCH_URL'):
+        return os.environ['OPENSEARCH_URL']
+    return f"http://{os.environ.get('OPENSEARCH_HOST', 'localhost:9200')}"
+
+class OpenSearchClient:
+    def __init__(self, url=None, user=None, password=None, timeout=60):
+        self.url = (url or default_url()).rstrip('/')
+        user = user or os.environ.get('OPENSEARCH_USER')
+        password = password or os.environ.get('OPENSEARCH_PASSWORD')
+        self.auth = None
+        if user:
+            self.auth = 'Basic ' + base64.b64encode(f"{user}:{password or ''}".encode('utf-8')).decode('ascii')
+        self.timeout = timeout
+
+    def request(self, method, path, body=None, params=None, headers=None, raw_body=None):
+        """Send a request, returning the decoded JSON response; body is JSON-encoded unless raw_body (bytes) is given"""
+        url = f"{self.url}/{path.lstrip('/')}"
+        if params:
+            url += '?' + urllib.parse.urlencode(params)
+        request_headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
+        if self.auth:
+            request_headers['Authorization'] = self.auth
+        request_headers.update(headers or {})
+        data = raw_body if raw_body is not None else (json.dumps(body).encode('utf-8') if body is not None else None)
+        request = urllib.request.Request(url, data=data, method=method, headers=request_headers)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                content = response.read()
+        except urllib.error.HTTPError as e:
+            raise OpenSearchError(e.code, e.read().decode('utf-8', errors='replace')) from None
+        return json.loads(content) if content else None
+
+    def open_pit(self, index, keep_alive='5m'):
+        return self.request('POST', f"{urllib.parse.quote(index, safe='*,')}/_search/point_in_time", params={'keep_alive': keep_alive})['pit_id']
+
+    def close_pit(self, pit_id):
+        try:
+            self.request('DELETE', '_search/point_in_time', body={'pit_id': [pit_id]})
+        except (OpenSearchError, OSError):
+            # it will expire by itself
+            pass
+
+    def pit_search(self, index, body, page_size=1000, keep_alive='5m'):
+        """
+        Yield pages of hits for body (which must have a sort), using a point in time so that
+        the results are consistent, and search_after to page through them without deep paging costs.
+        _shard_doc is added as the last sort key, so hits with equal sort values (like many records
+        logged in the same millisecond) are neither repeated nor skipped at page boundaries.
+        """
+        sort = list(body['sort'])
+        if not any(key == '_shard_doc' or (isinstance(key, dict) and '_shard_doc' in key) for key in sort):
+            sort.append({'_shard_doc': 'asc'})
+        body = dict(body, sort=sort)
+        pit_id = self.open_pit(index, keep_alive)
+        try:
+            search_after = None
+            while True:
+                page_body = dict(body, size=page_size, pit={'id': pit_id, 'keep_alive': keep_alive})
+                if search_after is not None:
+                    page_body['search_after'] = search_after
+                response = self.request('POST', '_search', body=page_body)
+                pit_id = response.get('pit_id', pit_id)
+                hits = response['hits']['hits']
+                if not hits:
+                    return
+                yield hits
+                if len(hits) < page_size:
+                    return
+                search_after = hits[-1]['sort']
+        finally:
+            self.close_pit(pit_id)
+
+def prefetch(iterator, depth=2):
+    """Run iterator in a background thread, up to depth items ahead, so fetching overlaps with the caller's work"""
+    items = queue.Queue(maxsize=depth)
+    done = object()
+    stop = threading.Event()
+
+    def put(entry):
+        while not stop.is_set():
+            try:
+                items.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterator:
+                if not put((item, None)):
+                    break
+        except Exception as e:
+            put((done, e))
+            return
+        finally:
+            if hasattr(iterator, 'close'):
+                iterator.close()
+        put((done, None))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        stop.set()
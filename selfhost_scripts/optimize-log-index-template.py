@@ -0,0 +1,330 @@
+#!/bin/sh
+"exec" """$(dirname $0)/venv/bin/python""" "$0" "$@" # this is a polyglot shell exec which will drop down to the relative virtualenv's python
+
+"""
+Generate the OpenSearch index template for logs-* from the fields that logs actually contain.
+
+Samples recent log documents from OpenSearch, or log files in docker json-file, `service | json`
+or plain JSON lines format, and profiles each field's types, cardinality and length. Fields that
+are queried (given with --hot-field or found in OpenSearch Dashboards saved searches and
+visualizations) or have few distinct values stay indexed; high-cardinality fields and payload
+blobs like req/res are kept in _source without being indexed.
+
+Indexed strings keep OpenSearch's default text plus .keyword mapping, so Dashboards objects that
+aggregate on field.keyword keep working. With --strings-as-keywords they are mapped as keywords
+only, and so are strings that appear later; msg and log always keep their .keyword subfield.
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+
+from env_utils import json_loads
+from opensearch_client import OpenSearchClient, OpenSearchError
+
+DEFAULT_TEMPLATE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'config', 'logging', 'opensearch-index-template.json')
+
+KEYWORD_IGNORE_ABOVE = 256
+
+# what OpenSearch's dynamic mapping gives a string field
+TEXT_WITH_KEYWORD = {'type': 'text', 'fields': {'keyword': {'type': 'keyword', 'ignore_above': KEYWORD_IGNORE_ABOVE}}}
+
+# mappings that don't depend on what's observed
+FIXED_MAPPINGS = {
+    '@timestamp': {'type': 'date'},
+    'time': {'type': 'date', 'format': 'strict_date_optional_time||epoch_millis'},
+    'stream': {'type': 'keyword'},
+    'level': {'type': 'keyword'},
+    'msg': TEXT_WITH_KEYWORD,
+    'log': TEXT_WITH_KEYWORD,
+    'container_name': {'type': 'keyword'},
+    'container_id': {'type': 'keyword'},
+    'container_id_full': {'type': 'keyword'},
+    'service_name': {'type': 'keyword'},
+}
+
+# request/response payloads and the like, which are only ever read, never searched
+PAYLOAD_FIELDS = {'req', 'res', 'err.stack', 'stack', 'body', 'payload', 'headers'}
+
+# identifiers in saved objects text; only those that are exactly a sampled field's path count as used
+FIELD_TOKEN_RE = re.compile(r'[A-Za-z_@][A-Za-z0-9_@.]*')
+
+class FieldProfile:
+    def __init__(self, max_tracked):
+        self.max_tracked = max_tracked
+        self.count = 0
+        self.types = {}
+        self.values = set()
+        self.overflow = False
+        self.string_length = 0
+        self.string_count = 0
+
+    def add(self, value_type, value=None):
+        self.count += 1
+        self.types[value_type] = self.types.get(value_type, 0) + 1
+        if value_type == 'string':
+            self.string_length += len(value)
+            self.string_count += 1
+        if value_type in ('string', 'long', 'double', 'boolean') and not self.overflow:
+            self.values.add(value)
+            if len(self.values) > self.max_tracked:
+                self.overflow = True
+                self.values = set()
+
+    @property
+    def cardinality(self):
+        return None if self.overflow else len(self.values)
+
+    @property
+    def average_length(self):
+        return self.string_length / self.string_count if self.string_count else 0
+
+def value_type(value):
+    if isinstance(value, bool):
+        return 'boolean'
+    if isinstance(value, int):
+        return 'long'
+    if isinstance(value, float):
+        return 'double'
+    if isinstance(value, str):
+        return 'string'
+    if isinstance(value, dict):
+        return 'object'
+    return 'null' if value is None else 'other'
+
+def profile_document(profiles, document, max_tracked, prefix=''):
+    for key, value in document.items():
+        path = f"{prefix}{key}"
+        values = value if isinstance(value, list) else [value]
+        profile = profiles.get(path)
+        if profile is None:
+            profile = profiles[path] = FieldProfile(max_tracked)
+        for item in values:
+            item_type = value_type(item)
+            if item_type == 'null':
+                continue
+            profile.add(item_type, item if item_type != 'object' else None)
+            if item_type == 'object':
+                profile_document(profiles, item, max_tracked, f"{path}.")
+
+def document_from_line(line):
+    """Build the document fluent-bit would store for a log line: docker's json-file entry merged with the parsed log"""
+    line = line.strip()
+    if not line:
+        return None
+    if not line.startswith('{') and '|' in line:
+        service, line = line.split('|', 1)
+        document = {'service_name': service.strip()}
+        line = line.strip()
+    else:
+        document = {}
+    try:
+        entry = json_loads(line)
+    except ValueError:
+        document['log'] = line
+        return document
+    if not isinstance(entry, dict):
+        return None
+    if isinstance(entry.get('log'), str) and 'stream' in entry:
+        try:
+            parsed = json_loads(entry['log'])
+        except ValueError:
+            parsed = None
+        document.update(entry)
+        if isinstance(parsed, dict):
+            document.update(parsed)
+    else:
+        document.update(entry)
+    return document
+
+def sample_files(paths, limit):
+    for path in paths:
+        with open(path, 'r', errors='replace') as f:
+            for line in f:
+                if limit is not None and limit <= 0:
+                    return
+                document = document_from_line(line)
+                if document is not None:
+                    if limit is not None:
+                        limit -= 1
+                    yield document
+
+def sample_opensearch(client, index, since, limit):
+    body = {
+        'query': {'range': {'@timestamp': {'gte': since}}},
+        'sort': [{'@timestamp': 'desc'}],
+    }
+    for hits in client.pit_search(index, body, page_size=min(limit, 1000)):
+        for hit in hits:
+            yield hit['_source']
+            limit -= 1
+            if limit <= 0:
+                return
+
+def dashboards_usage_text(client, dashboards_index):
+    """Concatenated text of Dashboards saved searches and visualizations, to look for field names in"""
+    body = {'query': {'terms': {'type': ['search', 'visualization']}}, 'size': 1000}
+    try:
+        response = client.request('POST', f"{dashboards_index}/_search", body=body)
+    except OpenSearchError as e:
+        print(f"Warning: could not read saved objects from {dashboards_index}: {e}", file=sys.stderr)
+        return ''
+    return '\n'.join(json.dumps(hit.get('_source', {})) for hit in response['hits']['hits'])
+
+def used_fields(usage_text):
+    """Field paths named in Dashboards usage text, with the .keyword subfield taken as its field"""
+    fields = set()
+    for token in FIELD_TOKEN_RE.findall(usage_text):
+        fields.add(token[:-len('.keyword')] if token.endswith('.keyword') else token)
+    return fields
+
+def is_payload(path):
+    return path in PAYLOAD_FIELDS or any(path.startswith(f"{payload}.") for payload in PAYLOAD_FIELDS)
+
+def indexed_string_mapping(args):
+    if args.strings_as_keywords:
+        return {'type': 'keyword', 'ignore_above': KEYWORD_IGNORE_ABOVE}
+    return json.loads(json.dumps(TEXT_WITH_KEYWORD))
+
+def plan_field(path, profile, total, hot_fields, args):
+    """
+    Decide a field's mapping.
+
+    Returns:
+        tuple: (mapping dict or None to leave it to dynamic mapping, reason)
+    """
+    if path in FIXED_MAPPINGS:
+        return FIXED_MAPPINGS[path], 'fixed'
+    hot = path in hot_fields
+    types = set(profile.types)
+    if not types:
+        return None, 'only null'
+    if is_payload(path) and not hot:
+        if 'object' in types:
+            return {'type': 'object', 'enabled': False}, 'payload'
+        return {'type': 'keyword', 'index': False, 'doc_values': False}, 'payload'
+    if 'object' in types:
+        if len(types) > 1:
+            return {'type': 'object', 'enabled': False}, 'object mixed with values'
+        return None, 'object'
+    if not hot and profile.count < total * args.min_frequency:
+        return None, 'rare'
+    if types == {'boolean'}:
+        return {'type': 'boolean'}, 'boolean'
+    if types <= {'long', 'double'}:
+        mapping = {'type': 'double' if 'double' in types else 'long'}
+        if not hot and profile.cardinality is None:
+            mapping['index'] = False
+            return mapping, 'high cardinality number'
+        return mapping, 'number'
+    if len(types) > 1:
+        return indexed_string_mapping(args), f"unstable type ({', '.join(sorted(types))})"
+    if profile.average_length > args.blob_length and not hot:
+        return {'type': 'keyword', 'index': False, 'doc_values': False}, 'long strings'
+    if hot:
+        return indexed_string_mapping(args), 'queried'
+    if profile.cardinality is None or profile.cardinality > args.max_keyword_cardinality:
+        return {'type': 'keyword', 'index': False, 'doc_values': False}, 'high cardinality'
+    return indexed_string_mapping(args), 'low cardinality'
+
+def set_nested_mapping(properties, path, mapping):
+    parts = path.split('.')
+    for part in parts[:-1]:
+        parent = properties.setdefault(part, {})
+        if parent.get('enabled') is False or parent.get('type') not in (None, 'object'):
+            return False
+        properties = parent.setdefault('properties', {})
+    properties[parts[-1]] = mapping
+    return True
+
+def build_template(base_template, profiles, total, hot_fields, args):
+    """Returns (template, [(path, profile, mapping, reason)])"""
+    properties = {}
+    decisions = []
+    for path in sorted(profiles, key=lambda path: (path.count('.'), path)):
+        mapping, reason = plan_field(path, profiles[path], total, hot_fields, args)
+        if mapping is not None and not set_nested_mapping(properties, path, mapping):
+            mapping, reason = None, 'inside unindexed object'
+        decisions.append((path, profiles[path], mapping, reason))
+    for path, mapping in FIXED_MAPPINGS.items():
+        if path not in profiles:
+            set_nested_mapping(properties, path, mapping)
+    template = json.loads(json.dumps(base_template))
+    mappings = template.setdefault('template', {})['mappings'] = {'dynamic': True, 'properties': properties}
+    if args.strings_as_keywords:
+        mappings['dynamic_templates'] = [
+            {'strings_as_keywords': {'match_mapping_type': 'string',
+                                     'mapping': {'type': 'keyword', 'ignore_above': KEYWORD_IGNORE_ABOVE}}},
+        ]
+    return template, decisions
+
+def print_report(decisions, total, out=sys.stderr):
+    print(f"Profiled {total} documents", file=out)
+    print(f"{'field':40} {'seen':>7} {'types':20} {'distinct':>8} {'mapping':30} reason", file=out)
+    for path, profile, mapping, reason in decisions:
+        cardinality = '>' + str(profile.max_tracked) if profile.cardinality is None else str(profile.cardinality)
+        mapping_text = 'dynamic' if mapping is None else mapping['type'] + (' (not indexed)' if mapping.get('index') is False or mapping.get('enabled') is False else '')
+        print(f"{path:40} {profile.count:>7} {','.join(sorted(profile.types)):20} {cardinality:>8} {mapping_text:30} {reason}", file=out)
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate the logs-* OpenSearch index template from sampled log fields')
+    parser.add_argument('files', nargs='*', help='Log files to sample, rather than sampling from OpenSearch')
+    parser.add_argument('--opensearch', metavar='URL', help='OpenSearch to sample from and read Dashboards usage from (default: http://$OPENSEARCH_HOST, or localhost:9200)')
+    parser.add_argument('--index', default='logs-*', help='Indices to sample (default: logs-*)')
+    parser.add_argument('--since', default='now-1d', help='Sample documents newer than this (default: now-1d)')
+    parser.add_argument('-n', '--sample', type=int, default=20000, help='Number of documents to sample (default: 20000)')
+    parser.add_argument('--hot-field', action='append', default=[], help='Field that is queried, and so must be indexed (may be repeated)')
+    parser.add_argument('--no-dashboards-usage', action='store_true', help="Don't treat fields used in Dashboards saved searches and visualizations as queried")
+    parser.add_argument('--dashboards-index', default='.kibana', help='Index holding Dashboards saved objects (default: .kibana)')
+    parser.add_argument('--max-keyword-cardinality', type=int, default=1000, help='Distinct values above which an unqueried string field is not indexed (default: 1000)')
+    parser.add_argument('--blob-length', type=int, default=512, help='Average length above which an unqueried string field is not indexed (default: 512)')
+    parser.add_argument('--strings-as-keywords', action='store_true', help='Map indexed and new string fields as keywords only, without the text field and .keyword subfield of the default mapping; Dashboards objects using field.keyword must be updated')
+    parser.add_argument('--min-frequency', type=float, default=0.001, help='Fraction of documents a field must appear in to be mapped explicitly (default: 0.001)')
+    parser.add_argument('-t', '--template', default=DEFAULT_TEMPLATE, help='Template to take index patterns, settings and priority from (default: config/logging/opensearch-index-template.json)')
+    parser.add_argument('-o', '--output', help='File to write the template to (default: stdout)')
+    parser.add_argument('--apply', metavar='NAME', help='Also PUT the template to OpenSearch as _index_template/NAME')
+    args = parser.parse_args()
+
+    with open(args.template, 'r') as f:
+        base_template = json.load(f)
+    client = OpenSearchClient(args.opensearch)
+    max_tracked = args.max_keyword_cardinality + 1
+    profiles = {}
+    total = 0
+    try:
+        documents = sample_files(args.files, args.sample) if args.files else sample_opensearch(client, args.index, args.since, args.sample)
+        for document in documents:
+            profile_document(profiles, document, max_tracked)
+            total += 1
+    except (OpenSearchError, OSError) as e:
+        print(f"Error sampling logs: {e}", file=sys.stderr)
+        sys.exit(1)
+    if not total:
+        print("Error: no log documents found to sample", file=sys.stderr)
+        sys.exit(1)
+
+    hot_fields = set(args.hot_field)
+    if not args.no_dashboards_usage and (not args.files or args.opensearch):
+        usage_text = dashboards_usage_text(client, args.dashboards_index)
+        hot_fields.update(used_fields(usage_text) & set(profiles))
+
+    template, decisions = build_template(base_template, profiles, total, hot_fields, args)
+    print_report(decisions, total)
+    content = json.dumps(template, indent=4) + '\n'
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(content)
+    else:
+        sys.stdout.write(content)
+    if args.apply:
+        try:
+            client.request('PUT', f"_index_template/{args.apply}", body=template)
+        except (OpenSearchError, OSError) as e:
+            print(f"Error applying template {args.apply}: {e}", file=sys.stderr)
+            sys.exit(1)
+        print(f"Applied template {args.apply}", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
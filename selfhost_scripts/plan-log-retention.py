@@ -0,0 +1,271 @@
+#!/bin/sh
+"exec" """$(dirname $0)/venv/bin/python""" "$0" "$@" # this is a polyglot shell exec which will drop down to the relative virtualenv's python
+
+"""
+Size the log retention ISM policies to the disk OpenSearch has, from measured index growth.
+
+fluent-bit writes one logs-YYYY.MM.DD index per day (Logstash_Format), so each daily index's
+document count and primary store size is one sample of the growth rate. This fits a linear
+trend to the recent days of each index prefix, projects the daily growth, and works out how
+many days of short and long retention fit in the disk budget, leaving the rest of the disk for other indices and below the disk watermarks at
+which OpenSearch stops accepting writes and fluent-bit backs up. It also recommends primary
+shard counts and rollover sizes, and can write or apply the short and long policies.
+
+The planned policies are kept apart from the ones config/logging/setup-retention-policies.sh
+deploys (logs-30day-policy, logs-90day-policy and logs-7day-policy, from opensearch-ism-policy*.json):
+they are written to opensearch-ism-policy-planned-{short,long}.json and applied as
+logs-planned-short-policy and logs-planned-long-policy. Their ism_templates have priorities
+150 (short) and 200 (long), above the 100 of logs-30day-policy's logs-* template, so once
+applied, new indices of the planned prefixes get the planned policies instead of the 30-day one.
+Indices that already exist keep their policy (change them with manage-log-retention.sh).
+As fluent-bit only writes logs-YYYY.MM.DD, a short policy for the logs prefix would cover every
+new log index, so --apply refuses that unless --replace-deployed-policy is given.
+"""
+
+import argparse
+import datetime
+import fnmatch
+import json
+import math
+import os
+import re
+import sys
+
+from opensearch_client import OpenSearchClient, OpenSearchError
+
+INDEX_DATE_RE = re.compile(r'^(?P<prefix>.+?)-(?P<date>\d{4}\.\d{2}\.\d{2})$')
+
+# ism_template priorities of the planned policies: above logs-30day-policy's 100, so they take precedence for new indices
+SHORT_PRIORITY = 150
+LONG_PRIORITY = 200
+
+SIZE_UNITS = {'b': 1, 'kb': 1 << 10, 'mb': 1 << 20, 'gb': 1 << 30, 'tb': 1 << 40}
+
+def parse_size(text):
+    m = re.match(r'^\s*([\d.]+)\s*([kmgt]?b)?\s*$', text.lower())
+    if not m:
+        raise argparse.ArgumentTypeError(f"Can't parse size {text!r}; use e.g. 500mb or 40gb")
+    return int(float(m.group(1)) * SIZE_UNITS[m.group(2) or 'b'])
+
+def format_size(size):
+    for unit in ('tb', 'gb', 'mb', 'kb'):
+        if size >= SIZE_UNITS[unit]:
+            return f"{size / SIZE_UNITS[unit]:.1f}{unit}"
+    return f"{size:.0f}b"
+
+def get_daily_indices(client, pattern):
+    """Get {prefix: [(date, docs, primary_bytes, total_bytes)]} sorted by date, from dated index names"""
+    rows = client.request('GET', f"_cat/indices/{pattern}", params={'format': 'json', 'bytes': 'b', 'h': 'index,docs.count,pri.store.size,store.size'})
+    series = {}
+    for row in rows:
+        m = INDEX_DATE_RE.match(row['index'])
+        if not m:
+            continue
+        date = datetime.datetime.strptime(m.group('date'), '%Y.%m.%d').date()
+        series.setdefault(m.group('prefix'), []).append((date, int(row.get('docs.count') or 0),
+                                                         int(row.get('pri.store.size') or 0), int(row.get('store.size') or 0)))
+    for samples in series.values():
+        samples.sort()
+    return series
+
+def fit_daily_growth(samples, today, days):
+    """
+    Fit bytes per day over the last `days` complete days with least squares.
+
+    Returns:
+        dict: mean and projected daily primary bytes and docs, and the trend in bytes per day per day
+    """
+    complete = [sample for sample in samples if sample[0] < today][-days:]
+    if not complete:
+        # only today's partial index: scale it to a whole day
+        date, docs, primary, _ = samples[-1]
+        now = datetime.datetime.now()
+        fraction = max((now - datetime.datetime.combine(today, datetime.time())).total_seconds() / 86400, 1 / 24)
+        return {'days': 0, 'mean_bytes': primary / fraction, 'projected_bytes': primary / fraction,
+                'mean_docs': docs / fraction, 'trend': 0.}
+    xs = [(sample[0] - complete[0][0]).days for sample in complete]
+    ys = [sample[2] for sample in complete]
+    n = len(complete)
+    mean_x, mean_y = sum(xs) / n, sum(ys) / n
+    variance = sum((x - mean_x) ** 2 for x in xs)
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / variance if variance else 0.
+    next_day = (today - complete[0][0]).days
+    fitted = mean_y + slope * (next_day - mean_x)
+    recent = sum(ys[-3:]) / len(ys[-3:])
+    return {'days': n, 'mean_bytes': mean_y, 'projected_bytes': max(fitted, recent),
+            'mean_docs': sum(sample[1] for sample in complete) / n, 'trend': slope}
+
+def get_disk(client, pattern):
+    """Get (total disk bytes, bytes used by indices other than the log indices, data node count)"""
+    allocation = client.request('GET', '_cat/allocation', params={'format': 'json', 'bytes': 'b'})
+    nodes = [row for row in allocation if row.get('disk.total')]
+    disk_total = sum(int(row['disk.total']) for row in nodes)
+    all_indices = client.request('GET', '_cat/indices', params={'format': 'json', 'bytes': 'b', 'h': 'index,store.size'})
+    log_indices = {row['index'] for row in client.request('GET', f"_cat/indices/{pattern}", params={'format': 'json', 'h': 'index'})}
+    other_bytes = sum(int(row.get('store.size') or 0) for row in all_indices if row['index'] not in log_indices)
+    return disk_total, other_bytes, max(len(nodes), 1)
+
+def plan_retention(growth, budget, copies, args):
+    """
+    Split the budget between the long and short retention prefixes.
+
+    Returns:
+        dict: short and long prefixes, days, and daily bytes (with headroom and shard copies)
+    """
+    long_prefixes = [prefix for prefix in growth if prefix in args.long_prefix]
+    short_prefixes = [prefix for prefix in growth if prefix not in args.long_prefix]
+    daily = lambda prefixes: sum(growth[prefix]['projected_bytes'] for prefix in prefixes) * args.headroom * copies
+    long_daily, short_daily = daily(long_prefixes), daily(short_prefixes)
+    long_days = args.long_days if long_prefixes else 0
+    # keep the long retention as asked if the short retention can still be at least min_short_days
+    if long_days and budget - long_days * long_daily < args.min_short_days * short_daily:
+        long_days = max(1, int((budget - args.min_short_days * short_daily) // long_daily)) if long_daily else args.long_days
+    short_days = int((budget - long_days * long_daily) // short_daily) if short_daily else args.max_short_days
+    short_days = max(1, min(short_days, args.max_short_days))
+    return {'short_prefixes': short_prefixes, 'long_prefixes': long_prefixes, 'short_days': short_days, 'long_days': long_days,
+            'short_daily': short_daily, 'long_daily': long_daily}
+
+def covering_patterns(patterns, pattern):
+    """The patterns that match every index pattern does, like logs-* for logs-*"""
+    return [candidate for candidate in patterns if fnmatch.fnmatchcase(pattern, candidate)]
+
+def make_policy(description, retention_days, warm_days, patterns, priority, rollover_size=None):
+    """ISM policy in the layout of config/logging/opensearch-ism-policy*.json"""
+    hot_actions = []
+    if rollover_size:
+        hot_actions.append({'rollover': {'min_primary_shard_size': format_size(rollover_size), 'min_index_age': '1d'}})
+    states = []
+    if warm_days and warm_days < retention_days:
+        states.append({'name': 'hot', 'actions': hot_actions,
+                       'transitions': [{'state_name': 'warm', 'conditions': {'min_index_age': f"{warm_days}d"}}]})
+        states.append({'name': 'warm', 'actions': [{'read_only': {}}],
+                       'transitions': [{'state_name': 'delete', 'conditions': {'min_index_age': f"{retention_days}d"}}]})
+    else:
+        states.append({'name': 'hot', 'actions': hot_actions,
+                       'transitions': [{'state_name': 'delete', 'conditions': {'min_index_age': f"{retention_days}d"}}]})
+    states.append({'name': 'delete', 'actions': [{'delete': {}}], 'transitions': []})
+    policy = {'description': description, 'default_state': 'hot', 'states': states}
+    if patterns:
+        policy['ism_template'] = [{'index_patterns': patterns, 'priority': priority}]
+    return {'policy': policy}
+
+def apply_policy(client, policy_id, policy):
+    """Create or update an ISM policy (updates need the current sequence number)"""
+    params = None
+    try:
+        existing = client.request('GET', f"_plugins/_ism/policies/{policy_id}")
+        params = {'if_seq_no': existing['_seq_no'], 'if_primary_term': existing['_primary_term']}
+    except OpenSearchError as e:
+        if e.status != 404:
+            raise
+    client.request('PUT', f"_plugins/_ism/policies/{policy_id}", body=policy, params=params)
+
+def main():
+    parser = argparse.ArgumentParser(description='Plan log retention ISM policies from measured index growth and a disk budget')
+    parser.add_argument('--opensearch', metavar='URL', help='OpenSearch URL (default: http://$OPENSEARCH_HOST, or localhost:9200)')
+    parser.add_argument('--pattern', default='logs-*', help='Log indices to measure (default: logs-*)')
+    parser.add_argument('--days', type=int, default=14, help='Number of recent complete days to fit growth over (default: 14)')
+    parser.add_argument('--disk-budget', type=parse_size, help='Bytes the log indices may use (default: --budget-fraction of the data nodes\' disk, less other indices)')
+    parser.add_argument('--budget-fraction', type=float, default=0.7, help='Fraction of disk usable when there is no --disk-budget; keep it below the 85%% low watermark (default: 0.7)')
+    parser.add_argument('--long-prefix', action='append', default=[], help='Index prefix (like logs-pds) to keep for the long retention; other prefixes get the short retention (may be repeated)')
+    parser.add_argument('--long-days', type=int, default=90, help='Wanted long retention in days (default: 90)')
+    parser.add_argument('--max-short-days', type=int, default=30, help='Longest short retention to recommend (default: 30)')
+    parser.add_argument('--min-short-days', type=int, default=3, help='Shortest short retention to recommend before cutting the long retention (default: 3)')
+    parser.add_argument('--headroom', type=float, default=1.5, help='Factor on projected daily growth to allow for bursts (default: 1.5)')
+    parser.add_argument('--target-shard-size', type=parse_size, default=parse_size('30gb'), help='Target primary shard size (default: 30gb)')
+    parser.add_argument('--rollover', action='store_true', help='Add rollover actions at the recommended size (only for indices written through a rollover alias, not fluent-bit\'s dated indices)')
+    parser.add_argument('-o', '--output-dir', help='Write opensearch-ism-policy-planned-short.json and opensearch-ism-policy-planned-long.json here '
+                        '(e.g. config/logging; the policies setup-retention-policies.sh deploys are left alone)')
+    parser.add_argument('--apply', action='store_true', help='Create or update the logs-planned-short-policy and logs-planned-long-policy ISM policies in OpenSearch; '
+                        f'their index templates (priority {SHORT_PRIORITY} and {LONG_PRIORITY}) take precedence over logs-30day-policy (100) for new indices')
+    parser.add_argument('--replace-deployed-policy', action='store_true', help='Let --apply a short policy whose index pattern covers all of --pattern, '
+                        'so that every new log index gets it instead of logs-30day-policy')
+    args = parser.parse_args()
+
+    client = OpenSearchClient(args.opensearch)
+    today = datetime.date.today()
+    try:
+        series = get_daily_indices(client, args.pattern)
+        if not series:
+            print(f"Error: no dated indices match {args.pattern}", file=sys.stderr)
+            sys.exit(1)
+        disk_total, other_bytes, data_nodes = get_disk(client, args.pattern)
+        settings = client.request('GET', f"{args.pattern}/_settings/index.number_of_replicas")
+    except (OpenSearchError, OSError) as e:
+        print(f"Error reading from OpenSearch: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    replicas = max([int(index['settings']['index']['number_of_replicas']) for index in settings.values()] or [0])
+    # replicas can't be allocated on the node that holds the primary
+    copies = 1 + min(replicas, data_nodes - 1)
+    budget = args.disk_budget if args.disk_budget else disk_total * args.budget_fraction - other_bytes
+
+    print(f"Disk: {format_size(disk_total)} on {data_nodes} data node(s), {format_size(other_bytes)} used by other indices; "
+          f"log budget {format_size(budget)}, {copies} cop{'y' if copies == 1 else 'ies'} of each shard")
+    print(f"\n{'prefix':24} {'days':>4} {'docs/day':>12} {'mean/day':>10} {'projected':>10} {'trend/day':>10} {'shards':>6}")
+    growth = {}
+    for prefix, samples in sorted(series.items()):
+        fit = growth[prefix] = fit_daily_growth(samples, today, args.days)
+        shards = max(1, math.ceil(fit['projected_bytes'] / args.target_shard_size))
+        print(f"{prefix:24} {fit['days']:>4} {fit['mean_docs']:>12.0f} {format_size(fit['mean_bytes']):>10} "
+              f"{format_size(fit['projected_bytes']):>10} {format_size(abs(fit['trend'])):>9}{'-' if fit['trend'] < 0 else '+'} {shards:>6}")
+
+    plan = plan_retention(growth, budget, copies, args)
+    short_prefixes, long_prefixes = plan['short_prefixes'], plan['long_prefixes']
+    short_days, long_days = plan['short_days'], plan['long_days']
+    short_daily, long_daily = plan['short_daily'], plan['long_daily']
+
+    print(f"\nRecommended: short retention {short_days}d for {', '.join(short_prefixes) or '(none)'} "
+          f"(~{format_size(short_daily)}/day with headroom)")
+    if long_prefixes:
+        print(f"             long retention {long_days}d for {', '.join(long_prefixes)} (~{format_size(long_daily)}/day with headroom)"
+              + (f", cut from {args.long_days}d to fit the budget" if long_days < args.long_days else ''))
+    used = short_days * short_daily + long_days * long_daily
+    print(f"             using about {format_size(used)} of the {format_size(budget)} budget")
+    if used > budget:
+        print("Warning: even the shortest retention doesn't fit the budget; add disk or reduce logging", file=sys.stderr)
+    largest = max(growth.values(), key=lambda fit: fit['projected_bytes'])['projected_bytes']
+    rollover_size = args.target_shard_size if largest > args.target_shard_size else None
+    if rollover_size:
+        print(f"             daily indices exceed {format_size(args.target_shard_size)}: set number_of_shards in the index template "
+              f"or write through a rollover alias at {format_size(rollover_size)} per primary shard")
+
+    policies = {
+        'short': make_policy(f"{short_days}-day retention policy for logs, sized to the disk budget", short_days,
+                             max(1, short_days // 4) if short_days > 7 else None,
+                             [f"{prefix}-*" for prefix in short_prefixes], SHORT_PRIORITY, rollover_size if args.rollover else None),
+        'long': make_policy(f"{long_days or args.long_days}-day retention policy for important logs, sized to the disk budget",
+                            long_days or args.long_days, max(1, (long_days or args.long_days) // 3),
+                            [f"{prefix}-*" for prefix in long_prefixes], LONG_PRIORITY, rollover_size if args.rollover else None),
+    }
+    if args.output_dir:
+        for name, policy in policies.items():
+            path = os.path.join(args.output_dir, f"opensearch-ism-policy-planned-{name}.json")
+            with open(path, 'w') as f:
+                f.write(json.dumps(policy, indent=2) + '\n')
+            print(f"Wrote {path}")
+    if args.apply and short_prefixes and not args.replace_deployed_policy:
+        covering = covering_patterns(policies['short']['policy']['ism_template'][0]['index_patterns'], args.pattern)
+        if covering:
+            print(f"Error: the short policy's index pattern {', '.join(covering)} covers all of {args.pattern}, so applying it would give every new "
+                  "log index the planned policy instead of logs-30day-policy; pass --replace-deployed-policy if that is what you want",
+                  file=sys.stderr)
+            sys.exit(1)
+    if args.apply:
+        try:
+            for name, policy in policies.items():
+                if name == 'long' and not long_prefixes:
+                    continue
+                if name == 'short' and not short_prefixes:
+                    continue
+                apply_policy(client, f"logs-planned-{name}-policy", policy)
+                patterns = policy['policy']['ism_template'][0]['index_patterns']
+                print(f"Applied logs-planned-{name}-policy: new indices matching {', '.join(patterns)} get it instead of logs-30day-policy")
+        except (OpenSearchError, OSError) as e:
+            print(f"Error applying policies: {e}", file=sys.stderr)
+            sys.exit(1)
+    if not args.output_dir and not args.apply:
+        print(json.dumps(policies, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -3,10 +3,15 @@ from setuptools import setup
 setup(
     name="selfhost_scripts",
     version="0.1.0",
-    py_modules=["env_utils", "secret_types", "gen_secrets"],
+    py_modules=["env_utils", "secret_types", "k8s_secrets", "gen_secrets", "compose_model", "log_filters", "log_stats", "docker_logs", "log_dedupe", "opensearch_client", "container_metadata_map", "log_traces", "log_export"],
     python_requires=">=3.6",
     install_requires=[
         "PyYAML",
     ],
+    extras_require={
+        "fast-json": ["orjson"],
+        "parquet": ["pyarrow"],
+        "flb-storage": ["msgpack"],
+    },
     description="Operations helper utilities for bluesky self-hosting",
 )
@@ -0,0 +1,456 @@
+#!/bin/sh
+"exec" """$(dirname $0)/venv/bin/python""" "$0" "$@" # this is a polyglot shell exec which will drop down to the relative virtualenv's python
+
+"""
+Catch-up log shipper: backfill OpenSearch from the docker log files or fluent-bit's storage.
+
+fluent-bit only keeps storage.backlog.mem_limit of backlog and gives up on a chunk after
+Retry_Limit retries, so an OpenSearch outage or a burst of logs leaves gaps in the logs-*
+indices. This reads the docker json-file logs (or the chunks left in fluent-bit's filesystem
+storage) from a checkpoint, builds the same documents fluent-bit would (the docker entry merged
+with the parsed JSON log, plus container metadata, in logs-YYYY.MM.DD indices), and sends them
+through the _bulk API in large gzip-compressed batches over several connections. The batch size
+adapts to how long OpenSearch takes to respond, shrinking when it is slow or rejects work.
+
+Documents get ids derived from where they were read, so shipping the same range twice doesn't
+duplicate them. The documents fluent-bit did deliver have ids of its own, which these never match,
+so the docker logs are only shipped for an explicit --since/--until window, and not when logs-*
+already has documents in it (unless --allow-overlap): find the gap first, e.g. in OpenSearch
+Dashboards, and ship just that.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import datetime
+import glob
+import gzip
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+
+from docker_logs import DEFAULT_CONTAINERS_DIR, DockerLogTailer, load_checkpoint, read_container_metadata, save_checkpoint, swarm_service_name
+from env_utils import get_cache_path, json_dumps, json_loads
+from opensearch_client import OpenSearchClient, OpenSearchError
+
+DEFAULT_FLB_STORAGE = '/var/log/flb-storage'
+
+INDEX_PREFIX = 'logs'
+
+# level 1 gets most of the size reduction on JSON logs for a fraction of the CPU of the default level
+GZIP_LEVEL = 1
+
+RETRY_STATUSES = (429, 502, 503, 504)
+
+def get_checkpoint_file():
+    """Default offsets checkpoint; kept apart from log_formatter's, as the two read independently"""
+    return get_cache_path('log-shipper-offsets.json')
+
+def parse_time(text):
+    """Parse an ISO time (UTC unless it has an offset) or a duration before now like 90m, 6h or 2d"""
+    m = re.match(r'^(\d+)([smhd])$', text)
+    if m:
+        seconds = int(m.group(1)) * {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}[m.group(2)]
+        return datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=seconds)
+    try:
+        parsed = datetime.datetime.fromisoformat(text.replace('Z', '+00:00'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Can't parse time {text!r}; use e.g. 2024-05-01T12:00 or 6h") from None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed.astimezone(datetime.timezone.utc)
+
+class TimeRange:
+    """--since/--until bounds, compared against docker's RFC3339 UTC times as strings to avoid parsing every entry"""
+    def __init__(self, since=None, until=None):
+        self.since = since.strftime('%Y-%m-%dT%H:%M:%S') if since else None
+        self.until = until.strftime('%Y-%m-%dT%H:%M:%S') if until else None
+        self.since_epoch = since.timestamp() if since else None
+        self.until_epoch = until.timestamp() if until else None
+
+    def contains_time(self, time_text):
+        if self.since and time_text < self.since:
+            return False
+        return not (self.until and time_text >= self.until)
+
+    def contains_epoch(self, timestamp):
+        if self.since_epoch is not None and timestamp < self.since_epoch:
+            return False
+        return not (self.until_epoch is not None and timestamp >= self.until_epoch)
+
+    def query(self):
+        """Range query on @timestamp for the same bounds"""
+        bounds = {}
+        if self.since:
+            bounds['gte'] = f"{self.since}Z"
+        if self.until:
+            bounds['lt'] = f"{self.until}Z"
+        return {'range': {'@timestamp': bounds}} if bounds else {'match_all': {}}
+
+def count_existing(client, time_range):
+    """Count the documents the logs-* indices already have in time_range, of any service"""
+    response = client.request('POST', f"{INDEX_PREFIX}-*/_count", body={'query': time_range.query()},
+                              params={'ignore_unavailable': 'true', 'allow_no_indices': 'true'})
+    return response.get('count', 0)
+
+def document_id(*parts):
+    return hashlib.blake2b(':'.join(str(part) for part in parts).encode('utf-8'), digest_size=16).hexdigest()
+
+def docker_timestamp(time_text):
+    """@timestamp (millisecond precision, as fluent-bit writes it) and index date for a docker RFC3339Nano time"""
+    seconds, _, fraction = time_text.rstrip('Z').partition('.')
+    return f"{seconds}.{(fraction + '000')[:3]}Z", seconds[:10].replace('-', '.')
+
+def epoch_timestamp(timestamp):
+    moment = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+    return moment.strftime('%Y-%m-%dT%H:%M:%S.') + f"{moment.microsecond // 1000:03d}Z", moment.strftime('%Y.%m.%d')
+
+class DockerDocuments:
+    """
+    Builds the documents fluent-bit's pipeline makes from docker entries (see config/logging/fluent-bit.conf);
+    compose_service_names matches fluent-bit run with SERVICE_NAME_FROM_COMPOSE_LABEL=1
+    """
+    def __init__(self, compose_service_names=False):
+        self.compose_service_names = compose_service_names
+        self.metadata = {}
+
+    def container_metadata(self, container_dir):
+        """Get (container_name, service_name) as add-container-metadata.lua sets them, or None"""
+        if container_dir not in self.metadata:
+            metadata = read_container_metadata(container_dir)
+            if metadata is not None:
+                name, compose_service = metadata
+                metadata = name, (self.compose_service_names and compose_service) or swarm_service_name(name)
+            self.metadata[container_dir] = metadata
+        return self.metadata[container_dir]
+
+    def document(self, tailed, entry):
+        """Get (index, id, document) for an entry read from tailed"""
+        message = entry.get('log', '')
+        document = {'log': message, 'stream': entry.get('stream'), 'time': entry.get('time')}
+        # the json parser filter, with Reserve_Data and Preserve_Key
+        if message.startswith('{'):
+            try:
+                parsed = json_loads(message)
+            except ValueError:
+                parsed = None
+            if isinstance(parsed, dict):
+                document.update(parsed)
+        # the add-container-metadata.lua filter
+        container_dir = os.path.dirname(tailed.path)
+        container_id = os.path.basename(container_dir)
+        document['filepath'] = tailed.path
+        document['container_id_full'] = container_id
+        document['container_id'] = container_id[:12]
+        metadata = self.container_metadata(container_dir)
+        if metadata is not None:
+            document['container_name'], service = metadata
+            if service:
+                document['service_name'] = service
+        timestamp, date = docker_timestamp(entry.get('time') or '')
+        document['@timestamp'] = timestamp
+        return f"{INDEX_PREFIX}-{date}", document_id(tailed.path, tailed.inode, entry['offset']), document
+
+def docker_source(tailer, time_range, compose_service_names=False):
+    """Yield (documents, checkpoints) for each read of the docker log files, up to their current ends"""
+    builder = DockerDocuments(compose_service_names)
+    for tailed, lines, offset in tailer.read_batches(follow=False):
+        documents = [builder.document(tailed, entry) for entry in tailed.entries(lines)
+                     if time_range.contains_time(entry.get('time') or '')]
+        yield documents, {tailed.path: tailer.advance(tailed, offset)}
+
+def event_time_hook(code, data):
+    """msgpack ext type 0 is fluent-bit's EventTime: 32-bit big endian seconds and nanoseconds"""
+    if code == 0 and len(data) == 8:
+        return int.from_bytes(data[:4], 'big') + int.from_bytes(data[4:], 'big') / 1e9
+    return None
+
+def read_flb_chunk(path):
+    """
+    Get (tag, [(timestamp, record)]) from a fluent-bit filesystem storage chunk, or None if it isn't a
+    chunk of log records. The chunkio header is 2 magic bytes, a CRC32, 16 bytes of padding and the
+    metadata length, followed by the metadata (fluent-bit's own 4 byte header and the tag) and the
+    msgpack-encoded events.
+    """
+    import msgpack
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < 24 or data[:2] != b'\xc1\x00':
+        return None
+    meta_length = int.from_bytes(data[22:24], 'big')
+    meta = data[24:24 + meta_length]
+    if meta[:2] == b'\xf1\x77':
+        if meta[2] != 0:
+            # metrics or traces
+            return None
+        meta = meta[4:]
+    tag = meta.decode('utf-8', errors='replace')
+    unpacker = msgpack.Unpacker(raw=False, ext_hook=event_time_hook, strict_map_key=False)
+    unpacker.feed(data[24 + meta_length:])
+    records = []
+    try:
+        for event in unpacker:
+            # the file is preallocated, so what follows the events is zeroes (which unpack as integers)
+            if not isinstance(event, (list, tuple)) or len(event) != 2:
+                break
+            header, record = event
+            # [[timestamp, metadata], record] since fluent-bit 2.1, [timestamp, record] before
+            timestamp = header[0] if isinstance(header, (list, tuple)) else header
+            if isinstance(timestamp, (int, float)) and isinstance(record, dict):
+                records.append((float(timestamp), record))
+    except (ValueError, msgpack.exceptions.ExtraData):
+        # a chunk fluent-bit was writing to when it stopped can end in a partial event
+        pass
+    return tag, records
+
+def flb_source(storage_dir, offsets, time_range):
+    """Yield (documents, checkpoints) for each fluent-bit storage chunk, skipping the records already shipped"""
+    # chunk files are named <pid>-<seconds>.<nanoseconds>.flb, so sort by the time in the name
+    paths = glob.glob(os.path.join(storage_dir, '*', '*.flb'))
+    paths.sort(key=lambda path: os.path.basename(path).split('-', 1)[-1])
+    for path in paths:
+        try:
+            chunk = read_flb_chunk(path)
+        except OSError as e:
+            print(f"Warning: could not read {path}: {e}", file=sys.stderr)
+            continue
+        if chunk is None:
+            continue
+        tag, records = chunk
+        shipped = (offsets.get(path) or {}).get('records', 0)
+        documents = []
+        for number, (timestamp, record) in enumerate(records[shipped:], start=shipped):
+            if not time_range.contains_epoch(timestamp):
+                continue
+            record = dict(record)
+            record['@timestamp'], date = epoch_timestamp(timestamp)
+            documents.append((f"{INDEX_PREFIX}-{date}", document_id(os.path.basename(path), number), record))
+        yield documents, {path: {'records': len(records)}}
+
+class BulkShipper:
+    """
+    Sends _bulk requests on a pool of connections, sizing batches so each takes about target_latency:
+    batches grow while responses are quick and shrink when they're slow or OpenSearch pushes back.
+    """
+    def __init__(self, client, connections=4, compress=True, target_latency=2., min_batch=512 << 10,
+                 max_batch=32 << 20, initial_batch=4 << 20, retries=8):
+        self.client = client
+        self.connections = connections
+        self.compress = compress
+        self.target_latency = target_latency
+        self.min_batch = min_batch
+        self.max_batch = max_batch
+        self.batch_bytes = initial_batch
+        self.retries = retries
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=connections)
+        # totals of the delivered batches, added by the caller as they complete
+        self.stats = collections.Counter()
+
+    def adapt(self, latency=None, throttled=False):
+        if throttled:
+            factor = 0.5
+        else:
+            # move part of the way towards the size that would take target_latency
+            factor = min(1.5, max(0.5, (self.target_latency / max(latency, 0.001)) ** 0.5))
+        self.batch_bytes = int(min(self.max_batch, max(self.min_batch, self.batch_bytes * factor)))
+
+    def post(self, actions, stats):
+        """Send actions (pairs of action and document lines), returning the per-item results"""
+        payload = b''.join(action + document for action, document in actions)
+        headers = {'Content-Type': 'application/x-ndjson'}
+        if self.compress:
+            payload = gzip.compress(payload, compresslevel=GZIP_LEVEL)
+            headers['Content-Encoding'] = 'gzip'
+        start = time.monotonic()
+        response = self.client.request('POST', '_bulk', raw_body=payload, headers=headers,
+                                       params={'filter_path': 'errors,items.*.status,items.*.error'})
+        latency = time.monotonic() - start
+        items = [next(iter(item.values())) for item in response.get('items', [])]
+        self.adapt(latency, throttled=any(item.get('status') == 429 for item in items))
+        stats['requests'] += 1
+        stats['bytes'] += len(payload)
+        return items
+
+    def send(self, actions):
+        """
+        Send a batch, retrying what OpenSearch rejected for load, and return a Counter of the results;
+        raises OpenSearchError or OSError if it can't be delivered
+        """
+        stats = collections.Counter()
+        attempt = 0
+        while actions:
+            try:
+                items = self.post(actions, stats)
+            except OpenSearchError as e:
+                if e.status == 413 and len(actions) > 1:
+                    # too large for http.max_content_length: send it in halves
+                    self.adapt(throttled=True)
+                    middle = len(actions) // 2
+                    stats.update(self.send(actions[:middle]))
+                    actions = actions[middle:]
+                    continue
+                if e.status not in RETRY_STATUSES or attempt >= self.retries:
+                    raise
+                self.adapt(throttled=True)
+            except OSError:
+                if attempt >= self.retries:
+                    raise
+                self.adapt(throttled=True)
+            else:
+                retry = []
+                for (action, document), item in zip(actions, items):
+                    status = item.get('status', 0)
+                    if status < 300:
+                        stats['created'] += 1
+                    elif status == 409:
+                        # already shipped by an earlier run
+                        stats['existing'] += 1
+                    elif status == 429 and attempt < self.retries:
+                        retry.append((action, document))
+                    else:
+                        stats['failed'] += 1
+                        if self.stats['failed'] + stats['failed'] <= 10:
+                            print(f"Warning: document rejected ({status}): {json.dumps(item.get('error'))}", file=sys.stderr)
+                actions = retry
+                if not actions:
+                    break
+            attempt += 1
+            time.sleep(min(30., 0.5 * 2 ** attempt))
+        return stats
+
+    def submit(self, actions):
+        return self.pool.submit(self.send, actions)
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+
+def action_lines(index, doc_id, document):
+    return json_dumps({'create': {'_index': index, '_id': doc_id}}) + b'\n', json_dumps(document) + b'\n'
+
+def ship(source, shipper, offsets, save, checkpoint_interval=5.):
+    """
+    Ship the documents from source in batches of shipper.batch_bytes, with up to two batches per connection
+    in flight. Checkpoints are put in offsets (and saved) in the order the batches were read, once every
+    earlier batch has been delivered, so nothing is skipped after a failure or an interruption.
+    """
+    in_flight = collections.deque()
+    actions, checkpoints, size = [], {}, 0
+    last_save = last_report = start = time.monotonic()
+
+    def complete(wait):
+        nonlocal last_save
+        while in_flight and (wait or in_flight[0][0].done()):
+            future, batch_checkpoints = in_flight.popleft()
+            shipper.stats.update(future.result())
+            offsets.update(batch_checkpoints)
+            wait = wait and len(in_flight) >= shipper.connections * 2
+        if time.monotonic() - last_save >= checkpoint_interval:
+            save()
+            last_save = time.monotonic()
+
+    def submit():
+        nonlocal actions, checkpoints, size
+        in_flight.append((shipper.submit(actions), checkpoints))
+        actions, checkpoints, size = [], {}, 0
+
+    try:
+        for documents, source_checkpoints in source:
+            for document in documents:
+                action = action_lines(*document)
+                actions.append(action)
+                size += len(action[0]) + len(action[1])
+            checkpoints.update(source_checkpoints)
+            if size >= shipper.batch_bytes:
+                submit()
+            complete(wait=len(in_flight) >= shipper.connections * 2)
+            now = time.monotonic()
+            if now - last_report >= 10:
+                report(shipper, now - start)
+                last_report = now
+        if actions or checkpoints:
+            submit()
+        while in_flight:
+            complete(wait=True)
+    finally:
+        save()
+    report(shipper, time.monotonic() - start)
+
+def report(shipper, elapsed):
+    stats = shipper.stats
+    shipped = stats['created'] + stats['existing']
+    print(f"Shipped {shipped} documents ({stats['created']} new, {stats['existing']} already present, {stats['failed']} rejected) "
+          f"in {elapsed:.0f}s, {shipped / max(elapsed, 0.001):.0f}/s; {stats['bytes'] / (1 << 20):.1f}MB sent in {stats['requests']} requests, "
+          f"batch size now {shipper.batch_bytes / (1 << 20):.1f}MB", file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description='Backfill OpenSearch with container logs that fluent-bit did not deliver')
+    source_group = parser.add_mutually_exclusive_group()
+    source_group.add_argument('--docker-logs', metavar='DIR', nargs='?', const=DEFAULT_CONTAINERS_DIR, default=DEFAULT_CONTAINERS_DIR,
+                              help=f'Ship docker json-file logs from this containers directory (the default, from {DEFAULT_CONTAINERS_DIR})')
+    source_group.add_argument('--flb-storage', metavar='DIR', nargs='?', const=DEFAULT_FLB_STORAGE,
+                              help=f'Ship the chunks in fluent-bit\'s filesystem storage instead (default: {DEFAULT_FLB_STORAGE}; the '
+                                   'fluent-bit-storage volume on the host); needs msgpack, and fluent-bit should be stopped')
+    parser.add_argument('--docker-service', action='append', help='Only ship logs of this service (may be repeated)')
+    parser.add_argument('--compose-service-names', action='store_true',
+                        help='Set service_name from the compose service label, as fluent-bit does with SERVICE_NAME_FROM_COMPOSE_LABEL=1 '
+                             '(default: from swarm container names only)')
+    parser.add_argument('--since', type=parse_time, help='Only ship entries from this time on (ISO time in UTC, or e.g. 6h ago)')
+    parser.add_argument('--until', type=parse_time, help='Only ship entries before this time')
+    parser.add_argument('--allow-overlap', action='store_true',
+                        help='Ship docker logs even though logs-* has documents between --since and --until; the ones fluent-bit delivered get duplicated')
+    parser.add_argument('--checkpoint', help=f'File to keep shipped offsets in (default: {get_checkpoint_file()})')
+    parser.add_argument('--opensearch', metavar='URL', help='OpenSearch URL (default: http://$OPENSEARCH_HOST, or localhost:9200)')
+    parser.add_argument('-c', '--connections', type=int, default=4, help='Number of bulk requests to send in parallel (default: 4)')
+    parser.add_argument('--target-latency', type=float, default=2., help='Seconds each bulk request should take; batches are sized to match (default: 2)')
+    parser.add_argument('--max-batch-mb', type=float, default=32., help='Largest uncompressed batch in MB (default: 32)')
+    parser.add_argument('--no-compress', action='store_true', help='Send uncompressed requests')
+    parser.add_argument('--retries', type=int, default=8, help='Times to retry a request OpenSearch rejects for load or fails to answer (default: 8)')
+    args = parser.parse_args()
+    if not args.flb_storage and not (args.since and args.until):
+        parser.error('shipping docker logs needs --since and --until around the gap: the documents fluent-bit delivered '
+                     'have ids of their own, so everything else would be indexed twice')
+
+    checkpoint_file = args.checkpoint or get_checkpoint_file()
+    time_range = TimeRange(args.since, args.until)
+    client = OpenSearchClient(args.opensearch, timeout=max(60, args.target_latency * 10))
+    shipper = BulkShipper(client, connections=args.connections, compress=not args.no_compress, target_latency=args.target_latency,
+                          max_batch=int(args.max_batch_mb * (1 << 20)), retries=args.retries)
+    shipper.batch_bytes = min(shipper.batch_bytes, shipper.max_batch)
+    if args.flb_storage:
+        try:
+            import msgpack  # noqa: F401
+        except ImportError:
+            print("Error: reading fluent-bit storage needs msgpack (pip install msgpack)", file=sys.stderr)
+            sys.exit(1)
+        offsets = load_checkpoint(checkpoint_file)
+        source = flb_source(args.flb_storage, offsets, time_range)
+        save = lambda: save_checkpoint(checkpoint_file, {path: checkpoint for path, checkpoint in offsets.items() if os.path.exists(path)})
+    else:
+        try:
+            existing = count_existing(client, time_range)
+        except (OpenSearchError, OSError) as e:
+            print(f"Error counting the documents already in OpenSearch: {e}", file=sys.stderr)
+            sys.exit(1)
+        if existing and not args.allow_overlap:
+            print(f"Error: {INDEX_PREFIX}-* already has {existing} documents between --since and --until, which would be indexed twice; "
+                  "narrow the window to the gap, or pass --allow-overlap", file=sys.stderr)
+            sys.exit(1)
+        tailer = DockerLogTailer(args.docker_logs, checkpoint_file, from_start=True, services=args.docker_service)
+        offsets, save = tailer.offsets, tailer.save
+        source = docker_source(tailer, time_range, args.compose_service_names)
+    try:
+        ship(source, shipper, offsets, save)
+    except (OpenSearchError, OSError) as e:
+        print(f"Error shipping to OpenSearch: {e}; offsets up to the last delivered batch were saved", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        shipper.close()
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
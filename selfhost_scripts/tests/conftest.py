@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the scripts import the shared modules in selfhost_scripts by their top-level names
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
@@ -0,0 +1,88 @@
+import importlib.util
+import os
+
+import pytest
+
+pytest.importorskip('pandas')
+
+spec = importlib.util.spec_from_file_location('compose2envtable', os.path.join(os.path.dirname(__file__), '..', 'compose2envtable', 'main.py'))
+compose2envtable = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(compose2envtable)
+
+SOURCES = {
+    'docker-compose.yaml': {
+        'pds': {'PDS_HOSTNAME': 'pds.${DOMAIN}', 'LOG_LEVEL': 'info'},
+        'bsky': {'BSKY_PUBLIC_URL': 'https://api.${DOMAIN}', 'LOG_LEVEL': 'info'},
+    },
+    'override.yaml': {
+        'pds': {'LOG_LEVEL': 'debug'},
+    },
+}
+
+PROFILES = {
+    '.env': {'DOMAIN': 'example.com'},
+    '.env.staging': {'DOMAIN': 'staging.example.com'},
+}
+
+def records(df):
+    return sorted(tuple(None if value != value else value for value in row) for row in df.itertuples(index=False))
+
+def test_mk_table_pivots_envs_by_container():
+    d = compose2envtable.mergeSources(SOURCES)
+    gd = compose2envtable.groupbyEnv(d)
+    rows, gd = compose2envtable.update4ComposerOnly(set(['LOG_LEVEL', 'UNUSED']), gd)
+    df = compose2envtable.mkTable(rows, ['bsky', 'pds'], list(gd.values()))
+    assert list(df.index) == ['BSKY_PUBLIC_URL', 'LOG_LEVEL', 'PDS_HOSTNAME', 'UNUSED']
+    assert df.loc['LOG_LEVEL', 'pds'] == 'debug'
+    assert df.loc['LOG_LEVEL', 'bsky'] == 'info'
+    assert df.loc['PDS_HOSTNAME', 'pds'] == 'pds.${DOMAIN}'
+    assert df.loc['UNUSED'].isna().all()
+
+def test_mk_table_statistics():
+    gd = compose2envtable.groupbyEnv({'a': {'X': '1'}, 'b': {'X': '1'}, 'c': {'X': '2', 'Y': '3'}})
+    rows, gd = compose2envtable.update4ComposerOnly(set(['X']), gd, mark='Y')
+    extraFields = compose2envtable.EnvVal.__statisticsFields__
+    df = compose2envtable.mkTable(rows, extraFields + ['a', 'b', 'c'], list(gd.values()), extraFields=extraFields)
+    assert df.loc['X', 'mostCommon_'] == '1'
+    assert df.loc['Y', 'composerOnly_'] == 'Y'
+    assert df.loc['X', 'composerOnly_'] != 'Y'
+
+def test_cube_resolves_each_profile():
+    cube = compose2envtable.mkCube(SOURCES, PROFILES)
+    assert cube.profiles == ['.env', '.env.staging']
+    df = compose2envtable.cubeToRecords(cube)
+    hostname = df[(df.env == 'PDS_HOSTNAME')].set_index('profile')['value']
+    assert hostname.to_dict() == {'.env': 'pds.example.com', '.env.staging': 'pds.staging.example.com'}
+
+def test_cube_raw_values_without_profiles():
+    cube = compose2envtable.mkCube(SOURCES, {})
+    assert cube.profiles == ['raw']
+    df = compose2envtable.cubeToRecords(cube)
+    assert set(df[df.env == 'PDS_HOSTNAME']['value']) == {'pds.${DOMAIN}'}
+
+def test_diff_profiles():
+    df = compose2envtable.diffProfiles(compose2envtable.mkCube(SOURCES, PROFILES))
+    assert records(df) == [
+        ('BSKY_PUBLIC_URL', 'docker-compose.yaml', 'bsky', 'https://api.example.com', 'https://api.staging.example.com'),
+        ('PDS_HOSTNAME', 'docker-compose.yaml', 'pds', 'pds.example.com', 'pds.staging.example.com'),
+    ]
+
+def test_diff_sources_compares_envs_set_by_both():
+    df = compose2envtable.diffSources(compose2envtable.mkCube(SOURCES, {}))
+    assert records(df) == [('LOG_LEVEL', 'pds', 'raw', 'info', 'debug')]
+
+def test_diff_sources_missing_differs():
+    df = compose2envtable.diffSources(compose2envtable.mkCube(SOURCES, {}), missingDiffers=True)
+    assert records(df) == [
+        ('LOG_LEVEL', 'pds', 'raw', 'info', 'debug'),
+        ('PDS_HOSTNAME', 'pds', 'raw', 'pds.${DOMAIN}', None),
+    ]
+
+def test_diff_sources_compares_all_sources_setting_env():
+    sources = {
+        'a.yaml': {'pds': {'X': '1'}},
+        'b.yaml': {'pds': {'Y': '1'}},
+        'c.yaml': {'pds': {'Y': '2'}},
+    }
+    df = compose2envtable.diffSources(compose2envtable.mkCube(sources, {}))
+    assert records(df) == [('Y', 'pds', 'raw', '1', '2')]
@@ -0,0 +1,88 @@
+import pytest
+
+import compose_model
+from compose_model import interpolate, load_compose, normalize_compose, read_env_file, service_environment
+
+COMPOSE = """\
+x-logging: &logging
+  driver: json-file
+services:
+  pds:
+    logging: *logging
+    env_file: ./pds.env
+    environment:
+      - PDS_HOSTNAME=pds.${DOMAIN}
+      - PDS_DEBUG=${PDS_DEBUG:-false}
+      - PASSED_THROUGH
+  bsky:
+    environment:
+      BSKY_PUBLIC_URL: https://api.${DOMAIN}
+      BSKY_ENABLED: true
+"""
+
+@pytest.mark.parametrize('src, expected', [
+    ('${DOMAIN}', 'example.com'),
+    ('$DOMAIN/x', 'example.com/x'),
+    ('$$DOMAIN', '$DOMAIN'),
+    ('${EMPTY:-default}', 'default'),
+    ('${EMPTY-default}', ''),
+    ('${UNSET-default}', 'default'),
+    ('${DOMAIN:+set}', 'set'),
+    ('${EMPTY:+set}', ''),
+    ('${EMPTY+set}', 'set'),
+    ('${UNSET}', ''),
+])
+def test_interpolate(src, expected):
+    assert interpolate(src, {'DOMAIN': 'example.com', 'EMPTY': ''}) == expected
+
+def test_read_env_file_quoting(tmp_path):
+    env_file = tmp_path / 'test.env'
+    env_file.write_text("""\
+# comment
+export DOMAIN=example.com
+UNQUOTED=pds.${DOMAIN}  # inline comment
+DOUBLE="pds.${DOMAIN} # not a comment"
+SINGLE='pds.${DOMAIN}'
+FROM_ENV=${OUTER}
+""")
+    assert read_env_file(env_file, {'OUTER': 'outer'}) == {
+        'DOMAIN': 'example.com',
+        'UNQUOTED': 'pds.example.com',
+        'DOUBLE': 'pds.example.com # not a comment',
+        'SINGLE': 'pds.${DOMAIN}',
+        'FROM_ENV': 'outer',
+    }
+
+def test_normalize_compose():
+    model = normalize_compose(compose_model.load_yaml(COMPOSE))
+    assert 'x-logging' not in model
+    assert model['services']['pds']['logging'] == {'driver': 'json-file'}
+    assert model['services']['pds']['env_file'] == ['./pds.env']
+    assert model['services']['pds']['environment']['PASSED_THROUGH'] is None
+    assert model['services']['bsky']['environment']['BSKY_ENABLED'] == 'true'
+
+def test_service_environment(tmp_path):
+    (tmp_path / 'pds.env').write_text('PDS_ADMIN_PASSWORD=secret\nPDS_HOSTNAME=overridden\n')
+    model = normalize_compose(compose_model.load_yaml(COMPOSE))
+    environment = service_environment(model, 'pds', {'DOMAIN': 'example.com', 'PASSED_THROUGH': 'yes'}, base_dir=tmp_path)
+    assert environment == {
+        'PDS_ADMIN_PASSWORD': 'secret',
+        'PDS_HOSTNAME': 'pds.example.com',
+        'PDS_DEBUG': 'false',
+        'PASSED_THROUGH': 'yes',
+    }
+    # without env, values are returned as written
+    assert service_environment(model, 'bsky')['BSKY_PUBLIC_URL'] == 'https://api.${DOMAIN}'
+    with pytest.raises(KeyError):
+        service_environment(model, 'missing')
+
+def test_load_compose_cached_by_content(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    compose_file = tmp_path / 'docker-compose.yaml'
+    compose_file.write_text(COMPOSE)
+    model = load_compose(compose_file)
+    assert len(list((tmp_path / 'cache').rglob('*.json'))) == 1
+    assert load_compose(compose_file) == model
+    compose_file.write_text(COMPOSE.replace('api.', 'appview.'))
+    assert load_compose(compose_file)['services']['bsky']['environment']['BSKY_PUBLIC_URL'] == 'https://appview.${DOMAIN}'
+    assert len(list((tmp_path / 'cache').rglob('*.json'))) == 2
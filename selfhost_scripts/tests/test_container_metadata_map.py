@@ -0,0 +1,58 @@
+import json
+
+from container_metadata_map import render_map, scan_containers, write_map
+from docker_logs import read_container_metadata, read_container_name, swarm_service_name
+
+def add_container(containers_dir, container_id, name, compose_service=None):
+    container_dir = containers_dir / container_id
+    container_dir.mkdir(parents=True)
+    labels = {'com.docker.compose.service': compose_service} if compose_service else {}
+    (container_dir / 'config.v2.json').write_text(json.dumps({'Name': f'/{name}', 'Config': {'Labels': labels}}))
+    return container_dir
+
+def test_swarm_service_name():
+    assert swarm_service_name('bsky_pds.1.abc123') == 'pds'
+    assert swarm_service_name('selfhost-pds-1') is None
+
+def test_container_naming(tmp_path):
+    compose = add_container(tmp_path, 'a' * 64, 'selfhost-pds-1', 'pds')
+    swarm = add_container(tmp_path, 'b' * 64, 'bsky_appview.1.xyz')
+    plain = add_container(tmp_path, 'c' * 64, 'jaeger')
+    assert read_container_metadata(str(compose)) == ('selfhost-pds-1', 'pds')
+    assert read_container_metadata(str(swarm)) == ('bsky_appview.1.xyz', None)
+    assert read_container_name(str(compose)) == 'pds'
+    assert read_container_name(str(swarm)) == 'appview'
+    assert read_container_name(str(plain)) == 'jaeger'
+    assert read_container_name(str(tmp_path / ('d' * 64))) == 'd' * 12
+
+def test_scan_reuses_known_containers(tmp_path):
+    add_container(tmp_path, 'a' * 64, 'selfhost-pds-1', 'pds')
+    (tmp_path / ('b' * 64)).mkdir()
+    containers, complete = scan_containers(str(tmp_path))
+    assert containers == {'a' * 64: ('selfhost-pds-1', 'pds')}
+    # the container without a config yet is retried
+    assert not complete
+    containers, complete = scan_containers(str(tmp_path), {'a' * 64: ('known', None), 'gone': ('old', None)})
+    assert containers == {'a' * 64: ('known', None)}
+
+def test_render_map():
+    content = render_map({'b' * 64: ('bsky_appview.1.xyz', None), 'a' * 64: ('selfhost-pds-1', 'pds')})
+    header, *lines = content.splitlines()
+    assert header.startswith('# container-map ')
+    assert lines == [f"{'a' * 64}\tselfhost-pds-1\tpds", f"{'b' * 64}\tbsky_appview.1.xyz\t"]
+    # the hash in the header changes with the content
+    assert render_map({'a' * 64: ('selfhost-pds-1', None)}).splitlines()[0] != header
+
+def test_write_map_only_when_changed(tmp_path):
+    map_file = tmp_path / 'metadata' / 'container-map.tsv'
+    containers = {'a' * 64: ('selfhost-pds-1', 'pds')}
+    changed, written = write_map(str(map_file), containers)
+    assert changed
+    assert map_file.read_text() == render_map(containers)
+    assert write_map(str(map_file), containers, written) == (False, written)
+    # rewritten after something else changed it
+    map_file.write_text('')
+    changed, written = write_map(str(map_file), containers, written)
+    assert changed and map_file.read_text() == render_map(containers)
+    changed, _ = write_map(str(map_file), {}, written)
+    assert changed
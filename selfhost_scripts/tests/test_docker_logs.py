@@ -0,0 +1,80 @@
+import json
+
+import pytest
+
+from docker_logs import DockerLogTailer, load_checkpoint
+
+def add_container(containers_dir, container_id, service, entries=()):
+    container_dir = containers_dir / container_id
+    container_dir.mkdir(parents=True)
+    config = {'Name': f'/selfhost-{service}-1', 'Config': {'Labels': {'com.docker.compose.service': service}}}
+    (container_dir / 'config.v2.json').write_text(json.dumps(config))
+    log_file = container_dir / f'{container_id}-json.log'
+    log_file.touch()
+    append(log_file, *entries)
+    return log_file
+
+def append(log_file, *messages):
+    with log_file.open('a') as f:
+        for message in messages:
+            f.write(json.dumps({'log': message, 'stream': 'stdout', 'time': '2024-01-01T00:00:00Z'}) + '\n')
+
+@pytest.fixture
+def containers_dir(tmp_path):
+    return tmp_path / 'containers'
+
+@pytest.fixture
+def checkpoint(tmp_path):
+    return tmp_path / 'offsets.json'
+
+def read_all(containers_dir, checkpoint, **kwargs):
+    tailer = DockerLogTailer(str(containers_dir), str(checkpoint), **kwargs)
+    return [line for lines in tailer.line_batches(follow=False) for line in lines]
+
+def test_reads_service_lines(containers_dir, checkpoint):
+    add_container(containers_dir, 'a' * 64, 'pds', ['{"msg":"one"}\n', '{"msg":"two"}\n'])
+    add_container(containers_dir, 'b' * 64, 'bsky', ['{"msg":"three"}\n'])
+    assert sorted(read_all(containers_dir, checkpoint, from_start=True)) == [
+        'bsky | {"msg":"three"}\n', 'pds | {"msg":"one"}\n', 'pds | {"msg":"two"}\n']
+
+def test_joins_split_messages(containers_dir, checkpoint):
+    add_container(containers_dir, 'a' * 64, 'pds', ['{"msg":"lo', 'ng"}\n', '{"msg":"next"}\n'])
+    assert read_all(containers_dir, checkpoint, from_start=True) == ['pds | {"msg":"long"}\n', 'pds | {"msg":"next"}\n']
+
+def test_resumes_from_checkpoint(containers_dir, checkpoint):
+    log_file = add_container(containers_dir, 'a' * 64, 'pds', ['{"n":1}\n'])
+    assert read_all(containers_dir, checkpoint, from_start=True) == ['pds | {"n":1}\n']
+    assert load_checkpoint(str(checkpoint))[str(log_file)]['offset'] == log_file.stat().st_size
+    append(log_file, '{"n":2}\n')
+    assert read_all(containers_dir, checkpoint, from_start=True) == ['pds | {"n":2}\n']
+
+def test_incomplete_message_read_again_after_restart(containers_dir, checkpoint):
+    log_file = add_container(containers_dir, 'a' * 64, 'pds', ['{"n":1}\n', '{"n":'])
+    assert read_all(containers_dir, checkpoint, from_start=True) == ['pds | {"n":1}\n']
+    append(log_file, '2}\n')
+    assert read_all(containers_dir, checkpoint, from_start=True) == ['pds | {"n":2}\n']
+
+def test_existing_files_read_from_end_without_checkpoint(containers_dir, checkpoint):
+    add_container(containers_dir, 'a' * 64, 'pds', ['{"n":1}\n'])
+    assert read_all(containers_dir, checkpoint) == []
+
+def test_rotated_file_read_from_start(containers_dir, checkpoint):
+    log_file = add_container(containers_dir, 'a' * 64, 'pds', ['{"n":1}\n', '{"n":2}\n'])
+    read_all(containers_dir, checkpoint, from_start=True)
+    log_file.unlink()
+    append(log_file, '{"n":3}\n')
+    assert read_all(containers_dir, checkpoint, from_start=True) == ['pds | {"n":3}\n']
+
+def test_service_filter(containers_dir, checkpoint):
+    add_container(containers_dir, 'a' * 64, 'pds', ['{"n":1}\n'])
+    add_container(containers_dir, 'b' * 64, 'bsky', ['{"n":2}\n'])
+    assert read_all(containers_dir, checkpoint, from_start=True, services=['bsky']) == ['bsky | {"n":2}\n']
+
+def test_idle_batches(containers_dir, checkpoint):
+    log_file = add_container(containers_dir, 'a' * 64, 'pds')
+    tailer = DockerLogTailer(str(containers_dir), str(checkpoint), poll_interval=0.)
+    batches = tailer.line_batches(follow=True, idle=True)
+    assert next(batches) == []
+    append(log_file, '{"n":1}\n')
+    assert next(batches) == ['pds | {"n":1}\n']
+    batches.close()
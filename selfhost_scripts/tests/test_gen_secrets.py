@@ -0,0 +1,70 @@
+import sys
+
+import pytest
+
+import gen_secrets
+from env_utils import read_env
+
+TEMPLATE = """\
+ADMIN_PASSWORD=                                 # long_hex
+PDS_JWT_SECRET=                                 # short_hex
+POSTGRES_USER=                                  # fixed_value:pg
+POSTGRES_PASSWORD=                              # complex_password
+BSKY_STATSIG_KEY=                               # external
+"""
+
+@pytest.fixture
+def template(tmp_path):
+    template_file = tmp_path / 'secrets-passwords.env.example'
+    template_file.write_text(TEMPLATE)
+    return template_file
+
+def run(monkeypatch, *args):
+    monkeypatch.setattr(sys, 'argv', ['gen_secrets.py', *map(str, args)])
+    gen_secrets.main()
+
+def test_seeded_random_is_reproducible_per_stack():
+    first = gen_secrets.seeded_stack_random('s', 'alpha')
+    second = gen_secrets.seeded_stack_random('s', 'alpha')
+    assert gen_secrets.generate_long_key(first) == gen_secrets.generate_long_key(second)
+    assert gen_secrets.generate_random_password(first) == gen_secrets.generate_random_password(second)
+    other = gen_secrets.seeded_stack_random('s', 'beta')
+    assert gen_secrets.generate_long_key(gen_secrets.seeded_stack_random('s', 'alpha')) != gen_secrets.generate_long_key(other)
+
+def test_generated_formats():
+    assert len(gen_secrets.generate_long_key()) == 64
+    assert len(gen_secrets.generate_short_key(gen_secrets.seeded_stack_random('s', 'alpha'))) == 32
+    assert gen_secrets.generate_short_key() != gen_secrets.generate_short_key()
+
+def test_generate_keeps_existing_values(tmp_path, template):
+    secret_config = gen_secrets.parse_secret_template(str(template))
+    secrets_file = tmp_path / 'secrets-passwords.env'
+    secrets_file.write_text('ADMIN_PASSWORD=kept\n')
+    new_secrets, external_secrets = gen_secrets.generate_secrets_file(secret_config, str(secrets_file))
+    assert set(new_secrets) == {'PDS_JWT_SECRET', 'POSTGRES_USER', 'POSTGRES_PASSWORD', 'BSKY_STATSIG_KEY'}
+    assert external_secrets == ['BSKY_STATSIG_KEY']
+    secret_vars = read_env(str(secrets_file), interpolate=False)
+    assert secret_vars['ADMIN_PASSWORD'] == 'kept'
+    assert secret_vars['POSTGRES_USER'] == 'pg'
+    assert gen_secrets.generate_secrets_file(secret_config, str(secrets_file))[0] == {}
+
+def test_stacks_with_seed(tmp_path, template, monkeypatch):
+    stacks_dir = tmp_path / 'stacks'
+    run(monkeypatch, '-t', template, '--stacks', 'alpha', 'beta', '--stacks-dir', stacks_dir, '--seed', 'fleet', '-k', 'k8s-secrets.yaml')
+    alpha = read_env(str(stacks_dir / 'alpha' / 'secrets-passwords.env'), interpolate=False)
+    beta = read_env(str(stacks_dir / 'beta' / 'secrets-passwords.env'), interpolate=False)
+    assert (stacks_dir / 'alpha' / 'k8s-secrets.yaml').exists()
+    assert alpha['ADMIN_PASSWORD'] != beta['ADMIN_PASSWORD']
+
+    # the same seed gives the same secrets for a stack generated again from scratch
+    run(monkeypatch, '-t', template, '--stacks', 'alpha', '--stacks-dir', tmp_path / 'again', '--seed', 'fleet')
+    assert read_env(str(tmp_path / 'again' / 'alpha' / 'secrets-passwords.env'), interpolate=False) == alpha
+
+def test_seed_needs_stacks(tmp_path, template, monkeypatch):
+    with pytest.raises(SystemExit):
+        run(monkeypatch, '-t', template, tmp_path / 'secrets-passwords.env', '--seed', 'fleet')
+    assert not (tmp_path / 'secrets-passwords.env').exists()
+
+def test_invalid_stack_name(tmp_path, template, monkeypatch):
+    with pytest.raises(SystemExit):
+        run(monkeypatch, '-t', template, '--stacks', '../escape', '--stacks-dir', tmp_path)
@@ -0,0 +1,123 @@
+import datetime
+import importlib.util
+import json
+import os
+import sys
+
+import pytest
+
+JAEGER_ANNOTATION = os.path.join(os.path.dirname(__file__), '..', 'utils', 'jaeger_annotation.py')
+
+@pytest.fixture
+def jaeger_annotation(monkeypatch):
+    """A fresh copy of the module, so the clients it creates lazily aren't shared between tests"""
+    monkeypatch.delenv('JAEGER_URL', raising=False)
+    spec = importlib.util.spec_from_file_location('jaeger_annotation', JAEGER_ANNOTATION)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def test_import_loads_no_clients(jaeger_annotation):
+    assert jaeger_annotation._jaeger_client is None and jaeger_annotation._tracer is None and jaeger_annotation._exporter is None
+    assert not any(name == 'requests_openapi' or name.startswith('opentelemetry') for name in sys.modules)
+
+def test_clients_created_once_on_first_use(jaeger_annotation, monkeypatch):
+    opened = []
+    monkeypatch.setattr(jaeger_annotation, 'open_jaeger_client', lambda: opened.append(jaeger_annotation.jaeger_url) or object())
+    monkeypatch.setattr(jaeger_annotation, 'setup_otlp_client', lambda: object())
+    jaeger_annotation.configure(jaeger='http://jaeger:16686/', otlp='http://collector:4318/v1/traces')
+    assert opened == []
+    client = jaeger_annotation.jaeger_client
+    assert jaeger_annotation.get_jaeger_client() is client
+    assert opened == ['http://jaeger:16686']
+    assert jaeger_annotation.otlp_endpoint == 'http://collector:4318/v1/traces'
+    assert jaeger_annotation.tracer is jaeger_annotation.get_tracer()
+
+def test_unknown_attribute(jaeger_annotation):
+    with pytest.raises(AttributeError):
+        jaeger_annotation.not_a_client
+
+NOW = datetime.datetime(2024, 5, 1, 12, tzinfo=datetime.timezone.utc)
+
+class FakeResponse:
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+        self.text = json.dumps(content)
+
+    def json(self):
+        return self.content
+
+class FakeJaegerClient:
+    """Searches {service: {trace_id: start time}} like the Jaeger API v3, returning at most query.search_depth traces"""
+    def __init__(self, traces, failing=()):
+        self.traces = traces
+        self.failing = set(failing)
+        self.searches = []
+
+    def QueryService_GetServices(self):
+        return FakeResponse(200, {'services': list(self.traces)})
+
+    def QueryService_FindTraces(self, **query):
+        service_name = query['query.service_name']
+        start_min, start_max = (datetime.datetime.fromisoformat(query[f'query.start_time_{end}'][:26]).replace(tzinfo=datetime.timezone.utc)
+                                for end in ('min', 'max'))
+        self.searches.append((service_name, start_min, start_max))
+        if service_name in self.failing:
+            return FakeResponse(503, {'error': 'unavailable'})
+        found = [(trace_id, start) for trace_id, start in self.traces[service_name].items() if start_min <= start <= start_max]
+        if not found:
+            return FakeResponse(404, {'error': {'httpCode': 404, 'message': 'No traces found'}})
+        spans = [{'traceId': trace_id, 'startTimeUnixNano': str(int(start.timestamp() * 1e9))} for trace_id, start in found[:query['query.search_depth']]]
+        return FakeResponse(200, {'result': {'resourceSpans': [{'scopeSpans': [{'spans': spans}]}]}})
+
+@pytest.fixture
+def index(jaeger_annotation, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return jaeger_annotation.TraceIdIndex(str(tmp_path / 'trace-ids.sqlite'))
+
+def trace_id(n):
+    return f'{n:032x}'
+
+def test_find_by_prefix(index):
+    with index.db:
+        index.add({'4bf92f3577b34da6a3ce929d0e0e4736': 2, '4bf92f3000000000000000000000000a': 3, '5bf92f3577b34da6a3ce929d0e0e4736': 1})
+    assert index.find('4BF92F3') == ['4bf92f3000000000000000000000000a', '4bf92f3577b34da6a3ce929d0e0e4736']
+    assert index.find('4bf92f35') == ['4bf92f3577b34da6a3ce929d0e0e4736']
+    assert index.find('6') == []
+    for bad in ('4bf92g3', '', '0' * 33):
+        with pytest.raises(ValueError, match='not a trace id'):
+            index.find(bad)
+
+def test_refresh_searches_from_last_index(index):
+    client = FakeJaegerClient({'pds': {trace_id(1): NOW - datetime.timedelta(hours=1)}})
+    index.refresh(client, days=7, now=NOW)
+    assert client.searches == [('pds', NOW - datetime.timedelta(days=7), NOW)]
+    assert index.indexed_until('pds') == NOW
+    later = NOW + datetime.timedelta(hours=1)
+    client.traces['pds'][trace_id(2)] = NOW + datetime.timedelta(minutes=30)
+    index.refresh(client, days=7, now=later)
+    # the next search starts INDEX_OVERLAP before the last one ended
+    assert client.searches[-1] == ('pds', NOW - datetime.timedelta(minutes=5), later)
+    assert index.find(trace_id(0)[:30]) == [trace_id(2), trace_id(1)]
+
+def test_refresh_skips_failed_searches(jaeger_annotation, index):
+    client = FakeJaegerClient({'pds': {trace_id(1): NOW}, 'bsky': {trace_id(2): NOW}}, failing=['bsky'])
+    index.refresh(client, now=NOW)
+    assert index.indexed_until('pds') == NOW
+    # not advanced, so the next refresh searches the whole window again
+    assert index.indexed_until('bsky') is None
+    client.failing.add('pds')
+    with pytest.raises(jaeger_annotation.JaegerQueryError):
+        index.refresh(client, now=NOW + datetime.timedelta(hours=1))
+    assert index.indexed_until('pds') == NOW
+
+def test_search_split_at_depth(jaeger_annotation, monkeypatch):
+    monkeypatch.setattr(jaeger_annotation, 'SEARCH_DEPTH', 4)
+    traces = {trace_id(n): NOW - datetime.timedelta(minutes=n) for n in range(1, 11)}
+    client = FakeJaegerClient({'pds': traces})
+    found = jaeger_annotation.find_trace_starts(client, 'pds', NOW - datetime.timedelta(hours=1), NOW)
+    assert set(found) == set(traces)
+    assert found[trace_id(3)] == int((NOW - datetime.timedelta(minutes=3)).timestamp() * 1e9)
+    assert len(client.searches) > 1
+    assert all(end - start <= datetime.timedelta(minutes=30) for _, start, end in client.searches[1:])
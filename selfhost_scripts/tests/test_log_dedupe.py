@@ -0,0 +1,93 @@
+from log_dedupe import NoiseReducer, RepeatCollapser, ServiceSampler, fingerprint
+
+def test_fingerprint_ignores_volatile_fields():
+    first = {'level': 30, 'msg': 'ok', 'time': 1, 'pid': 7, 'reqId': 'a'}
+    second = {'level': 30, 'msg': 'ok', 'time': 2, 'pid': 8, 'reqId': 'b'}
+    assert fingerprint('pds', first) == fingerprint('pds', second)
+    assert fingerprint('pds', first) != fingerprint('bsky', first)
+    assert fingerprint('pds', first) != fingerprint('pds', {**first, 'msg': 'not ok'})
+
+def test_sampler_allows_burst_then_rate():
+    sampler = ServiceSampler(rate=5)
+    assert [sampler.allow('pds', 100.) for _ in range(7)] == [True] * 5 + [False] * 2
+    # one token back every 1/rate seconds
+    assert sampler.allow('pds', 100.2)
+    assert not sampler.allow('pds', 100.2)
+    # the bucket holds at most one second's worth
+    assert [sampler.allow('pds', 200.) for _ in range(7)] == [True] * 5 + [False] * 2
+
+def test_sampler_buckets_per_service():
+    sampler = ServiceSampler(rate=1)
+    assert sampler.allow('pds', 0.)
+    assert not sampler.allow('pds', 0.)
+    assert sampler.allow('bsky', 0.)
+    assert sampler.report() == [(None, ('pds', None, ' [sampled: dropped 1 lines over 1/s]\n'))]
+    assert sampler.report() == []
+
+def test_sampler_refill_clamped_when_time_steps_back():
+    sampler = ServiceSampler(rate=2)
+    assert sampler.allow('pds', 10.)
+    assert sampler.allow('pds', 10.)
+    # an earlier record must not take tokens away, nor refill them when time catches up again
+    assert not sampler.allow('pds', 5.)
+    assert sampler.buckets['pds'] == (0., 10.)
+    assert not sampler.allow('pds', 10.)
+    assert sampler.allow('pds', 10.5)
+
+def test_collapser_counts_repeats_per_window():
+    collapser = RepeatCollapser(window=5.)
+    record = {'level': 30, 'msg': 'ok'}
+    assert collapser.process('pds', 'pds-1', dict(record), 0.) == (True, [])
+    assert collapser.process('pds', 'pds-1', dict(record), 1.) == (False, [])
+    assert collapser.process('pds', 'pds-1', dict(record), 2.) == (False, [])
+    show, summaries = collapser.process('pds', 'pds-1', dict(record), 6.)
+    assert show
+    assert summaries == [(None, ('pds-1', None, ' [repeated 2 more times in 2.0s] ok\n'))]
+
+def lines(*records):
+    return [(f"pds|{record}", ('pds', dict(record), str(record))) for record in records]
+
+def test_noise_reducer_uses_clock_for_live_logs():
+    now = [1000.]
+    reducer = NoiseReducer(sample_rate=1, clock=lambda: now[0])
+    timestamps = []
+    def record_timestamp(log_obj):
+        timestamps.append(log_obj)
+        return log_obj['time']
+    # records from the past don't move time when logs are live
+    output = reducer.process(lines({'msg': 'a', 'time': 1.}, {'msg': 'b', 'time': 500.}), str.strip, record_timestamp)
+    assert [parsed[1]['msg'] for line, parsed in output if line is not None] == ['a']
+    assert timestamps == []
+    now[0] = 1001.
+    output = reducer.process(lines({'msg': 'c', 'time': 2.}), str.strip, record_timestamp)
+    assert [parsed[1]['msg'] for line, parsed in output if line is not None] == ['c']
+
+def test_noise_reducer_uses_record_time_for_replays():
+    reducer = NoiseReducer(sample_rate=1, clock=lambda: 0., use_record_time=True)
+    output = reducer.process(lines({'msg': 'a', 'time': 1.}, {'msg': 'b', 'time': 1.5}, {'msg': 'c', 'time': 2.}), str.strip, lambda log_obj: log_obj['time'])
+    assert [parsed[1]['msg'] for line, parsed in output if line is not None] == ['a', 'c']
+    assert reducer.record_time == 2.
+
+def test_collapser_expires_oldest_windows_first():
+    collapser = RepeatCollapser(window=5.)
+    for now, msg in ((0., 'a'), (1., 'b'), (2., 'a'), (3., 'b'), (4., 'c')):
+        collapser.process('pds', 'pds-1', {'msg': msg}, now)
+    assert collapser.expire(5.) == []
+    assert collapser.expire(6.5) == [(None, ('pds-1', None, ' [repeated 1 more times in 2.0s] a\n')),
+                                     (None, ('pds-1', None, ' [repeated 1 more times in 2.0s] b\n'))]
+    assert list(collapser.trackers) == [fingerprint('pds', {'msg': 'c'})]
+
+def test_collapser_expiry_heap_stays_bounded():
+    collapser = RepeatCollapser(window=1000., max_entries=10)
+    for n in range(100):
+        collapser.process('pds', 'pds-1', {'msg': str(n)}, float(n))
+    assert len(collapser.trackers) == 10
+    assert len(collapser.expiry) <= 20
+
+def test_noise_reducer_reports_on_empty_batch():
+    now = [0.]
+    reducer = NoiseReducer(collapse_window=5., clock=lambda: now[0])
+    reducer.process(lines({'msg': 'a'}, {'msg': 'a'}, {'msg': 'a'}), str.strip, lambda log_obj: None)
+    # a burst that stops is reported once its window ends, without waiting for more input
+    now[0] = 6.
+    assert reducer.process([], str.strip, lambda log_obj: None) == [(None, ('pds', None, ' [repeated 2 more times in 0.0s] a\n'))]
@@ -0,0 +1,59 @@
+import pytest
+
+pytest.importorskip('pyarrow')
+
+import pyarrow.parquet
+
+from log_export import ParquetExporter, hour_end, hour_partition
+
+HOUR = 1700000000 - 1700000000 % 3600
+
+def exported_rows(directory):
+    return sum(pyarrow.parquet.read_table(path).num_rows for path in directory.rglob('*.parquet'))
+
+def test_hour_end():
+    assert hour_end(hour_partition(HOUR + 10)) == HOUR + 3600
+    assert hour_end('unknown') is None
+
+def test_buffered_rows_capped(tmp_path):
+    exporter = ParquetExporter(tmp_path, row_group_size=100, max_buffered_rows=150)
+    for n in range(90):
+        exporter.add('pds', {'msg': 'a'}, HOUR + n)
+        exporter.add('bsky', {'msg': 'b'}, HOUR + n)
+    assert exporter.buffered_rows <= 150
+    assert exporter.buffered_rows == sum(len(buffer['msg']) for buffer in exporter.buffers.values())
+    exporter.close()
+    assert exported_rows(tmp_path) == 180
+
+def test_closed_hours_written(tmp_path):
+    exporter = ParquetExporter(tmp_path, row_group_size=100, late_seconds=300)
+    exporter.add('pds', {'msg': 'a'}, HOUR + 10)
+    exporter.add('bsky', {'msg': 'b'}, HOUR + 20)
+    # within late_seconds of the hour's end, late records still join its partition
+    exporter.add('pds', {'msg': 'c'}, HOUR + 3600 + 100)
+    exporter.add('bsky', {'msg': 'd'}, HOUR + 30)
+    assert not list(tmp_path.rglob('*.parquet'))
+    exporter.add('pds', {'msg': 'e'}, HOUR + 3600 + 400)
+    assert list(exporter.buffers) == [('pds', hour_partition(HOUR + 3600))]
+    assert not exporter.writers
+    assert exported_rows(tmp_path) == 3
+    exporter.close()
+    assert exported_rows(tmp_path) == 5
+
+def test_flush_closes_open_files(tmp_path):
+    exporter = ParquetExporter(tmp_path, row_group_size=100, flush_seconds=60)
+    exporter.add('pds', {'msg': 'a'}, HOUR + 10)
+    exporter.add('pds', None, None, 'no time yet')
+    exporter.add('bsky', None, None, 'no time')
+    exporter.maybe_flush()
+    assert exported_rows(tmp_path) == 0
+    exporter.last_flush -= 60
+    exporter.maybe_flush()
+    # the current hour and the unknown hour are finished, without temporary files left
+    assert exported_rows(tmp_path) == 3
+    assert {path.parent.name for path in tmp_path.rglob('*.parquet')} == {f'hour={hour_partition(HOUR)}', 'hour=unknown'}
+    assert not list(tmp_path.rglob('.*.tmp'))
+    exporter.add('pds', {'msg': 'b'}, HOUR + 20)
+    exporter.close()
+    assert exported_rows(tmp_path) == 4
+    assert len(list(tmp_path.rglob('service=pds/*/*.parquet'))) == 2
@@ -0,0 +1,135 @@
+import json
+
+import pytest
+
+from log_filters import compile_filter, regex_literal, service_name
+from log_formatter import adjust_vars
+
+@pytest.mark.parametrize('pattern, literal', [
+    ('/xrpc/app.bsky', '/xrpc/app'),
+    ('timeout.*after', 'timeout'),
+    ('colou?r', 'colo'),
+    ('ab*cd', 'cd'),
+    ('ab+cd', 'ab'),
+    ('ab{2,10}', 'ab'),
+    ('ab{2}cd', 'ab'),
+    ('ab{0,3}cd', 'cd'),
+    ('abc{,2}', 'ab'),
+    ('x{a}yz', 'yz'),
+    (r'a\.bc', 'bc'),
+    ('[0-9]+ms', 'ms'),
+    ('^ok$', 'ok'),
+    ('err(or)?', None),
+    ('pds|bsky', None),
+    ('.*', None),
+])
+def test_regex_literal(pattern, literal):
+    assert regex_literal(pattern) == literal
+
+def test_service_name():
+    assert service_name('pds-1  ') == 'pds'
+    assert service_name('social-app-12') == 'social-app'
+    assert service_name(None) is None
+
+def test_compile_filter_empty():
+    assert compile_filter([]) is None
+
+def test_compile_filter_errors():
+    with pytest.raises(ValueError):
+        compile_filter(['level'])
+    with pytest.raises(ValueError):
+        compile_filter(['level>=warn'])
+    with pytest.raises(ValueError):
+        compile_filter(['msg~(unclosed'])
+
+def test_matches():
+    log_filter = compile_filter(['level>=40 service=pds', 'req_url~^/xrpc/'])
+    assert log_filter.matches('pds-1 ', {'level': 50, 'req_url': '/xrpc/com.atproto.sync.getRepo'})
+    assert not log_filter.matches('pds-1 ', {'level': 30, 'req_url': '/xrpc/com.atproto.sync.getRepo'})
+    assert not log_filter.matches('bsky-1 ', {'level': 50, 'req_url': '/xrpc/com.atproto.sync.getRepo'})
+    assert not log_filter.matches('pds-1 ', {'level': 50, 'req_url': '/health'})
+    assert not log_filter.matches('pds-1 ', None)
+
+def test_matches_equality():
+    log_filter = compile_filter(['res_statusCode=200', 'name!=xrpc'])
+    assert log_filter.matches('pds', {'res_statusCode': 200, 'name': 'pds'})
+    assert log_filter.matches('pds', {'res_statusCode': '200.0'})
+    assert not log_filter.matches('pds', {'res_statusCode': 200, 'name': 'xrpc'})
+
+def test_matches_json_values():
+    log_filter = compile_filter(['cached=true'])
+    assert log_filter.matches('pds', {'cached': True})
+    assert not log_filter.matches('pds', {'cached': False})
+    assert not log_filter.matches('pds', {'cached': 'True'})
+    assert compile_filter(['err=null']).matches('pds', {'err': None}) is False
+    assert compile_filter(['cached!=false']).matches('pds', {'cached': True})
+
+def test_lines_without_prefix_dropped():
+    assert not compile_filter(['level>=0']).matches(None, None)
+    assert not compile_filter(['service=pds']).matches(None, None)
+    assert compile_filter(['service!=pds']).matches(None, None)
+
+def test_matches_nested_field():
+    log_filter = compile_filter(['err.code=ECONNRESET'])
+    assert log_filter.matches('pds', {'err': {'code': 'ECONNRESET'}})
+    assert not log_filter.matches('pds', {'err': 'ECONNRESET'})
+
+# every filter is checked against every line: the prefilter may only reject lines that matches() rejects
+AGREEMENT_FILTERS = [
+    'level>=40',
+    'level=30',
+    'service=pds',
+    'service!=pds',
+    'msg=ok',
+    'msg!=ok',
+    'msg~abb{2,3}c',
+    'msg~ab{0,2}c',
+    'msg~colou?r',
+    r'msg~^done\sin\s[0-9]+ms$',
+    'msg!~colo',
+    'req_url~/xrpc/app',
+    'req_method=GET',
+    'res_statusCode>=500',
+    'err.code=ECONNRESET',
+    'hostname~pds{1,2}',
+    'cached=true',
+    'cached!=true',
+]
+
+AGREEMENT_RECORDS = [
+    {'level': 30, 'msg': 'ok'},
+    {'level': 50, 'msg': 'abbbc'},
+    {'level': 40, 'msg': 'ac'},
+    {'level': 30, 'msg': 'abbc'},
+    {'level': 30, 'msg': 'color'},
+    {'level': 30, 'msg': 'colour'},
+    {'level': 30, 'msg': 'done in 12ms'},
+    {'level': 30, 'msg': 'quote " and \\ backslash'},
+    {'level': 30, 'req': {'method': 'GET', 'url': '/xrpc/app.bsky.feed.getTimeline'}, 'res': {'statusCode': 200}},
+    {'level': 50, 'req': {'method': 'POST', 'url': '/xrpc/com.atproto.repo.createRecord'}, 'res': {'statusCode': 502}},
+    {'level': 50, 'err': {'code': 'ECONNRESET'}},
+    {'level': 30, 'hostname': 'pdss'},
+    {'level': 30, 'cached': True},
+    {'level': 30, 'cached': False},
+]
+
+def parse_record(line):
+    service_prefix, log_json = line.split('|', 1)
+    return service_prefix, adjust_vars(json.loads(log_json))
+
+@pytest.mark.parametrize('expression', AGREEMENT_FILTERS)
+def test_prefilter_agrees_with_matches(expression):
+    log_filter = compile_filter([expression])
+    for service in ('pds', 'bsky'):
+        for record in AGREEMENT_RECORDS:
+            line = f"{service}|{json.dumps(record)}"
+            matches = log_filter.matches(*parse_record(line))
+            if matches:
+                assert log_filter.prefilter(line), (expression, line)
+                assert log_filter.prefilter_bytes(line.encode('utf-8')), (expression, line)
+
+def test_prefilter_rejects_lines_without_field():
+    log_filter = compile_filter(['res_statusCode>=500'])
+    assert not log_filter.prefilter('pds|{"level":30,"msg":"ok"}')
+    assert not log_filter.prefilter_bytes(b'pds|{"level":30,"msg":"ok"}')
+    assert log_filter.prefilter('pds|{"res":{"statusCode":502}}')
@@ -0,0 +1,27 @@
+import json
+import os
+
+from log_formatter import PlainRenderer, extract_status_vars, read_line_batches
+
+def test_plain_renderer_writes_rest_of_record_as_json(capsys):
+    renderer = PlainRenderer()
+    log_obj = {'level': 30, 'msg': 'ok', 'cached': True, 'err': None, 'nested': {'n': 1}}
+    status_vars = extract_status_vars(log_obj)
+    renderer.record('pds', status_vars, log_obj)
+    renderer.flush()
+    prefix, rest = capsys.readouterr().out.rstrip('\n').split(' {', 1)
+    assert prefix == 'pds| level=30 msg=ok'
+    assert json.loads('{' + rest) == {'cached': True, 'err': None, 'nested': {'n': 1}}
+
+def test_read_line_batches_yields_empty_batch_when_idle():
+    read_fd, write_fd = os.pipe()
+    with os.fdopen(read_fd, 'rb') as reader:
+        batches = read_line_batches(reader, idle_timeout=0.01)
+        os.write(write_fd, b'pds|{"n":1}\npds|{"n"')
+        assert next(batches) == ['pds|{"n":1}\n']
+        # nothing more arrives: the caller still gets control back
+        assert next(batches) == []
+        os.write(write_fd, b':2}\n')
+        assert next(batches) == ['pds|{"n":2}\n']
+        os.close(write_fd)
+        assert list(batches) == []
@@ -0,0 +1,38 @@
+import os
+import subprocess
+import sys
+
+from log_formatter import chunk_boundaries
+
+LOG_FORMATTER = os.path.join(os.path.dirname(__file__), '..', 'log_formatter.py')
+
+def write_log(path, count):
+    with open(path, 'w') as f:
+        for n in range(count):
+            f.write(f'pds|{{"level":{30 if n % 3 else 50},"msg":"line {n}","n":{n}}}\n')
+        f.write('not a record\n')
+
+def format_log(*args, stdin=None):
+    return subprocess.run([sys.executable, LOG_FORMATTER, *args], stdin=stdin, capture_output=True, text=True, check=True).stdout
+
+def test_chunk_boundaries_end_at_lines(tmp_path):
+    path = tmp_path / 'saved.log'
+    write_log(path, 100)
+    boundaries = chunk_boundaries(str(path), 200)
+    assert len(boundaries) > 1
+    assert boundaries[0][0] == 0 and boundaries[-1][1] == path.stat().st_size
+    content = path.read_bytes()
+    for (start, end), (next_start, _) in zip(boundaries, boundaries[1:]):
+        assert end == next_start
+        assert content[end - 1:end] == b'\n'
+
+def test_replay_matches_sequential_output(tmp_path):
+    path = tmp_path / 'saved.log'
+    write_log(path, 500)
+    with open(path) as f:
+        expected = format_log(stdin=f)
+    # --chunk-size 0 gives chunks of a single line, so the order of many worker results is checked
+    assert format_log('--replay', str(path), '--chunk-size', '0', '-j', '3') == expected
+    with open(path) as f:
+        expected = format_log('-w', 'level>=50', stdin=f)
+    assert format_log('--replay', str(path), '--chunk-size', '0', '-j', '3', '-w', 'level>=50') == expected
@@ -0,0 +1,97 @@
+import io
+import math
+import random
+
+import pytest
+
+from log_stats import OTHER_ROUTE, LatencySketch, RequestStats, StatsReporter, normalize_route
+
+def exact_quantile(values, q):
+    """The value the sketch's rank q * (count - 1) points at"""
+    return sorted(values)[math.floor(q * (len(values) - 1))]
+
+@pytest.mark.parametrize('q', [0., 0.5, 0.9, 0.99, 1.])
+def test_sketch_quantile_within_relative_accuracy(q):
+    rng = random.Random(1)
+    values = [rng.lognormvariate(3, 1.5) for _ in range(20000)]
+    sketch = LatencySketch(relative_accuracy=0.01)
+    for value in values:
+        sketch.add(value)
+    expected = exact_quantile(values, q)
+    assert sketch.quantile(q) == pytest.approx(expected, rel=0.01)
+
+def test_sketch_empty_and_zero():
+    sketch = LatencySketch()
+    assert sketch.quantile(0.5) is None
+    sketch.add(0., count=3)
+    sketch.add(10.)
+    assert sketch.count == 4
+    assert sketch.quantile(0.5) == 0.
+    assert sketch.quantile(1.) == pytest.approx(10., rel=0.01)
+
+def test_sketch_quantile_capped_at_max():
+    sketch = LatencySketch()
+    sketch.add(100.)
+    assert sketch.quantile(0.99) <= 100.
+
+def test_sketch_merge_is_exact():
+    rng = random.Random(2)
+    values = [rng.expovariate(0.01) for _ in range(5000)]
+    whole, first, second = LatencySketch(), LatencySketch(), LatencySketch()
+    for i, value in enumerate(values):
+        whole.add(value)
+        (first if i % 2 else second).add(value)
+    first.merge(second)
+    assert first.count == whole.count
+    assert first.buckets == whole.buckets
+    assert first.max == whole.max
+    for q in (0.5, 0.9, 0.99):
+        assert first.quantile(q) == whole.quantile(q)
+
+def test_sketch_merge_needs_same_accuracy():
+    with pytest.raises(ValueError):
+        LatencySketch(0.01).merge(LatencySketch(0.02))
+
+def test_sketch_collapse_keeps_counts_and_high_quantiles():
+    sketch = LatencySketch(relative_accuracy=0.01, max_buckets=64)
+    values = [1.05 ** i for i in range(1000)]
+    for value in values:
+        sketch.add(value)
+    assert len(sketch.buckets) <= 64
+    assert sketch.count == len(values)
+    assert sum(sketch.buckets.values()) == len(values)
+    assert sketch.quantile(0.99) == pytest.approx(exact_quantile(values, 0.99), rel=0.01)
+
+def test_normalize_route():
+    assert normalize_route('/xrpc/app.bsky.feed.getTimeline?limit=50') == '/xrpc/app.bsky.feed.getTimeline'
+    assert normalize_route('/profile/did:plc:abc123/post/42') == '/profile/:id/post/:id'
+    assert normalize_route('/img/feed_thumbnail/plain/0123456789abcdef') == '/img/feed_thumbnail/plain/:id'
+
+def test_request_stats_routes_and_overflow():
+    stats = RequestStats(max_routes=2)
+    assert not stats.add('pds', {'msg': 'not a request'})
+    for route in ('/a', '/b', '/c', '/d'):
+        assert stats.add('pds', {'req_method': 'GET', 'req_url': route, 'res_statusCode': 200, 'responseTime': 5})
+    assert stats.routes[('pds', 'GET', '/a')].count == 1
+    assert stats.routes[('pds', 'GET', OTHER_ROUTE)].count == 2
+    stats.add('bsky', {'req_method': 'GET', 'req_url': '/a', 'res_statusCode': 503})
+    assert stats.routes[('bsky', 'GET', '/a')].status_class_counts() == {'5xx': 1}
+
+def test_request_stats_merge():
+    first, second = RequestStats(), RequestStats()
+    first.add('pds', {'req_method': 'GET', 'req_url': '/a', 'res_statusCode': 200, 'responseTime': 5})
+    second.add('pds', {'req_method': 'GET', 'req_url': '/a', 'res_statusCode': 404, 'responseTime': 50})
+    first.merge(second)
+    route = first.routes[('pds', 'GET', '/a')]
+    assert route.count == 2
+    assert route.status_counts == {200: 1, 404: 1}
+    assert route.latency.max == 50
+
+def test_reporter_snapshots_without_new_records():
+    out = io.StringIO()
+    reporter = StatsReporter(interval=0., out=out)
+    reporter.add('pds', {'req_method': 'GET', 'req_url': '/a', 'res_statusCode': 200, 'responseTime': 5})
+    # called for the empty batches that a quiet stream yields
+    reporter.maybe_snapshot()
+    assert '--- requests in the last' in out.getvalue()
+    assert reporter.totals.routes[('pds', 'GET', '/a')].count == 1
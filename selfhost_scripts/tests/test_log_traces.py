@@ -0,0 +1,85 @@
+import multiprocessing
+
+import pytest
+
+from log_traces import TraceIndex, parse_trace_arg, record_trace_id
+
+TRACE_ID = '4bf92f3577b34da6a3ce929d0e0e4736'
+
+def test_record_trace_id():
+    assert record_trace_id({'trace_id': TRACE_ID.upper()}) == TRACE_ID
+    assert record_trace_id({'traceId': 'a3ce929d0e0e4736'}) == '0000000000000000a3ce929d0e0e4736'
+    assert record_trace_id({'trace_id': '0' * 32}) is None
+    assert record_trace_id({'req': {'headers': {'traceparent': f'00-{TRACE_ID}-00f067aa0ba902b7-01'}}}) == TRACE_ID
+    assert record_trace_id({'req': f'{{"headers":{{"traceparent":"00-{TRACE_ID}-00f067aa0ba902b7-01"}}}}'}) == TRACE_ID
+    assert record_trace_id({'msg': 'no trace'}) is None
+
+def test_parse_trace_arg():
+    assert parse_trace_arg(TRACE_ID) == TRACE_ID
+    assert parse_trace_arg(' 4BF92F3 ') == '4bf92f3'
+    assert parse_trace_arg(f'http://localhost:16686/trace/{TRACE_ID}') == TRACE_ID
+    # 64 bit ids are stored padded, so they are looked up padded rather than as a prefix
+    assert parse_trace_arg('a3ce929d0e0e4736') == '0000000000000000a3ce929d0e0e4736'
+    assert parse_trace_arg('not a trace') is None
+
+@pytest.fixture
+def trace_index(tmp_path):
+    index = TraceIndex(tmp_path / 'traces.sqlite')
+    yield index
+    index.close()
+
+def test_find_full_and_short_ids(trace_index):
+    other = TRACE_ID[:7] + 'f' * 25
+    trace_index.add([(TRACE_ID, 'pds|{"a":1}\n'), (other, 'pds|{"b":2}\n'), ('1' * 32, 'bsky|{"c":3}\n')])
+    assert trace_index.find(TRACE_ID) == [TRACE_ID]
+    assert trace_index.find(TRACE_ID[:7]) == [TRACE_ID, other]
+    assert trace_index.find('2' * 7) == []
+
+def test_lines_in_indexed_order(trace_index):
+    trace_index.add([(TRACE_ID, 'pds|{"n":1}\n'), ('1' * 32, 'bsky|{"n":2}\n')])
+    trace_index.add([(TRACE_ID, 'bsky|{"n":3}\n')])
+    assert trace_index.lines(TRACE_ID) == ['pds|{"n":1}\n', 'bsky|{"n":3}\n']
+
+def test_64_bit_trace_id_lookup(trace_index):
+    trace_id = record_trace_id({'trace_id': 'a3ce929d0e0e4736'})
+    trace_index.add([(trace_id, 'pds|{"n":1}\n'), ('a3ce929d0e0e4736' + '1' * 16, 'pds|{"n":2}\n')])
+    assert trace_index.find(parse_trace_arg('a3ce929d0e0e4736')) == [trace_id]
+
+def test_rotation_keeps_recent_lines(tmp_path):
+    index = TraceIndex(tmp_path / 'traces.sqlite', max_bytes=200)
+    try:
+        for n in range(20):
+            index.add([(f"{n:032x}", f'pds|{{"n":{n:02d}}}\n')])
+        assert (tmp_path / 'traces.sqlite.lines.1').exists()
+        assert (tmp_path / 'traces.sqlite.lines').stat().st_size < 100
+        kept = [n for n in range(20) if index.find(f"{n:032x}")]
+        assert kept == list(range(kept[0], 20))
+        assert 0 < kept[0] < 20
+        for n in kept:
+            assert index.lines(f"{n:032x}") == [f'pds|{{"n":{n:02d}}}\n']
+    finally:
+        index.close()
+
+def add_lines(path, writer, count):
+    index = TraceIndex(path, max_bytes=4096)
+    for n in range(count):
+        index.add([(f"{writer:016x}{n:016x}", f'w{writer}|{{"n":{n}}}\n')])
+    index.close()
+
+def test_concurrent_writers(tmp_path):
+    path = tmp_path / 'traces.sqlite'
+    writers = [multiprocessing.Process(target=add_lines, args=(path, writer, 200)) for writer in (1, 2)]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+        assert writer.exitcode == 0
+    index = TraceIndex(path)
+    try:
+        for writer in (1, 2):
+            trace_ids = index.find(f"{writer:016x}")
+            assert trace_ids
+            for trace_id in trace_ids:
+                assert index.lines(trace_id) == [f'w{writer}|{{"n":{int(trace_id[16:], 16)}}}\n']
+    finally:
+        index.close()
@@ -0,0 +1,75 @@
+import importlib.util
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+spec = importlib.util.spec_from_file_location('manage_params_files', os.path.join(os.path.dirname(__file__), '..', '..', 'manage-params-files.py'))
+manage_params_files = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(manage_params_files)
+
+SOCIAL_ENV = Path('repos/social-app/.env')
+CADDY_ENV = Path('config/caddy-dynamic.env')
+
+@pytest.fixture(autouse=True)
+def work_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    Path('first.env').write_text('DOMAIN=first.example\n')
+    Path('second.env').write_text('DOMAIN=second.example\n')
+    return tmp_path
+
+def generate(content):
+    """Stand in for generate-env-files.sh, writing derived files after the current link was made"""
+    time.sleep(0.01)
+    for path in (SOCIAL_ENV, CADDY_ENV):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+
+def link(params_file, use_cache=True):
+    assert manage_params_files.create_env_link(params_file, Path('.env'), None, use_cache)
+
+def test_cache_is_opt_in():
+    link('first.env', use_cache=False)
+    generate('first')
+    link('second.env', use_cache=False)
+    assert not manage_params_files.DERIVED_CACHE_DIR.exists()
+    assert SOCIAL_ENV.read_text() == 'first'
+
+def test_switch_saves_and_restores():
+    link('first.env')
+    generate('first')
+    link('second.env')
+    # nothing cached for second.env yet: the files on disk are left alone
+    assert SOCIAL_ENV.read_text() == 'first'
+    generate('second')
+    link('first.env')
+    assert SOCIAL_ENV.read_text() == 'first'
+    assert CADDY_ENV.read_text() == 'first'
+    link('second.env')
+    assert SOCIAL_ENV.read_text() == 'second'
+
+def test_files_from_previous_target_are_not_cached():
+    link('first.env')
+    generate('first')
+    link('second.env')
+    # not regenerated for second.env, so switching away must not cache first.env's output for it
+    link('first.env')
+    assert not manage_params_files.get_derived_cache_path(None, 'second.env').exists()
+    link('second.env')
+    assert SOCIAL_ENV.read_text() == 'first'
+
+def test_edited_params_file_is_not_restored():
+    link('first.env')
+    generate('first')
+    link('second.env')
+    generate('second')
+    time.sleep(0.01)
+    Path('first.env').write_text('DOMAIN=edited.example\n')
+    link('first.env')
+    assert SOCIAL_ENV.read_text() == 'second'
+
+def test_env_content_not_derived():
+    paths = manage_params_files.get_derived_artifact_paths('production')
+    assert not [path for path in paths if path.name.startswith('env-content')]
+    assert Path('repos/social-app/google-services.production.json') in paths
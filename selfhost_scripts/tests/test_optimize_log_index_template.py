@@ -0,0 +1,68 @@
+import argparse
+import importlib.util
+import os
+
+spec = importlib.util.spec_from_file_location('optimize_log_index_template', os.path.join(os.path.dirname(__file__), '..', 'optimize-log-index-template.py'))
+optimize = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(optimize)
+
+BASE_TEMPLATE = {'index_patterns': ['logs-*'], 'template': {'settings': {'number_of_shards': 1}}, 'priority': 100}
+
+def make_args(**kwargs):
+    defaults = dict(max_keyword_cardinality=10, blob_length=64, min_frequency=0.01, strings_as_keywords=False)
+    return argparse.Namespace(**{**defaults, **kwargs})
+
+def profile(documents, args):
+    profiles = {}
+    for document in documents:
+        optimize.profile_document(profiles, document, args.max_keyword_cardinality + 1)
+    return profiles
+
+DOCUMENTS = [
+    {'msg': f'request {n}', 'level': 30, 'service_name': 'pds', 'route': f'/xrpc/{n % 3}', 'reqId': f'id-{n}',
+     'responseTime': n * 1.5, 'cached': n % 2 == 0, 'req': {'url': f'/xrpc/{n}', 'headers': {'host': 'pds'}}}
+    for n in range(100)
+]
+
+def build(hot_fields=(), **kwargs):
+    args = make_args(**kwargs)
+    profiles = profile(DOCUMENTS, args)
+    template, decisions = optimize.build_template(BASE_TEMPLATE, profiles, len(DOCUMENTS), set(hot_fields), args)
+    return template['template']['mappings'], {path: reason for path, _, _, reason in decisions}
+
+def test_default_keeps_text_and_keyword():
+    mappings, reasons = build()
+    properties = mappings['properties']
+    assert properties['msg']['fields']['keyword']['type'] == 'keyword'
+    assert properties['route'] == optimize.TEXT_WITH_KEYWORD
+    assert reasons['route'] == 'low cardinality'
+    assert properties['reqId'] == {'type': 'keyword', 'index': False, 'doc_values': False}
+    assert properties['req'] == {'type': 'object', 'enabled': False}
+    assert properties['cached'] == {'type': 'boolean'}
+    assert properties['responseTime'] == {'type': 'double', 'index': False}
+    assert 'dynamic_templates' not in mappings
+
+def test_strings_as_keywords_is_opt_in():
+    mappings, _ = build(strings_as_keywords=True)
+    assert mappings['properties']['route'] == {'type': 'keyword', 'ignore_above': optimize.KEYWORD_IGNORE_ABOVE}
+    assert mappings['properties']['msg']['fields']['keyword']['type'] == 'keyword'
+    assert mappings['dynamic_templates'][0]['strings_as_keywords']['mapping']['type'] == 'keyword'
+
+def test_hot_fields_stay_indexed():
+    mappings, reasons = build(hot_fields=['reqId'])
+    assert mappings['properties']['reqId'] == optimize.TEXT_WITH_KEYWORD
+    assert reasons['reqId'] == 'queried'
+
+def test_used_fields_match_exact_paths():
+    usage = '{"visState": "{\\"params\\":{\\"field\\":\\"route.keyword\\"}}", "query": "reqId:abc AND level:50"}'
+    fields = optimize.used_fields(usage)
+    assert {'route', 'reqId', 'level'} <= fields
+    # a field whose name is only a prefix of a used one is not used
+    assert 'req' not in fields and 'rout' not in fields
+
+def test_document_from_line():
+    assert optimize.document_from_line('pds | {"msg":"ok"}') == {'service_name': 'pds', 'msg': 'ok'}
+    entry = '{"log":"{\\"msg\\":\\"ok\\"}\\n","stream":"stdout","time":"2024-01-01T00:00:00Z"}'
+    document = optimize.document_from_line(entry)
+    assert document['msg'] == 'ok' and document['stream'] == 'stdout'
+    assert optimize.document_from_line('plain text') == {'log': 'plain text'}
@@ -0,0 +1,130 @@
+import argparse
+import datetime
+import importlib.util
+import os
+import sys
+
+import pytest
+
+spec = importlib.util.spec_from_file_location('plan_log_retention', os.path.join(os.path.dirname(__file__), '..', 'plan-log-retention.py'))
+plan_log_retention = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(plan_log_retention)
+
+TODAY = datetime.date(2024, 1, 15)
+MB = 1 << 20
+
+def samples(sizes, today=TODAY):
+    """One sample per day before today, the last one yesterday"""
+    return [(today - datetime.timedelta(days=len(sizes) - n), 1000 * (n + 1), size, 2 * size) for n, size in enumerate(sizes)]
+
+def plan_args(**kwargs):
+    defaults = {'long_prefix': [], 'long_days': 90, 'max_short_days': 30, 'min_short_days': 3, 'headroom': 1.}
+    return argparse.Namespace(**{**defaults, **kwargs})
+
+def test_sizes():
+    assert plan_log_retention.parse_size('500mb') == 500 * MB
+    assert plan_log_retention.parse_size('1.5 GB') == 1536 * MB
+    assert plan_log_retention.parse_size('42') == 42
+    with pytest.raises(argparse.ArgumentTypeError):
+        plan_log_retention.parse_size('lots')
+    assert plan_log_retention.format_size(1536 * MB) == '1.5gb'
+    assert plan_log_retention.format_size(10) == '10b'
+
+def test_fit_constant_growth():
+    fit = plan_log_retention.fit_daily_growth(samples([100 * MB] * 7), TODAY, 14)
+    assert fit['days'] == 7
+    assert fit['trend'] == 0
+    assert fit['projected_bytes'] == fit['mean_bytes'] == 100 * MB
+    assert fit['mean_docs'] == 4000
+
+def test_fit_projects_the_trend():
+    fit = plan_log_retention.fit_daily_growth(samples([10 * MB * n for n in range(1, 8)]), TODAY, 14)
+    assert fit['trend'] == pytest.approx(10 * MB)
+    # the next day continues the line
+    assert fit['projected_bytes'] == pytest.approx(80 * MB)
+
+def test_fit_shrinking_growth_keeps_recent_days():
+    fit = plan_log_retention.fit_daily_growth(samples([70 * MB, 60 * MB, 50 * MB, 40 * MB]), TODAY, 14)
+    assert fit['trend'] < 0
+    # a falling trend projects no lower than the mean of the last three days
+    assert fit['projected_bytes'] == pytest.approx(50 * MB)
+
+def test_fit_uses_only_recent_complete_days():
+    series = samples([1000 * MB] * 3 + [100 * MB] * 5) + [(TODAY, 1, 5000 * MB, 5000 * MB)]
+    fit = plan_log_retention.fit_daily_growth(series, TODAY, 5)
+    assert fit['days'] == 5 and fit['mean_bytes'] == 100 * MB
+
+def test_plan_fits_the_budget():
+    growth = {'logs': {'projected_bytes': 100 * MB}, 'logs-pds': {'projected_bytes': 10 * MB}}
+    plan = plan_log_retention.plan_retention(growth, 2000 * MB, 2, plan_args(long_prefix=['logs-pds'], long_days=10))
+    assert plan['short_prefixes'] == ['logs'] and plan['long_prefixes'] == ['logs-pds']
+    assert plan['short_daily'] == 200 * MB and plan['long_daily'] == 20 * MB
+    assert plan['long_days'] == 10
+    # (2000 - 10 * 20) / 200
+    assert plan['short_days'] == 9
+
+def test_plan_cuts_long_retention_for_min_short_days():
+    growth = {'logs': {'projected_bytes': 100 * MB}, 'logs-pds': {'projected_bytes': 10 * MB}}
+    plan = plan_log_retention.plan_retention(growth, 1000 * MB, 1, plan_args(long_prefix=['logs-pds']))
+    assert plan['short_days'] == 3
+    # (1000 - 3 * 100) / 10
+    assert plan['long_days'] == 70
+
+def test_plan_caps_short_days():
+    plan = plan_log_retention.plan_retention({'logs': {'projected_bytes': MB}}, 1000 * MB, 1, plan_args())
+    assert plan['short_days'] == 30 and plan['long_days'] == 0
+
+def test_make_policy():
+    policy = plan_log_retention.make_policy('short', 20, 5, ['logs-*'], plan_log_retention.SHORT_PRIORITY, 30 << 30)['policy']
+    assert [state['name'] for state in policy['states']] == ['hot', 'warm', 'delete']
+    assert policy['states'][0]['actions'] == [{'rollover': {'min_primary_shard_size': '30.0gb', 'min_index_age': '1d'}}]
+    assert policy['states'][0]['transitions'][0]['conditions'] == {'min_index_age': '5d'}
+    assert policy['states'][1]['transitions'][0]['conditions'] == {'min_index_age': '20d'}
+    assert policy['ism_template'] == [{'index_patterns': ['logs-*'], 'priority': 150}]
+    policy = plan_log_retention.make_policy('short', 5, None, [], plan_log_retention.SHORT_PRIORITY)['policy']
+    assert [state['name'] for state in policy['states']] == ['hot', 'delete']
+    assert 'ism_template' not in policy
+
+def test_covering_patterns():
+    assert plan_log_retention.covering_patterns(['logs-*', 'logs-pds-*'], 'logs-*') == ['logs-*']
+    assert plan_log_retention.covering_patterns(['logs-pds-*'], 'logs-*') == []
+    assert plan_log_retention.covering_patterns(['logs-*'], 'logs-2024.*') == ['logs-*']
+
+class FakeClient:
+    """Answers the planner's requests for fluent-bit's logs-YYYY.MM.DD indices"""
+    def __init__(self, url=None):
+        self.applied = []
+
+    def request(self, method, path, body=None, params=None):
+        if method == 'PUT':
+            self.applied.append(path)
+            return {}
+        if path.startswith('_cat/indices'):
+            days = [datetime.date.today() - datetime.timedelta(days=n) for n in range(1, 4)]
+            return [{'index': f"logs-{day.strftime('%Y.%m.%d')}", 'docs.count': '1000', 'pri.store.size': str(100 * MB),
+                     'store.size': str(100 * MB)} for day in days]
+        if path == '_cat/allocation':
+            return [{'disk.total': str(100 << 30)}]
+        if path.endswith('_settings/index.number_of_replicas'):
+            return {'logs-x': {'settings': {'index': {'number_of_replicas': '0'}}}}
+        raise plan_log_retention.OpenSearchError(404, 'not found')
+
+@pytest.fixture
+def client(monkeypatch):
+    client = FakeClient()
+    monkeypatch.setattr(plan_log_retention, 'OpenSearchClient', lambda url: client)
+    return client
+
+def run(monkeypatch, *args):
+    monkeypatch.setattr(sys, 'argv', ['plan-log-retention.py', *args])
+    plan_log_retention.main()
+
+def test_apply_refuses_to_take_over_every_index(client, monkeypatch, capsys):
+    with pytest.raises(SystemExit):
+        run(monkeypatch, '--apply')
+    assert 'covers all of logs-*' in capsys.readouterr().err
+    assert client.applied == []
+
+def test_apply_takes_over_when_asked(client, monkeypatch):
+    run(monkeypatch, '--apply', '--replace-deployed-policy')
+    assert client.applied == ['_plugins/_ism/policies/logs-planned-short-policy']
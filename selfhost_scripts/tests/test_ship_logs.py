@@ -0,0 +1,179 @@
+import collections
+import datetime
+import importlib.util
+import json
+import os
+import sys
+
+import pytest
+
+spec = importlib.util.spec_from_file_location('ship_logs', os.path.join(os.path.dirname(__file__), '..', 'ship-logs-to-opensearch.py'))
+ship_logs = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(ship_logs)
+
+from docker_logs import DockerLogTailer
+
+def utc(*args):
+    return datetime.datetime(*args, tzinfo=datetime.timezone.utc)
+
+def add_container(containers_dir, container_id, service, entries):
+    container_dir = containers_dir / container_id
+    container_dir.mkdir(parents=True)
+    config = {'Name': f'/bsky_{service}.1.xyz', 'Config': {'Labels': {'com.docker.compose.service': service}}}
+    (container_dir / 'config.v2.json').write_text(json.dumps(config))
+    log_file = container_dir / f'{container_id}-json.log'
+    with log_file.open('w') as f:
+        for time_text, message in entries:
+            f.write(json.dumps({'log': message, 'stream': 'stdout', 'time': time_text}) + '\n')
+    return log_file
+
+def read_documents(tmp_path, time_range=None):
+    tailer = DockerLogTailer(str(tmp_path / 'containers'), str(tmp_path / 'offsets.json'), from_start=True)
+    return [document for documents, _ in ship_logs.docker_source(tailer, time_range or ship_logs.TimeRange()) for document in documents]
+
+def test_docker_documents(tmp_path):
+    log_file = add_container(tmp_path / 'containers', 'a' * 64, 'pds', [
+        ('2024-05-01T23:59:59.123456789Z', '{"level":30,"msg":"hello"}\n'),
+        ('2024-05-02T00:00:00.5Z', 'plain text\n')])
+    (index, doc_id, document), (next_index, next_id, plain) = read_documents(tmp_path)
+    assert index == 'logs-2024.05.01' and next_index == 'logs-2024.05.02'
+    assert document['msg'] == 'hello' and document['level'] == 30
+    assert document['@timestamp'] == '2024-05-01T23:59:59.123Z'
+    assert document['container_id'] == 'a' * 12 and document['filepath'] == str(log_file)
+    assert document['service_name'] == 'pds'
+    assert plain['log'] == 'plain text\n' and plain['@timestamp'] == '2024-05-02T00:00:00.500Z'
+    assert doc_id != next_id
+
+def test_document_ids_are_stable(tmp_path):
+    add_container(tmp_path / 'containers', 'a' * 64, 'pds', [('2024-05-01T00:00:00Z', '{"n":1}\n')])
+    first = read_documents(tmp_path)
+    os.remove(tmp_path / 'offsets.json')
+    assert read_documents(tmp_path) == first
+    assert ship_logs.document_id('a', 1) == ship_logs.document_id('a', '1') != ship_logs.document_id('a', 2)
+
+def test_time_range(tmp_path):
+    add_container(tmp_path / 'containers', 'a' * 64, 'pds', [
+        ('2024-05-01T00:59:59Z', '{"n":1}\n'), ('2024-05-01T01:00:00Z', '{"n":2}\n'), ('2024-05-01T02:00:00Z', '{"n":3}\n')])
+    time_range = ship_logs.TimeRange(utc(2024, 5, 1, 1), utc(2024, 5, 1, 2))
+    assert [document['n'] for _, _, document in read_documents(tmp_path, time_range)] == [2]
+    assert time_range.contains_epoch(utc(2024, 5, 1, 1).timestamp())
+    assert not time_range.contains_epoch(utc(2024, 5, 1, 2).timestamp())
+    assert time_range.query() == {'range': {'@timestamp': {'gte': '2024-05-01T01:00:00Z', 'lt': '2024-05-01T02:00:00Z'}}}
+
+class FakeClient:
+    """Answers _bulk requests with the given statuses, one list per request, and _count with count"""
+    def __init__(self, *responses, count=0):
+        self.responses = list(responses)
+        self.count = count
+        self.requests = []
+
+    def request(self, method, path, body=None, params=None, headers=None, raw_body=None):
+        if path.endswith('_count'):
+            self.requests.append(body)
+            return {'count': self.count}
+        lines = ship_logs.gzip.decompress(raw_body).splitlines() if headers.get('Content-Encoding') else raw_body.splitlines()
+        self.requests.append([json.loads(line)['create']['_id'] for line in lines[::2]])
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return {'items': [{'create': {'status': status}} for status in response]}
+
+def actions(count):
+    return [ship_logs.action_lines('logs-2024.05.01', str(n), {'n': n}) for n in range(count)]
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(ship_logs.time, 'sleep', lambda seconds: None)
+
+def test_send_counts_results_and_retries_rejected(monkeypatch):
+    client = FakeClient([201, 409, 429, 400], [201])
+    shipper = ship_logs.BulkShipper(client, connections=1)
+    stats = shipper.send(actions(4))
+    shipper.close()
+    assert client.requests == [['0', '1', '2', '3'], ['2']]
+    assert (stats['created'], stats['existing'], stats['failed'], stats['requests']) == (2, 1, 1, 2)
+
+def test_send_splits_too_large_requests():
+    client = FakeClient(ship_logs.OpenSearchError(413, 'too large'), [201, 201], [201, 201])
+    shipper = ship_logs.BulkShipper(client, connections=1, compress=False)
+    assert shipper.send(actions(4))['created'] == 4
+    shipper.close()
+    assert client.requests == [['0', '1', '2', '3'], ['0', '1'], ['2', '3']]
+
+def test_send_gives_up_after_retries():
+    client = FakeClient(*[ship_logs.OpenSearchError(503, 'unavailable')] * 3)
+    shipper = ship_logs.BulkShipper(client, connections=1, retries=2)
+    with pytest.raises(ship_logs.OpenSearchError):
+        shipper.send(actions(1))
+    shipper.close()
+
+def test_batch_size_adapts():
+    shipper = ship_logs.BulkShipper(FakeClient(), target_latency=2., min_batch=1 << 20, max_batch=8 << 20, initial_batch=4 << 20)
+    shipper.adapt(latency=8.)
+    assert shipper.batch_bytes == 2 << 20
+    shipper.adapt(latency=0.01)
+    assert shipper.batch_bytes == 3 << 20
+    for _ in range(10):
+        shipper.adapt(throttled=True)
+    assert shipper.batch_bytes == 1 << 20
+    shipper.close()
+
+class RecordingShipper:
+    """Delivers every batch at once, keeping the ids of each"""
+    def __init__(self, batch_bytes):
+        self.batch_bytes = batch_bytes
+        self.connections = 1
+        self.stats = collections.Counter()
+        self.batches = []
+
+    def submit(self, batch):
+        self.batches.append([json.loads(action)['create']['_id'] for action, _ in batch])
+        future = ship_logs.concurrent.futures.Future()
+        future.set_result(collections.Counter(created=len(batch)))
+        return future
+
+def test_ship_batches_and_checkpoints():
+    source = [([('logs-2024.05.01', f"{read}-{n}", {'n': n}) for n in range(3)], {'file': {'offset': read}}) for read in range(4)]
+    size = sum(map(len, ship_logs.action_lines(*source[0][0][0])))
+    shipper = RecordingShipper(batch_bytes=size * 5)
+    offsets, saved = {}, []
+    ship_logs.ship(iter(source), shipper, offsets, lambda: saved.append(dict(offsets)))
+    # batches end after the read that took them past batch_bytes
+    assert [len(batch) for batch in shipper.batches] == [6, 6]
+    assert shipper.stats['created'] == 12
+    assert offsets == {'file': {'offset': 3}}
+    assert saved[-1] == offsets
+
+def test_ship_saves_only_delivered_checkpoints():
+    source = [([('logs-2024.05.01', '0', {'n': 0})], {'file': {'offset': 0}})]
+    class FailingShipper(RecordingShipper):
+        def submit(self, batch):
+            future = ship_logs.concurrent.futures.Future()
+            future.set_exception(ship_logs.OpenSearchError(400, 'bad'))
+            return future
+    offsets, saved = {}, []
+    with pytest.raises(ship_logs.OpenSearchError):
+        ship_logs.ship(iter(source), FailingShipper(0), offsets, lambda: saved.append(dict(offsets)))
+    assert offsets == {} and saved == [{}]
+
+def run(monkeypatch, tmp_path, client, *args):
+    monkeypatch.setattr(ship_logs, 'OpenSearchClient', lambda url, timeout: client)
+    monkeypatch.setattr(sys, 'argv', ['ship-logs-to-opensearch.py', '--docker-logs', str(tmp_path / 'containers'),
+                                      '--checkpoint', str(tmp_path / 'offsets.json'), *args])
+    ship_logs.main()
+
+def test_docker_logs_need_a_window(monkeypatch, tmp_path, capsys):
+    with pytest.raises(SystemExit):
+        run(monkeypatch, tmp_path, FakeClient(), '--since', '6h')
+    assert '--since and --until' in capsys.readouterr().err
+
+def test_refuses_to_ship_over_delivered_documents(monkeypatch, tmp_path, capsys):
+    add_container(tmp_path / 'containers', 'a' * 64, 'pds', [('2024-05-01T01:30:00Z', '{"n":1}\n')])
+    client = FakeClient([201], count=5)
+    window = ['--since', '2024-05-01T01:00', '--until', '2024-05-01T02:00']
+    with pytest.raises(SystemExit):
+        run(monkeypatch, tmp_path, client, *window)
+    assert 'already has 5 documents' in capsys.readouterr().err
+    assert client.requests[0]['query']['range']['@timestamp'] == {'gte': '2024-05-01T01:00:00Z', 'lt': '2024-05-01T02:00:00Z'}
+    run(monkeypatch, tmp_path, client, *window, '--allow-overlap')
+    assert len(client.requests[-1]) == 1
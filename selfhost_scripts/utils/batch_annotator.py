@@ -43,6 +43,8 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('-n', '--dry-run', action='store_true', help="Create the telemetry but don't export them to opentelemetry")
     parser.add_argument('csv_file', help="The CSV file containing traces and annotations")
+    add_endpoint_arguments(parser)
     args = parser.parse_args()
+    configure(args.jaeger_url, args.otlp_endpoint)
     process_csv_annotations(args.csv_file, args.dry_run)
 
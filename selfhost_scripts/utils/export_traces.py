@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 from jaeger_annotation import *
+import jaeger_annotation
 import csv
 import copy
 import datetime
@@ -13,6 +14,7 @@ def query_traces(start_time_min, start_time_max):
     start_time_min = start_time_min.isoformat() + '.000000000Z'
     start_time_max = start_time_max.isoformat() + '.000000000Z'
     traces = {}
+    jaeger_client = get_jaeger_client()
     for service_name in jaeger_client.QueryService_GetServices().json().get('services', []):
         query = {'query.service_name': service_name, 'query.start_time_min': start_time_min, 'query.start_time_max': start_time_max}
         response = jaeger_client.QueryService_FindTraces(**query)
@@ -117,7 +119,7 @@ def format_csv(f, traces, op_name=None, annotator_batch=None):
         end_time_nano = parse_unix_nano_time(end_time_str)
         end_time = format_date_csv(end_time_nano)
         duration = (end_time_nano - start_time_nano)/1000
-        trace_link = f'=HYPERLINK("http://localhost:16686/trace/{trace_id}", "{trace_id}")'
+        trace_link = f'=HYPERLINK("{jaeger_annotation.jaeger_url}/trace/{trace_id}", "{trace_id}")'
         row = {'trace_id': trace_link, 'start_time': start_time, 'end_time': end_time, 'duration': duration, 'trace_operation_name': op_name, 'annotator.batch': annotator_batch}
         span_counts = sorted(trace.get('span_counts', {}).items())
         error_counts = sorted(trace.get('error_counts', {}).items())
@@ -152,7 +154,9 @@ if __name__ == '__main__':
     parser.add_argument('start_time_min', help="The start time to search from")
     parser.add_argument('start_time_max', help="The start time to search to")
     parser.add_argument('attrs', nargs='*', help="Additional attributes in the form attr=value to limit the scope by")
+    add_endpoint_arguments(parser)
     args = parser.parse_args()
+    configure(args.jaeger_url, args.otlp_endpoint)
     attributes = {}
     for attr_def in args.attrs:
         attr_match = FILTER_RE.match(attr_def)
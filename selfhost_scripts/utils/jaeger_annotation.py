@@ -1,16 +1,17 @@
 #!/usr/bin/env python
 
-import requests_openapi as roa
-from opentelemetry import trace
-from opentelemetry.sdk.resources import SERVICE_NAME, Resource
-from opentelemetry.sdk.trace import TracerProvider, _Span
-from opentelemetry.sdk.trace.export import BatchSpanProcessor
-from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+# requests_openapi and opentelemetry are imported when the clients are first used, so that
+# loading this module (and running --dry-run or CSV work that doesn't need them) stays quick
 import copy
 import datetime
 import json
 import logging
 import os.path
+import re
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))  # for shared modules in selfhost_scripts
+from env_utils import get_cache_path
 
 def id2int(hex_id):
     return int(hex_id, 16) if hex_id else None
@@ -20,23 +21,68 @@ ANNOTATOR_NAME = 'brightsun.trace_annotator'
 
 __script_dir = os.path.dirname(os.path.abspath(__file__))
 
+# the Jaeger query API/UI, and the OTLP/HTTP traces endpoint that annotations are exported to
+jaeger_url = os.environ.get('JAEGER_URL', 'http://localhost:16686').rstrip('/')
+otlp_endpoint = os.environ.get('OTEL_EXPORTER_OTLP_TRACES_ENDPOINT', 'http://localhost:4318/v1/traces')
+
+_jaeger_client = None
+_tracer = None
+_exporter = None
+
+def configure(jaeger=None, otlp=None):
+    """Set the endpoints (before the clients are first used), overriding $JAEGER_URL and $OTEL_EXPORTER_OTLP_TRACES_ENDPOINT"""
+    global jaeger_url, otlp_endpoint
+    if jaeger:
+        jaeger_url = jaeger.rstrip('/')
+    if otlp:
+        otlp_endpoint = otlp
+
+def add_endpoint_arguments(parser):
+    parser.add_argument('--jaeger-url', help=f"Jaeger query URL (default: $JAEGER_URL, or {jaeger_url})")
+    parser.add_argument('--otlp-endpoint', help=f"OTLP/HTTP traces endpoint to export annotations to (default: $OTEL_EXPORTER_OTLP_TRACES_ENDPOINT, or {otlp_endpoint})")
+
 def open_jaeger_client():
+    import requests_openapi as roa
     client = roa.Client().load_spec_from_file(os.path.join(__script_dir, "jaeger-api-v3-openapi3.json"))
-    client.set_server(roa.Server(url="http://localhost:16686"))
+    client.set_server(roa.Server(url=jaeger_url))
     return client
 
+def get_jaeger_client():
+    global _jaeger_client
+    if _jaeger_client is None:
+        _jaeger_client = open_jaeger_client()
+    return _jaeger_client
+
 def setup_otlp_client():
+    """Make the tracer that annotation spans are created with; they are exported explicitly, so it has no span processor"""
+    from opentelemetry.sdk.resources import SERVICE_NAME, Resource
+    from opentelemetry.sdk.trace import TracerProvider
     resource = Resource.create(attributes={SERVICE_NAME: SERVICE_NAME_STR})
     provider = TracerProvider(resource=resource)
-    exporter = OTLPSpanExporter(endpoint="http://localhost:4318/v1/traces",)
-    processor = BatchSpanProcessor(exporter)
-    provider.add_span_processor(processor)
-    tracer = provider.get_tracer(ANNOTATOR_NAME)
-    return tracer, exporter
+    return provider.get_tracer(ANNOTATOR_NAME)
 
-jaeger_client = open_jaeger_client()
+def get_tracer():
+    global _tracer
+    if _tracer is None:
+        _tracer = setup_otlp_client()
+    return _tracer
 
-tracer, exporter = setup_otlp_client()
+def get_exporter():
+    global _exporter
+    if _exporter is None:
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        _exporter = OTLPSpanExporter(endpoint=otlp_endpoint)
+    return _exporter
+
+def __getattr__(name):
+    # jaeger_annotation.jaeger_client, .tracer and .exporter are created on first access
+    if name == 'jaeger_client':
+        return get_jaeger_client()
+    if name == 'tracer':
+        return get_tracer()
+    if name == 'exporter':
+        return get_exporter()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def get_span_attribute(span, attr):
     """This searches through the nested structure for an attribute matching this name
@@ -64,7 +110,7 @@ def collapse_attributes(attributes):
     return new_attributes
 
 def get_trace_spans(src_trace_id):
-    src_trace = jaeger_client.QueryService_GetTrace(trace_id=src_trace_id)
+    src_trace = get_jaeger_client().QueryService_GetTrace(trace_id=src_trace_id)
     src_spans = []
     for resource_span in src_trace.json().get('result', {}).get('resourceSpans', []):
         resource = copy.deepcopy(resource_span.get('resource', {}))
@@ -79,39 +125,137 @@ def get_trace_spans(src_trace_id):
     src_spans.sort(key=lambda span: get_span_attributes(span, 'startTimeUnixNano', 'startTime'))
     return src_spans
 
-default_trace_flags = trace.span.TraceFlags.get_default()
-default_trace_state = trace.span.TraceState.get_default()
-
 def make_span_context(trace_id, span_id):
-    return trace.SpanContext(trace_id=trace_id, span_id=span_id, is_remote=True, trace_flags=default_trace_flags, trace_state=default_trace_state)
-
-short_trace_id_map = {}
+    from opentelemetry import trace
+    return trace.SpanContext(trace_id=trace_id, span_id=span_id, is_remote=True,
+                             trace_flags=trace.span.TraceFlags.get_default(), trace_state=trace.span.TraceState.get_default())
 
+# the short trace id index is a SQLite table of full trace ids and start times, filled from Jaeger incrementally
+TRACE_ID_DB_FILENAME = os.environ.get('JAEGER_TRACE_ID_DB') or str(get_cache_path('jaeger-trace-ids.sqlite'))
+# the map the index replaces; its trace ids are imported when the index is created
 SHORT_TRACE_ID_FILENAME = 'jaeger-short-trace-ids.json'
-if os.path.exists(SHORT_TRACE_ID_FILENAME):
-    with open(SHORT_TRACE_ID_FILENAME, 'r') as f:
-        short_trace_id_map.update(json.load(f))
+# each refresh searches again from this long before the last one, for spans that reach Jaeger late
+INDEX_OVERLAP = datetime.timedelta(minutes=5)
+# traces per search; a window that returns this many is split in two, so no trace is left out
+SEARCH_DEPTH = 1000
+
+class JaegerQueryError(Exception):
+    def __init__(self, status, message):
+        super().__init__(f"Jaeger query failed ({status}): {message}")
+        self.status = status
+
+def format_query_time(d):
+    return d.astimezone(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f') + '000Z'
+
+class TraceIdIndex:
+    """Full trace ids by start time, looked up by prefix, with the time up to which each service has been indexed"""
+    def __init__(self, path=TRACE_ID_DB_FILENAME):
+        import sqlite3
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path)
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS trace_ids (trace_id BLOB PRIMARY KEY, start_time INTEGER) WITHOUT ROWID')
+            self.db.execute('CREATE TABLE IF NOT EXISTS indexed_services (service_name TEXT PRIMARY KEY, indexed_until INTEGER)')
+            if self.db.execute('SELECT COUNT(*) FROM trace_ids').fetchone()[0] == 0 and os.path.exists(SHORT_TRACE_ID_FILENAME):
+                with open(SHORT_TRACE_ID_FILENAME, 'r') as f:
+                    self.add({trace_id: None for trace_ids in json.load(f).values() for trace_id in trace_ids})
+
+    def add(self, traces):
+        """Add {trace_id: start time in ns} (in the caller's transaction)"""
+        self.db.executemany('INSERT INTO trace_ids VALUES (?, ?) ON CONFLICT (trace_id) DO UPDATE SET '
+                            'start_time = COALESCE(MIN(start_time, excluded.start_time), start_time, excluded.start_time)',
+                            [(bytes.fromhex(trace_id), start_time) for trace_id, start_time in traces.items()])
+
+    def find(self, prefix):
+        """Get the trace ids starting with prefix, most recent first; a range scan of the primary key"""
+        if not re.fullmatch(r'[0-9a-fA-F]{1,32}', prefix):
+            raise ValueError(f"{prefix!r} is not a trace id: expected up to 32 hex digits")
+        prefix = prefix.lower()
+        low, high = bytes.fromhex(prefix.ljust(32, '0')), bytes.fromhex(prefix.ljust(32, 'f'))
+        rows = self.db.execute('SELECT trace_id FROM trace_ids WHERE trace_id BETWEEN ? AND ? ORDER BY start_time DESC', (low, high))
+        return [trace_id.hex() for (trace_id,) in rows]
+
+    def indexed_until(self, service_name):
+        row = self.db.execute('SELECT indexed_until FROM indexed_services WHERE service_name = ?', (service_name,)).fetchone()
+        return datetime.datetime.fromtimestamp(row[0] / 1e9, datetime.timezone.utc) if row else None
+
+    def refresh(self, jaeger_client, days=7, now=None):
+        """
+        Index the traces each service started since it was last indexed (or in the last `days` days).
+        A service whose search fails is skipped, and searched from the same time on the next refresh;
+        raises JaegerQueryError if the services can't be listed or every search failed.
+        """
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        response = jaeger_client.QueryService_GetServices()
+        if response.status_code != 200:
+            raise JaegerQueryError(response.status_code, response.text)
+        services = response.json().get('services', [])
+        error, indexed = None, 0
+        for service_name in services:
+            since = now - datetime.timedelta(days=days)
+            indexed_until = self.indexed_until(service_name)
+            if indexed_until is not None:
+                since = max(since, indexed_until - INDEX_OVERLAP)
+            try:
+                traces = find_trace_starts(jaeger_client, service_name, since, now)
+            except JaegerQueryError as e:
+                logging.warning(f"Could not index the traces of {service_name}: {e}")
+                error = e
+                continue
+            logging.info(f"Indexed {len(traces)} traces for {service_name} since {since.isoformat()}")
+            with self.db:
+                self.add(traces)
+                self.db.execute('INSERT OR REPLACE INTO indexed_services VALUES (?, ?)', (service_name, int(now.timestamp() * 1e9)))
+            indexed += 1
+        if error is not None and not indexed:
+            raise error
+
+def find_trace_starts(jaeger_client, service_name, start_time_min, start_time_max):
+    """
+    Get {trace_id: start time in ns} for the traces of a service that started in the window, splitting it as needed;
+    raises JaegerQueryError if Jaeger doesn't answer the search (it answers 404 when there are no traces)
+    """
+    query = {'query.service_name': service_name, 'query.start_time_min': format_query_time(start_time_min),
+             'query.start_time_max': format_query_time(start_time_max), 'query.search_depth': SEARCH_DEPTH}
+    # the API has no way to search for just the ids, so this returns the full traces
+    response = jaeger_client.QueryService_FindTraces(**query)
+    if response.status_code == 404:
+        return {}
+    if response.status_code != 200:
+        raise JaegerQueryError(response.status_code, response.text)
+    traces = {}
+    for resource_span in response.json().get('result', {}).get('resourceSpans', []):
+        for scope_span in resource_span.get('scopeSpans', []):
+            for span in scope_span.get('spans', []):
+                trace_id = span.get('traceId')
+                start_time = int(span.get('startTimeUnixNano') or 0) or None
+                if trace_id not in traces or (start_time and (traces[trace_id] is None or start_time < traces[trace_id])):
+                    traces[trace_id] = start_time
+    if len(traces) >= SEARCH_DEPTH and start_time_max - start_time_min > datetime.timedelta(seconds=1):
+        middle = start_time_min + (start_time_max - start_time_min) / 2
+        traces = find_trace_starts(jaeger_client, service_name, start_time_min, middle)
+        traces.update(find_trace_starts(jaeger_client, service_name, middle, start_time_max))
+    return traces
+
+_trace_id_index = None
+
+def get_trace_id_index():
+    global _trace_id_index
+    if _trace_id_index is None:
+        _trace_id_index = TraceIdIndex()
+    return _trace_id_index
 
 def find_trace_id(short_trace_id, days=7):
-    if short_trace_id in short_trace_id_map:
-        return short_trace_id_map[short_trace_id][0]
-    start_time_min = (datetime.datetime.now() - datetime.timedelta(days=days)).isoformat() + '000Z'
-    start_time_max = (datetime.datetime.now() + datetime.timedelta(days=0)).isoformat() + '000Z'
-    found_trace_id = None
-    for service_name in jaeger_client.QueryService_GetServices().json().get('services', []):
-        query = {'query.service_name': service_name, 'query.start_time_min': start_time_min, 'query.start_time_max': start_time_max}
-        # this is wasteful and returns the full traces
-        traces = jaeger_client.QueryService_FindTraces(**query).json()
-        for resource_span in traces.get('result', {}).get('resourceSpans', []):
-            for scope_span in resource_span.get('scopeSpans', []):
-                for span in scope_span.get('spans', []):
-                    trace_id = span.get('traceId')
-                    short_trace_id_map.setdefault(trace_id[:7], []).extend([trace_id])
-                    if trace_id[:7] == short_trace_id:
-                        found_trace_id = trace_id
-    with open(SHORT_TRACE_ID_FILENAME, 'w') as f:
-        json.dump(short_trace_id_map, f)
-    return found_trace_id
+    """Get the full trace id for a short trace id, bringing the index up to date from Jaeger if it isn't known yet"""
+    index = get_trace_id_index()
+    found = index.find(short_trace_id)
+    if not found:
+        index.refresh(get_jaeger_client(), days)
+        found = index.find(short_trace_id)
+    if len(found) > 1:
+        logging.warning(f"{len(found)} traces start with {short_trace_id}, using the most recent: {', '.join(found)}")
+    return found[0] if found else None
 
 def parse_unix_nano_time(ds):
     return datetime.datetime.fromtimestamp(int(ds)/1000000000) if ds else None
@@ -130,13 +274,16 @@ def add_span_to_trace(src_trace_id, name, attributes, dry_run=False):
         if src_trace_id:
             logging.info(f"Found {src_trace_id} for {short_trace_id}")
         else:
-            raise ValueError("Could not find full trace id for {short_trace_id} (searched 7 days)")
+            raise ValueError(f"Could not find full trace id for {short_trace_id} (searched 7 days)")
     src_spans = get_trace_spans(src_trace_id)
     parent_span = src_spans[0]
     parent_span_id = parent_span.get('spanId')
     existing_annotations = filter_annotations(src_spans)
     if existing_annotations:
         logging.info(f"Trace {src_trace_id} already has {len(existing_annotations)} annotations")
+    from opentelemetry import trace
+    from opentelemetry.sdk.trace import _Span
+    tracer = get_tracer()
     src_trace_id_int = id2int(src_trace_id)
     this_id = tracer.id_generator.generate_span_id()
     parent_context = make_span_context(src_trace_id_int, id2int(parent_span_id))
@@ -154,5 +301,5 @@ def add_span_to_trace(src_trace_id, name, attributes, dry_run=False):
         logging.info(f"Span {src_trace_id}/{this_id:x} created, not exporting: {SERVICE_NAME_STR}/{name} {attributes}")
     else:
         logging.info(f"Exporting span {src_trace_id}/{this_id:x}: {SERVICE_NAME_STR}/{name} {attributes}")
-        exporter.export([span])
+        get_exporter().export([span])
 
@@ -12,7 +12,9 @@ if __name__ == '__main__':
     parser.add_argument('trace_id', help="The hex ID of the trace to be annotated")
     parser.add_argument('operation_name', help="The name to attach to this span (appears in jaeger next to annotator)")
     parser.add_argument('attrs', nargs='*', help="Additional attributes in the form attr=value")
+    add_endpoint_arguments(parser)
     args = parser.parse_args()
+    configure(args.jaeger_url, args.otlp_endpoint)
     attributes = {'annotator.date': datetime.datetime.now().isoformat()+'000Z'}
     for attr_def in args.attrs:
         if '=' not in attr_def: